@@ -0,0 +1,137 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+
+class AnswerCache:
+    def __init__(self, threshold: float, ttl: float, max_entries: int, search_k: int = 4):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.search_k = search_k
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        # One index per namespace, so a lookup only searches entries it may return.
+        # They are created on insert, with the dimension of the embedding provider in use.
+        self._indexes = {}
+        self._dimension = None
+        self._entries = {}
+        self._next_id = 0
+        self._index_version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        return np.ascontiguousarray(embedding / np.linalg.norm(embedding))
+
+    def _sync_version(self, index_version: Optional[str]):
+        # Answers are only valid for the index they were generated from.
+        if index_version != self._index_version:
+            if self._entries:
+                self.invalidations += 1
+            self._reset()
+            self._index_version = index_version
+
+    def _reset(self, dimension: Optional[int] = None):
+        self._indexes = {}
+        self._entries = {}
+        if dimension is not None:
+            self._dimension = dimension
+
+    def _remove(self, entry_ids: List[int]):
+        by_namespace = {}
+        for entry_id in entry_ids:
+            by_namespace.setdefault(self._entries.pop(entry_id)['namespace'], []).append(entry_id)
+        for namespace, ids in by_namespace.items():
+            index = self._indexes[namespace]
+            index.remove_ids(np.array(ids, dtype=np.int64))
+            if not index.ntotal:
+                del self._indexes[namespace]
+
+    def lookup(self, embedding: np.ndarray, namespace: str = "",
+               index_version: Optional[str] = None) -> Optional[Dict]:
+        query = self._normalize(embedding)
+
+        with self._lock:
+            self._sync_version(index_version)
+            index = self._indexes.get(namespace)
+            if index is None or self._dimension != query.shape[1]:
+                self.misses += 1
+                return None
+
+            scores, entry_ids = index.search(query, min(self.search_k, index.ntotal))
+            now = time.time()
+            expired, match = [], None
+            for score, entry_id in zip(scores[0].tolist(), entry_ids[0].tolist()):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                entry = self._entries[entry_id]
+                if now - entry['created'] > self.ttl:
+                    expired.append(entry_id)
+                elif match is None:
+                    match = dict(entry, similarity=score)
+
+            self.expired += len(expired)
+            self._remove(expired)
+
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return match
+
+    def put(self, embedding: np.ndarray, query: str, answer: str, sources: List[Dict],
+            namespace: str = "", index_version: Optional[str] = None):
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            self._sync_version(index_version)
+            if self._dimension != vector.shape[1]:
+                self._reset(vector.shape[1])
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = faiss.IndexIDMap2(faiss.IndexFlatIP(self._dimension))
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {
+                'query': query,
+                'answer': answer,
+                'sources': sources,
+                'namespace': namespace,
+                'created': time.time()
+            }
+
+            # Entry ids increase with insertion time, so the oldest entries go first.
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._remove(sorted(self._entries)[:overflow])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'expired': self.expired,
+            'invalidations': self.invalidations,
+            'entries': len(self),
+            'max_entries': self.max_entries
+        }
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
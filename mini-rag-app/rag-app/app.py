@@ -1,7 +1,8 @@
+import time
 import streamlit as st
-from rag_engine import RAGEngine
 from document_loader import load_documents
 import config
+from telemetry import telemetry
 
 st.set_page_config(
     page_title="Mini RAG Application",
@@ -14,62 +15,213 @@ st.markdown("Ask questions about company policies, product features, or technica
 
 @st.cache_resource
 def get_rag_engine():
-    return RAGEngine()
+    # Deferred so the page can render before numpy/faiss are imported.
+    start = time.perf_counter()
+    from rag_engine import RAGEngine
+    import_time = time.perf_counter() - start
+
+    engine = RAGEngine()
+    engine.startup_timings['engine_import'] = import_time
+    return engine
+
+
+@st.cache_resource
+def get_collection_manager():
+    from collection_manager import CollectionManager
+    return CollectionManager()
 
 rag = get_rag_engine()
+collections = get_collection_manager()
 
 with st.sidebar:
     st.header("⚙️ Settings")
 
     st.subheader("Index Management")
 
-    if config.FAISS_INDEX_PATH.exists():
-        if rag.index is None:
-            if rag.load_index():
-                st.success(f"✅ Index loaded ({len(rag.metadata)} chunks)")
+    collection_names = collections.names()
+    collection_name = st.selectbox(
+        "Collection",
+        [None] + collection_names,
+        format_func=lambda name: name or "Default (top-level documents)"
+    ) if collection_names else None
+
+    if collection_name is None:
+        if config.FAISS_INDEX_PATH.exists():
+            if rag.index is None:
+                if rag.load_index():
+                    st.success(f"✅ Index loaded ({len(rag.metadata)} chunks)")
+                else:
+                    st.error("❌ Failed to load index")
             else:
-                st.error("❌ Failed to load index")
+                st.success(f"✅ Index ready ({len(rag.metadata)} chunks)")
+
+            with st.expander("Startup report"):
+                report = rag.startup_report()
+                for name, value in report.items():
+                    if isinstance(value, float):
+                        st.text(f"{name}: {value * 1000:.1f} ms")
+                    else:
+                        st.text(f"{name}: {value}")
+
+            if st.button("🔁 Update Changed Documents"):
+                with st.spinner("Updating index..."):
+                    try:
+                        stats = rag.update_index()
+                        st.success(
+                            f"✅ Index updated! (+{stats['added_chunks']} / "
+                            f"-{stats['removed_chunks']} chunks, {stats['total_chunks']} total, "
+                            f"{stats['duplicate_chunks']} duplicates collapsed)"
+                        )
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error updating index: {e}")
+
+            if st.button("🔄 Rebuild Index"):
+                with st.spinner("Rebuilding index..."):
+                    try:
+                        stats = rag.rebuild_index()
+                        st.success(
+                            f"✅ Index rebuilt! ({stats['total_chunks']} chunks, "
+                            f"{stats['duplicate_chunks']} duplicates collapsed)"
+                        )
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error rebuilding index: {e}")
         else:
-            st.success(f"✅ Index ready ({len(rag.metadata)} chunks)")
+            st.warning("⚠️ No index found. Create one to get started.")
+            if st.button("🚀 Create Index"):
+                with st.spinner("Creating index from documents..."):
+                    try:
+                        documents = load_documents()
+                        st.info(f"Loaded {len(documents)} documents")
+                        chunks = rag.chunk_documents(documents)
+                        st.info(f"Created {len(chunks)} chunks")
+                        index, metadata = rag.create_index(chunks)
+                        st.info("Generated embeddings")
+                        rag.save_index(index, metadata, documents)
+                        rag.index = index
+                        rag.metadata = metadata
+                        st.success(
+                            f"✅ Index created! ({len(metadata)} chunks, "
+                            f"{len(chunks) - len(metadata)} duplicates collapsed)"
+                        )
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error creating index: {e}")
+    else:
+        collection = collections.collection(collection_name)
+        layout = collection.read_layout()
+        if layout is None:
+            st.warning(f"⚠️ Collection '{collection_name}' has no index yet.")
+        elif not collection.loaded:
+            if st.button("📂 Load Collection"):
+                try:
+                    collections.load(collection_name)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error loading collection: {e}")
+        else:
+            memory = collection.memory_report()
+            st.success(
+                f"✅ {len(collection)} chunks in {layout['shards']} shard(s), "
+                f"{memory['total_bytes'] / 2 ** 20:.1f} MB"
+            )
+            if st.button("⏏️ Unload Collection"):
+                collections.unload(collection_name)
+                st.rerun()
 
-        if st.button("🔄 Rebuild Index"):
-            with st.spinner("Rebuilding index..."):
+        if layout is not None and st.button("🔁 Update Changed Documents"):
+            with st.spinner("Updating collection..."):
                 try:
-                    documents = load_documents()
-                    chunks = rag.chunk_documents(documents)
-                    index, metadata = rag.create_index(chunks)
-                    rag.save_index(index, metadata)
-                    rag.index = index
-                    rag.metadata = metadata
-                    st.success(f"✅ Index rebuilt! ({len(chunks)} chunks)")
+                    stats = collections.update(collection_name)
+                    st.success(
+                        f"✅ Collection updated! (+{stats['added_chunks']} / "
+                        f"-{stats['removed_chunks']} chunks, {stats['total_chunks']} total)"
+                    )
                     st.rerun()
                 except Exception as e:
-                    st.error(f"Error rebuilding index: {e}")
-    else:
-        st.warning("⚠️ No index found. Create one to get started.")
-        if st.button("🚀 Create Index"):
-            with st.spinner("Creating index from documents..."):
+                    st.error(f"Error updating collection: {e}")
+
+        if st.button("🔄 Rebuild Collection" if layout is not None else "🚀 Build Collection"):
+            with st.spinner("Building collection..."):
                 try:
-                    documents = load_documents()
-                    st.info(f"Loaded {len(documents)} documents")
-                    chunks = rag.chunk_documents(documents)
-                    st.info(f"Created {len(chunks)} chunks")
-                    index, metadata = rag.create_index(chunks)
-                    st.info("Generated embeddings")
-                    rag.save_index(index, metadata)
-                    rag.index = index
-                    rag.metadata = metadata
-                    st.success(f"✅ Index created! ({len(chunks)} chunks)")
+                    stats = collections.build(collection_name)
+                    st.success(f"✅ Collection built! ({stats['total_chunks']} chunks, {stats['shards']} shard(s))")
                     st.rerun()
                 except Exception as e:
-                    st.error(f"Error creating index: {e}")
+                    st.error(f"Error building collection: {e}")
+
+        loaded = collections.memory_report()
+        if loaded:
+            st.caption("Loaded: " + ", ".join(
+                f"{name} ({report['total_bytes'] / 2 ** 20:.1f} MB)" for name, report in loaded.items()
+            ))
 
     st.divider()
 
     st.subheader("Retrieval Settings")
     top_k = st.slider("Number of chunks to retrieve", 1, 10, config.DEFAULT_TOP_K)
 
+    retrieval_modes = {
+        "dense": "Semantic (embeddings)",
+        "hybrid": "Hybrid (semantic + keyword)",
+        "lexical": "Keyword only (BM25, no API call)",
+    }
+    retrieval_mode = st.selectbox(
+        "Retrieval mode",
+        list(retrieval_modes),
+        index=list(retrieval_modes).index(config.RETRIEVAL_MODE),
+        format_func=retrieval_modes.get
+    )
+
+    # Queries go to the selected collection; it answers through the same methods as the engine.
+    searcher = rag if collection_name is None else collections.collection(collection_name)
+    ready = rag.index is not None if collection_name is None else searcher.loaded
+
+    available_sources = searcher.sources() if ready else []
+    selected_sources = st.multiselect(
+        "Only search these sources",
+        available_sources,
+        help="Leave empty to search every document",
+        disabled=not available_sources
+    )
+
     use_reranking = st.checkbox("Enable Reranking (slower, better quality)", value=False)
+    rerank_backends = {
+        "llm": "LLM, one call per chunk",
+        "listwise": "LLM, one call for all chunks",
+        "bm25": "BM25, local (no network)",
+        "cross_encoder": "Cross-encoder, local CPU",
+    }
+    rerank_backend = st.selectbox(
+        "Reranker backend",
+        list(rerank_backends),
+        index=list(rerank_backends).index(config.RERANK_BACKEND),
+        format_func=rerank_backends.get,
+        disabled=not use_reranking
+    )
+
+    st.caption(f"Embeddings: {config.EMBEDDING_PROVIDER} ({config.EMBEDDING_MODEL if config.EMBEDDING_PROVIDER == 'openai' else 'local'})")
+
+    if rag.embedding_cache is not None:
+        cache_stats = rag.embedding_cache.stats()
+        st.caption(
+            f"Embedding cache: {cache_stats['entries']} entries, "
+            f"{cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%} hit rate)"
+        )
+
+    if rag.answer_cache is not None:
+        answer_stats = rag.answer_cache.stats()
+        st.caption(
+            f"Answer cache: {answer_stats['entries']} answers, "
+            f"{answer_stats['hits']} hits / {answer_stats['misses']} misses "
+            f"({answer_stats['hit_rate']:.0%} hit rate)"
+        )
+
+    show_timing = st.checkbox("Show timing breakdown", value=False)
+    # Filled in after each query, below the settings it depends on.
+    timing_container = st.container()
 
     st.divider()
 
@@ -82,34 +234,100 @@ with st.sidebar:
     - What are the system requirements?
     """)
 
-if rag.index is not None:
+if ready:
     query = st.text_input("❓ Ask a question:", placeholder="Type your question here...")
 
     if st.button("🔍 Search & Answer", type="primary") and query:
-        with st.spinner("Searching and generating answer..."):
-            try:
-                if use_reranking:
-                    from reranker import rerank_chunks
-                    initial_chunks = rag.retrieve_chunks(query, top_k=config.RERANK_INITIAL_K)
-                    chunks = rerank_chunks(rag.client, query, initial_chunks, top_k=config.RERANK_TOP_K)
-                    st.info("🎯 Reranking applied")
-                else:
-                    chunks = rag.retrieve_chunks(query, top_k=top_k)
+        try:
+            from chunk_filter import ChunkFilter
+            chunk_filter = ChunkFilter(sources=selected_sources)
+
+            # Cached answers are only reused for the same retrieval settings.
+            if use_reranking:
+                cache_namespace = f"{retrieval_mode}:rerank:{rerank_backend}"
+            else:
+                cache_namespace = f"{retrieval_mode}:{top_k}"
+            if chunk_filter:
+                cache_namespace += f":{chunk_filter.describe()}"
 
-                answer = rag.generate_answer(query, chunks)
+            # The answer cache is keyed on query embeddings, so keyword-only
+            # retrieval skips it rather than make an embedding call.
+            use_answer_cache = retrieval_mode != "lexical"
+
+            with telemetry.trace("query") as query_trace:
+                with st.spinner("Searching..."):
+                    cached = searcher.lookup_answer(query, cache_namespace) if use_answer_cache else None
+                    if cached is not None:
+                        chunks = cached['sources']
+                    elif use_reranking:
+                        from reranker import LLM_RERANKERS, get_reranker
+                        initial_chunks = searcher.retrieve_chunks(
+                            query, top_k=config.RERANK_INITIAL_K, mode=retrieval_mode, chunk_filter=chunk_filter
+                        )
+                        rerank = get_reranker(rerank_backend)
+                        client = searcher.client if rerank_backend in LLM_RERANKERS else None
+                        chunks = rerank(client, query, initial_chunks, top_k=config.RERANK_TOP_K)
+                        st.info(f"🎯 Reranking applied ({rerank_backends[rerank_backend]})")
+                    else:
+                        chunks = searcher.retrieve_chunks(
+                            query, top_k=top_k, mode=retrieval_mode, chunk_filter=chunk_filter
+                        )
 
                 st.subheader("💡 Answer")
-                st.write(answer)
+                answer_container = st.container()
 
+                # Sources are rendered before generation starts; the answer streams in above them.
                 st.subheader("📚 Retrieved Sources")
 
                 for i, chunk in enumerate(chunks, 1):
                     with st.expander(f"Source {i}: {chunk['source']} (Score: {chunk['score']:.3f})"):
+                        if chunk.get('sources'):
+                            st.caption("Also in: " + ", ".join(chunk['sources'][1:]))
                         st.text(chunk['text'])
 
-            except Exception as e:
-                st.error(f"Error: {e}")
+                with answer_container:
+                    if cached is not None:
+                        st.markdown(cached['answer'])
+                        st.caption(
+                            f"⚡ Cached answer for \"{cached['query']}\" "
+                            f"(similarity {cached['similarity']:.3f}), "
+                            f"served in {searcher.last_generation_stats['total_time'] * 1000:.0f} ms"
+                        )
+                    else:
+                        answer = st.write_stream(searcher.generate_answer_stream(query, chunks))
+                        if use_answer_cache:
+                            searcher.cache_answer(query, answer, chunks, cache_namespace)
+                        stats = searcher.last_generation_stats
+                        if stats:
+                            st.caption(
+                                f"⏱️ First token after {stats['time_to_first_token']:.2f}s, "
+                                f"generated in {stats['total_time']:.2f}s"
+                            )
+                        context_stats = searcher.last_context_stats
+                        if context_stats:
+                            st.caption(
+                                f"🧩 Context: {context_stats['context_tokens']} tokens "
+                                f"({context_stats['tokens_saved']} saved by merging, deduplication and the "
+                                f"{context_stats['token_budget']}-token budget)"
+                            )
+
+            if show_timing:
+                with timing_container, st.expander("Timing breakdown", expanded=True):
+                    st.caption(f"Total {query_trace.duration * 1000:.0f} ms")
+                    st.text("\n".join(
+                        f"{'  ' * row['depth']}{row['span']:<{24 - 2 * row['depth']}} {row['duration_ms']:8.1f} ms"
+                        for row in query_trace.breakdown()
+                    ))
+                    if query_trace.counters:
+                        st.text("\n".join(
+                            f"{name:<24} {value:g}" for name, value in sorted(query_trace.counters.items())
+                        ))
+
+        except Exception as e:
+            st.error(f"Error: {e}")
 
+elif collection_name is not None:
+    st.info(f"👈 Please build or load the '{collection_name}' collection using the sidebar to get started!")
 else:
     st.info("👈 Please create an index using the sidebar to get started!")
 
@@ -0,0 +1,54 @@
+import argparse
+import time
+
+import tiktoken
+
+import config
+from chunking import BOUNDARY_MODES, chunk_texts, split_tokens, token_byte_lengths
+from document_loader import load_documents
+
+
+def _time(fn, repeats: int):
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the per-window chunker with the vectorised one")
+    parser.add_argument(
+        "--copies", type=int, default=50,
+        help="Repeat the documents directory this many times to build a larger corpus"
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per chunker, best run is reported")
+    args = parser.parse_args()
+
+    tokenizer = tiktoken.encoding_for_model("gpt-4")
+    texts = [doc['content'] for doc in load_documents()] * args.copies
+    megabytes = sum(len(text.encode('utf-8')) for text in texts) / 1e6
+
+    start = time.perf_counter()
+    token_byte_lengths(tokenizer)
+    print(f"Corpus: {len(texts)} documents, {megabytes:.1f} MB")
+    print(f"Token byte-length table built in {time.perf_counter() - start:.3f}s (once per process)\n")
+
+    baseline_time, baseline = _time(lambda: [split_tokens(tokenizer, text) for text in texts], args.repeats)
+    print(f"{'split_tokens':<22} {baseline_time:8.3f}s  {megabytes / baseline_time:8.2f} MB/s  "
+          f"{sum(map(len, baseline))} chunks")
+
+    for boundary in BOUNDARY_MODES:
+        elapsed, pieces = _time(lambda: chunk_texts(tokenizer, texts, boundary=boundary), args.repeats)
+        line = (f"{'chunk_texts/' + boundary:<22} {elapsed:8.3f}s  {megabytes / elapsed:8.2f} MB/s  "
+                f"{sum(map(len, pieces))} chunks  {baseline_time / elapsed:5.1f}x")
+        if boundary == "tokens":
+            line += "  identical" if pieces == baseline else "  MISMATCH"
+        print(line)
+
+    print(f"\nCHUNK_SIZE={config.CHUNK_SIZE}, CHUNK_OVERLAP={config.CHUNK_OVERLAP}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import types
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import config
+
+QUESTIONS_PATH = config.BASE_DIR / "test_questions.txt"
+QUESTION_PATTERN = re.compile(r"^\s*\d+\.\s+(.+?)\s*$")
+SOURCE_PATTERN = re.compile(r"^\s*Source:\s*(\S+)")
+
+VOCABULARY_SIZE = 20_000
+WORDS_PER_FILE = 200_000
+SENTENCE_WORDS = 14
+PARAGRAPH_SENTENCES = 5
+
+# Lower is better for timings, higher is better for throughput and quality.
+HIGHER_IS_BETTER = ('qps', 'per_second', 'recall', 'mrr')
+
+
+class StubEmbeddingsClient:
+    """Stands in for the OpenAI client, so the scheduler and cache path run without the API."""
+
+    def __init__(self, dimension: int):
+        from embeddings import FakeEmbeddingProvider
+        self._provider = FakeEmbeddingProvider(dimension, config.EMBEDDING_BATCH_SIZE, latency=0.0)
+        self.embeddings = self
+
+    def create(self, model: str, input: List[str], **kwargs):
+        vectors = self._provider.embed(input)
+        return types.SimpleNamespace(data=[types.SimpleNamespace(embedding=vector) for vector in vectors])
+
+
+@contextmanager
+def timed(stages: Dict[str, float], name: str):
+    start = time.perf_counter()
+    yield
+    stages[name] = time.perf_counter() - start
+
+
+def parse_test_questions(path: Path = QUESTIONS_PATH) -> List[Dict[str, str]]:
+    questions, current = [], None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            question = QUESTION_PATTERN.match(line)
+            source = SOURCE_PATTERN.match(line)
+            if question:
+                current = {'question': question.group(1), 'source': None}
+                questions.append(current)
+            elif source and current is not None:
+                current['source'] = source.group(1)
+
+    # Questions without an expected source cannot be scored.
+    return [question for question in questions if question['source']]
+
+
+def generate_corpus(documents_dir: Path, n_chunks: int, tokenizer, seed: int) -> Dict[str, float]:
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    vocabulary = np.array([
+        "".join(rng.choice(letters, size=length))
+        for length in rng.integers(2, 10, size=VOCABULARY_SIZE)
+    ])
+    # Zipf-like word frequencies, as in natural text.
+    probabilities = 1.0 / np.arange(1, VOCABULARY_SIZE + 1) ** 1.1
+    probabilities /= probabilities.sum()
+
+    def text_of(n_words: int) -> str:
+        words = vocabulary[rng.choice(VOCABULARY_SIZE, size=n_words, p=probabilities)].tolist()
+        for i in range(SENTENCE_WORDS - 1, n_words, SENTENCE_WORDS):
+            words[i] += "." if (i + 1) % (SENTENCE_WORDS * PARAGRAPH_SENTENCES) else ".\n\n"
+        return " ".join(words)
+
+    # Calibrate words per chunk against the real tokenizer.
+    sample = text_of(10_000)
+    tokens_per_word = len(tokenizer.encode_ordinary(sample)) / 10_000
+    step = config.CHUNK_SIZE - config.CHUNK_OVERLAP
+    total_words = int(n_chunks * step / tokens_per_word)
+
+    documents_dir.mkdir(parents=True, exist_ok=True)
+    written, file_index, total_bytes = 0, 0, 0
+    while written < total_words:
+        n_words = min(WORDS_PER_FILE, total_words - written)
+        path = documents_dir / f"synthetic_{file_index:05d}.txt"
+        path.write_text(text_of(n_words), encoding='utf-8')
+        total_bytes += path.stat().st_size
+        written += n_words
+        file_index += 1
+
+    return {'files': file_index, 'words': written, 'megabytes': total_bytes / 1e6}
+
+
+def make_engine(embedder: str, dimension: int):
+    from rag_engine import RAGEngine
+
+    config.EMBEDDING_DIMENSION = dimension
+    if embedder == "stub":
+        config.EMBEDDING_PROVIDER = "openai"
+        # Measure the scheduler itself, not the API quota.
+        config.EMBEDDING_RPM = config.EMBEDDING_TPM = 10 ** 12
+        # The stub client replaces the real one before any request is made.
+        os.environ.setdefault('OPENAI_API_KEY', "benchmark-stub")
+        rag = RAGEngine()
+        rag.client = StubEmbeddingsClient(dimension)
+    else:
+        config.EMBEDDING_PROVIDER = embedder
+        rag = RAGEngine()
+    return rag
+
+
+def _latency_stats(latencies: List[float]) -> Dict[str, float]:
+    latencies = np.array(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+def run_scale(n_chunks: int, args, tokenizer) -> Dict:
+    workdir = Path(tempfile.mkdtemp(prefix=f"rag_bench_{n_chunks}_"))
+    documents_dir, index_dir = workdir / "documents", workdir / "indexes"
+    stages = {}
+
+    try:
+        with timed(stages, 'generate'):
+            corpus = generate_corpus(documents_dir, n_chunks, tokenizer, args.seed)
+        config.use_documents_dir(documents_dir)
+        config.use_index_dir(index_dir)
+
+        from chunking import token_byte_lengths
+        from document_loader import load_documents
+        rag = make_engine(args.embedder, args.dimension)
+
+        # The tokenizer and its byte-length table are built once per process, outside the timings.
+        token_byte_lengths(rag.tokenizer)
+
+        with timed(stages, 'load'):
+            documents = load_documents()
+        with timed(stages, 'chunk'):
+            chunks = rag.chunk_documents(documents)
+        with timed(stages, 'dedup'):
+            chunks = rag.deduplicate(chunks)
+        with timed(stages, 'embed'):
+            embeddings, ids = rag._embed_chunks(chunks)
+        with timed(stages, 'build'):
+            index = rag._build_faiss_index(embeddings, ids)
+        # Includes the BM25 index build and the metadata store.
+        with timed(stages, 'save'):
+            rag.save_index(index, rag._chunk_metadata(chunks), documents)
+
+        rng = np.random.default_rng(args.seed)
+        sample = rng.choice(len(chunks), size=min(args.queries, len(chunks)), replace=False)
+        queries = [" ".join(chunks[i]['text'].split()[:12]) for i in sample]
+        del chunks, embeddings, index
+
+        reloaded = make_engine(args.embedder, args.dimension)
+        with timed(stages, 'index_load'):
+            reloaded.load_index()
+        query_embeddings = reloaded.generate_embeddings(queries)
+
+        search = {}
+        for top_k in args.top_k:
+            start = time.perf_counter()
+            reloaded.search_embeddings(query_embeddings, top_k)
+            batch_seconds = time.perf_counter() - start
+
+            latencies = []
+            for row in query_embeddings[:args.latency_queries]:
+                start = time.perf_counter()
+                reloaded.search_embeddings(row[np.newaxis, :], top_k)
+                latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            reloaded.retrieve_chunks_batch(queries, top_k, mode="lexical")
+            lexical_seconds = time.perf_counter() - start
+
+            search[str(top_k)] = dict(
+                _latency_stats(latencies),
+                dense_batch_qps=len(queries) / batch_seconds,
+                lexical_qps=len(queries) / lexical_seconds
+            )
+
+        n_indexed = reloaded.index.ntotal
+        return {
+            'target_chunks': n_chunks,
+            'chunks': n_indexed,
+            'corpus': corpus,
+            'index_bytes': config.FAISS_INDEX_PATH.stat().st_size,
+            'rescore_bytes': reloaded.memory_report()['rescore_bytes'],
+            'stages': stages,
+            'throughput': {
+                'chunk_mb_per_second': corpus['megabytes'] / stages['chunk'],
+                'embed_chunks_per_second': n_indexed / stages['embed'],
+                'build_vectors_per_second': n_indexed / stages['build'],
+            },
+            'search': search,
+        }
+    finally:
+        if args.keep:
+            print(f"  Kept benchmark files in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_quality(args, documents_dir: Path) -> Dict:
+    questions = parse_test_questions()
+    workdir = Path(tempfile.mkdtemp(prefix="rag_bench_quality_"))
+
+    try:
+        config.use_documents_dir(documents_dir)
+        config.use_index_dir(workdir)
+        rag = make_engine(args.quality_embedder, args.dimension)
+        rag.rebuild_index()
+
+        results = {}
+        for mode in ("dense", "lexical", "hybrid"):
+            retrieved = rag.retrieve_chunks_batch([q['question'] for q in questions], args.quality_k, mode=mode)
+            hits, reciprocal_ranks = [], []
+            for question, chunks in zip(questions, retrieved):
+                ranks = [rank for rank, chunk in enumerate(chunks, 1) if chunk['source'] == question['source']]
+                hits.append(1.0 if ranks else 0.0)
+                reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+            results[mode] = {
+                f"recall@{args.quality_k}": float(np.mean(hits)),
+                'mrr': float(np.mean(reciprocal_ranks)),
+            }
+
+        return {'embedder': args.quality_embedder, 'questions': len(questions), 'modes': results}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=config.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    # Corpus sizes and the generate stage describe the input, not the code under test.
+    skip = ('target_chunks', '.chunks', 'corpus.', 'stages.generate', 'index_bytes', 'rescore_bytes', 'questions')
+    old, new = _flatten(baseline['results']), _flatten(current['results'])
+    regressions = []
+
+    print(f"\n{'metric':<52} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(set(old) & set(new)):
+        if any(part in name for part in skip) or not old[name]:
+            continue
+        change = (new[name] - old[name]) / old[name]
+        higher_is_better = any(part in name for part in HIGHER_IS_BETTER)
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<52} {old[name]:12.4g} {new[name]:12.4g} {change:+8.1%}{flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage and retrieval quality")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000],
+        help="Synthetic corpus sizes in chunks (up to 10^7 given enough memory and disk)"
+    )
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 5, 10, 50], help="Search depths to time")
+    parser.add_argument("--queries", type=int, default=500, help="Queries per search measurement")
+    parser.add_argument("--latency-queries", type=int, default=100, help="Queries timed one at a time")
+    parser.add_argument(
+        "--embedder", choices=("fake", "hashing", "stub", "openai"), default="fake",
+        help="Embeddings for the synthetic corpora; stub runs the OpenAI path against a local fake client"
+    )
+    parser.add_argument("--dimension", type=int, default=256, help="Embedding dimension for local embedders")
+    parser.add_argument("--index-type", default=config.INDEX_TYPE, help="FAISS index type (see index_factory)")
+    parser.add_argument(
+        "--vector-storage", default=config.VECTOR_STORAGE,
+        help="float32, int8 or binary (see index_factory); lossy storages rescore candidates"
+    )
+    parser.add_argument("--chunk-size", type=int, default=config.CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=config.CHUNK_OVERLAP)
+    parser.add_argument(
+        "--quality-embedder", choices=("hashing", "fake", "openai", "sentence_transformers"),
+        default="hashing", help="Embeddings for the test_questions.txt recall/MRR run"
+    )
+    parser.add_argument("--quality-k", type=int, default=5)
+    parser.add_argument("--skip-quality", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated corpora and indexes")
+    parser.add_argument("--output", type=Path, help="Write results as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    args = parser.parse_args()
+
+    import faiss
+    import tiktoken
+
+    config.INDEX_TYPE = args.index_type
+    config.VECTOR_STORAGE = args.vector_storage
+    config.CHUNK_SIZE = args.chunk_size
+    config.CHUNK_OVERLAP = args.chunk_overlap
+    # Scratch indexes should not read or fill the shared embedding cache.
+    config.EMBEDDING_CACHE_ENABLED = False
+    config.ANSWER_CACHE_ENABLED = False
+    documents_dir = config.DOCUMENTS_DIR
+    tokenizer = tiktoken.encoding_for_model("gpt-4")
+
+    results = {}
+    for n_chunks in args.sizes:
+        print(f"Benchmarking {n_chunks} chunks...")
+        result = run_scale(n_chunks, args, tokenizer)
+        results[str(n_chunks)] = result
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result['stages'].items())
+        print(f"  {result['chunks']} chunks: {stages}")
+        for top_k, search in result['search'].items():
+            print(f"  top_k={top_k}: p50 {search['p50_ms']:.2f} ms, p95 {search['p95_ms']:.2f} ms, "
+                  f"{search['dense_batch_qps']:.0f} dense q/s (batched), {search['lexical_qps']:.0f} lexical q/s")
+
+    if not args.skip_quality:
+        print(f"\nRetrieval quality on test_questions.txt ({args.quality_embedder} embeddings)...")
+        quality = run_quality(args, documents_dir)
+        results['quality'] = quality
+        for mode, metrics in quality['modes'].items():
+            print(f"  {mode:<8} " + ", ".join(f"{name} {value:.3f}" for name, value in metrics.items()))
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+            'faiss': getattr(faiss, '__version__', None),
+        },
+        'settings': {
+            'embedder': args.embedder,
+            'dimension': args.dimension,
+            'index_type': args.index_type,
+            'vector_storage': args.vector_storage,
+            'chunk_size': args.chunk_size,
+            'chunk_overlap': args.chunk_overlap,
+            'queries': args.queries,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {baseline.get('commit')})")
+        regressions = compare(baseline, report, args.tolerance)
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        if regressions and args.fail_on_regression:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,165 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import config
+from index_factory import make_id_selector
+
+FILTER_FIELDS = ("source", "tag")
+
+
+class ChunkFilter:
+    """Restricts retrieval to chunks from any of `sources`, with any of `tags`, whose
+    chunk_id lies in the half-open `chunk_range`. Unset fields do not restrict."""
+
+    def __init__(self, sources: Optional[Iterable[str]] = None, tags: Optional[Iterable[str]] = None,
+                 chunk_range: Optional[Tuple[int, int]] = None):
+        self.sources = tuple(sorted(set(sources))) if sources else None
+        self.tags = tuple(sorted(set(tags))) if tags else None
+        self.chunk_range = (int(chunk_range[0]), int(chunk_range[1])) if chunk_range else None
+
+    @property
+    def key(self) -> Tuple:
+        return self.sources, self.tags, self.chunk_range
+
+    def __bool__(self) -> bool:
+        return any(value is not None for value in self.key)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ChunkFilter) and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def describe(self) -> str:
+        # Also used in answer cache namespaces, so it must identify the filter exactly.
+        parts = []
+        if self.sources is not None:
+            parts.append("source=" + ",".join(self.sources))
+        if self.tags is not None:
+            parts.append("tag=" + ",".join(self.tags))
+        if self.chunk_range is not None:
+            parts.append(f"chunks={self.chunk_range[0]}-{self.chunk_range[1]}")
+        return ";".join(parts)
+
+
+class FilterIndex:
+    """Sorted chunk ids per source and per tag, saved beside the FAISS index.
+
+    A filter resolves to the allowed chunk ids with a few set operations on these
+    arrays, and the FAISS selector built from them is cached, so repeating a filter
+    costs nothing beyond the search itself.
+    """
+
+    def __init__(self, chunk_ids: np.ndarray, fields: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        self.chunk_ids = chunk_ids
+        # field -> (keys, offsets, ids): the ids of keys[i] are ids[offsets[i]:offsets[i + 1]].
+        self.fields = fields
+        self._positions = {
+            field: {key: i for i, key in enumerate(keys.tolist())}
+            for field, (keys, _, _) in fields.items()
+        }
+        self._selectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self.chunk_ids.nbytes + sum(
+            array.nbytes for arrays in self.fields.values() for array in arrays
+        )
+
+    @staticmethod
+    def _group(chunk_ids: np.ndarray, keys_per_chunk: List[Iterable[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        groups = {}
+        for chunk_id, keys in zip(chunk_ids.tolist(), keys_per_chunk):
+            for key in keys:
+                groups.setdefault(key, []).append(chunk_id)
+
+        keys = sorted(groups)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(groups[key]) for key in keys], out=offsets[1:])
+        ids = np.concatenate([np.sort(np.array(groups[key], dtype=np.int64)) for key in keys]) \
+            if keys else np.zeros(0, dtype=np.int64)
+        return np.array(keys, dtype=str), offsets, ids
+
+    @classmethod
+    def build(cls, chunk_ids: List[int], sources: List[Iterable[str]], tags: List[Iterable[str]]) -> "FilterIndex":
+        chunk_ids = np.array(chunk_ids, dtype=np.int64)
+        return cls(np.sort(chunk_ids), {
+            "source": cls._group(chunk_ids, sources),
+            "tag": cls._group(chunk_ids, tags),
+        })
+
+    def save(self, path: Path):
+        arrays = {'chunk_ids': self.chunk_ids}
+        for field, (keys, offsets, ids) in self.fields.items():
+            arrays[f"{field}_keys"] = keys
+            arrays[f"{field}_offsets"] = offsets
+            arrays[f"{field}_ids"] = ids
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "FilterIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["chunk_ids"], {
+                field: (data[f"{field}_keys"], data[f"{field}_offsets"], data[f"{field}_ids"])
+                for field in FILTER_FIELDS
+            })
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def keys(self, field: str) -> List[str]:
+        return self.fields[field][0].tolist()
+
+    def _union(self, field: str, keys: Iterable[str]) -> np.ndarray:
+        _, offsets, ids = self.fields[field]
+        groups = [
+            ids[offsets[position]:offsets[position + 1]]
+            for position in (self._positions[field].get(key) for key in keys) if position is not None
+        ]
+        if not groups:
+            return np.zeros(0, dtype=np.int64)
+        # Groups overlap for tags, and for sources sharing a collapsed duplicate chunk.
+        return np.unique(np.concatenate(groups)) if len(groups) > 1 else groups[0]
+
+    def allowed_ids(self, chunk_filter: ChunkFilter) -> np.ndarray:
+        allowed = None
+        for field, keys in (("source", chunk_filter.sources), ("tag", chunk_filter.tags)):
+            if keys is None:
+                continue
+            ids = self._union(field, keys)
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+
+        if allowed is None:
+            allowed = self.chunk_ids
+        if chunk_filter.chunk_range is not None:
+            start, end = chunk_filter.chunk_range
+            allowed = allowed[np.searchsorted(allowed, start):np.searchsorted(allowed, end)]
+        return allowed
+
+    def selector(self, chunk_filter: ChunkFilter) -> Tuple[faiss.IDSelector, np.ndarray]:
+        """The FAISS selector for `chunk_filter` and the chunk ids it admits."""
+        with self._lock:
+            cached = self._selectors.get(chunk_filter)
+            if cached is not None:
+                self._selectors.move_to_end(chunk_filter)
+                return cached
+
+        allowed = self.allowed_ids(chunk_filter)
+        if chunk_filter.sources is None and chunk_filter.tags is None:
+            # A plain range check needs no id set.
+            selector = faiss.IDSelectorRange(*chunk_filter.chunk_range)
+        else:
+            selector = make_id_selector(allowed)
+
+        with self._lock:
+            self._selectors[chunk_filter] = (selector, allowed)
+            while len(self._selectors) > config.FILTER_SELECTOR_CACHE_SIZE:
+                self._selectors.popitem(last=False)
+        return selector, allowed
@@ -0,0 +1,120 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+
+BOUNDARY_MODES = ("tokens", "sentence", "paragraph")
+
+PARAGRAPH_PATTERN = re.compile(rb"\n[ \t]*\n\s*")
+SENTENCE_PATTERN = re.compile(rb"[.!?][\"')\]]*(?=\s)")
+
+_byte_length_tables: Dict[str, np.ndarray] = {}
+
+
+def split_tokens(tokenizer, text: str, chunk_size: int = config.CHUNK_SIZE,
+                 chunk_overlap: int = config.CHUNK_OVERLAP) -> List[Tuple[str, int]]:
+    pieces = []
+    tokens = tokenizer.encode(text)
+    total_tokens = len(tokens)
+
+    start = 0
+    while start < total_tokens:
+        end = min(start + chunk_size, total_tokens)
+        chunk_tokens = tokens[start:end]
+        pieces.append((tokenizer.decode(chunk_tokens), len(chunk_tokens)))
+        start += chunk_size - chunk_overlap
+
+    return pieces
+
+
+def token_byte_lengths(tokenizer) -> np.ndarray:
+    table = _byte_length_tables.get(tokenizer.name)
+    if table is None:
+        table = np.zeros(tokenizer.n_vocab, dtype=np.int64)
+        for token in range(tokenizer.n_vocab):
+            try:
+                table[token] = len(tokenizer.decode_single_token_bytes(token))
+            except KeyError:
+                pass
+        _byte_length_tables[tokenizer.name] = table
+    return table
+
+
+def _cut_candidates(data: bytes, byte_offsets: np.ndarray, boundary: str) -> np.ndarray:
+    positions = [match.end() for match in PARAGRAPH_PATTERN.finditer(data)]
+    if boundary == "sentence":
+        positions.extend(match.end() for match in SENTENCE_PATTERN.finditer(data))
+    if not positions:
+        return np.zeros(0, dtype=np.int64)
+
+    # Token indices whose start lies exactly on a boundary; cuts inside a token are ignored.
+    return np.flatnonzero(np.isin(byte_offsets, np.array(positions, dtype=np.int64)))
+
+
+def _token_windows(n_tokens: int, chunk_size: int, chunk_overlap: int) -> Tuple[np.ndarray, np.ndarray]:
+    starts = np.arange(0, n_tokens, chunk_size - chunk_overlap, dtype=np.int64)
+    return starts, np.minimum(starts + chunk_size, n_tokens)
+
+
+def _boundary_windows(n_tokens: int, candidates: np.ndarray, chunk_size: int,
+                      chunk_overlap: int, min_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    starts, ends = [], []
+    start = 0
+    while start < n_tokens:
+        end = min(start + chunk_size, n_tokens)
+        if end < n_tokens:
+            latest = np.searchsorted(candidates, end, side="right") - 1
+            if latest >= 0 and candidates[latest] >= start + min_size:
+                end = int(candidates[latest])
+        starts.append(start)
+        ends.append(end)
+        if end >= n_tokens:
+            break
+        start = max(end - chunk_overlap, start + 1)
+
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def chunk_texts(tokenizer, texts: List[str], chunk_size: Optional[int] = None,
+                chunk_overlap: Optional[int] = None,
+                boundary: Optional[str] = None) -> List[List[Tuple[str, int]]]:
+    chunk_size = chunk_size or config.CHUNK_SIZE
+    chunk_overlap = config.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+    boundary = boundary or config.CHUNK_BOUNDARY
+    if boundary not in BOUNDARY_MODES:
+        raise ValueError(f"Unknown chunk boundary '{boundary}', expected one of {BOUNDARY_MODES}")
+
+    byte_lengths = token_byte_lengths(tokenizer)
+    min_size = int(chunk_size * config.CHUNK_MIN_FRACTION)
+    results = []
+
+    # Each document is tokenized exactly once, in parallel across documents.
+    for text, tokens in zip(texts, tokenizer.encode_ordinary_batch(texts)):
+        n_tokens = len(tokens)
+        if not n_tokens:
+            results.append([])
+            continue
+
+        # Window boundaries are mapped to byte offsets, so chunk text is sliced
+        # out of the encoded document instead of being decoded per window.
+        byte_offsets = np.zeros(n_tokens + 1, dtype=np.int64)
+        np.cumsum(byte_lengths[np.asarray(tokens, dtype=np.int64)], out=byte_offsets[1:])
+        data = text.encode("utf-8")
+
+        if boundary == "tokens":
+            starts, ends = _token_windows(n_tokens, chunk_size, chunk_overlap)
+        else:
+            candidates = _cut_candidates(data, byte_offsets, boundary)
+            starts, ends = _boundary_windows(n_tokens, candidates, chunk_size, chunk_overlap, min_size)
+
+        byte_starts = byte_offsets[starts].tolist()
+        byte_ends = byte_offsets[ends].tolist()
+        token_counts = (ends - starts).tolist()
+        results.append([
+            (data[byte_start:byte_end].decode("utf-8", errors="replace"), token_count)
+            for byte_start, byte_end, token_count in zip(byte_starts, byte_ends, token_counts)
+        ])
+
+    return results
@@ -0,0 +1,398 @@
+import json
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+import config
+from chunk_filter import ChunkFilter
+from document_loader import has_documents, shard_of
+from lexical import CorpusStats, fuse_rankings
+from rag_engine import RAGEngine
+from telemetry import telemetry
+
+LAYOUT_FILE = "collection.json"
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+INDEX_FILE_KEYS = (
+    "faiss_index", "metadata", "chunk_rows", "chunk_text", "chunk_extra", "sources", "lexical_index",
+    "filter_index", "full_vectors", "full_vector_ids", "dedup_index", "manifest"
+)
+
+
+def _fuse(dense: List[Dict], lexical: List[Dict], top_k: int) -> List[Dict]:
+    """Hybrid fusion of rankings merged across shards, as RAGEngine fuses those of one index."""
+    chunks = {(chunk['shard'], chunk['chunk_id']): chunk for chunk in lexical + dense}
+    dense_scores = {(chunk['shard'], chunk['chunk_id']): chunk['score'] for chunk in dense}
+    lexical_scores = {(chunk['shard'], chunk['chunk_id']): chunk['score'] for chunk in lexical}
+    return [
+        dict(chunks[key], score=float(score), dense_score=dense_scores.get(key), lexical_score=lexical_scores.get(key))
+        for key, score in fuse_rankings(list(dense_scores.items()), list(lexical_scores.items()), top_k)
+    ]
+
+
+class Collection:
+    def __init__(self, name: str, documents_dir: Path, index_dir: Path, executor: ThreadPoolExecutor):
+        self.name = name
+        self.documents_dir = documents_dir
+        self.index_dir = index_dir
+        self.engines: List[RAGEngine] = []
+        self.last_used = 0.0
+        self._executor = executor
+        self._lock = threading.RLock()
+
+    @property
+    def layout_path(self) -> Path:
+        return self.index_dir / LAYOUT_FILE
+
+    def target_shards(self, layout: Optional[Dict]) -> int:
+        # A COLLECTION_SHARDS entry wins; otherwise a built collection keeps its shard count.
+        if self.name in config.COLLECTION_SHARDS:
+            return max(1, config.COLLECTION_SHARDS[self.name])
+        if layout is not None:
+            return layout['shards']
+        return max(1, config.DEFAULT_COLLECTION_SHARDS)
+
+    def read_layout(self) -> Optional[Dict]:
+        try:
+            with open(self.layout_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_layout(self):
+        layout = {
+            'shards': len(self.engines),
+            'shard_chunks': [len(engine.metadata) if engine.metadata is not None else 0 for engine in self.engines]
+        }
+        with open(self.layout_path, 'w', encoding='utf-8') as f:
+            json.dump(layout, f, indent=2)
+
+    def _shard_dir(self, shard: int, shard_count: int) -> Path:
+        return self.index_dir if shard_count == 1 else self.index_dir / f"shard-{shard:02d}"
+
+    def _make_engines(self, shard_count: int) -> List[RAGEngine]:
+        return [
+            RAGEngine(self._shard_dir(shard, shard_count), self.documents_dir,
+                      (shard, shard_count) if shard_count > 1 else None)
+            for shard in range(shard_count)
+        ]
+
+    def _remove_layout(self, shard_count: int):
+        # Files of the previous layout would otherwise be left behind when the shard count changes.
+        for shard in range(shard_count):
+            shard_dir = self._shard_dir(shard, shard_count)
+            if shard_dir != self.index_dir:
+                shutil.rmtree(shard_dir, ignore_errors=True)
+                continue
+            paths = config.index_paths(shard_dir)
+            for key in INDEX_FILE_KEYS:
+                getattr(paths, key).unlink(missing_ok=True)
+
+    @property
+    def loaded(self) -> bool:
+        return any(engine.index is not None for engine in self.engines)
+
+    @property
+    def primary(self) -> RAGEngine:
+        # Embeds queries and generates answers for the whole collection.
+        if not self.engines:
+            raise ValueError(f"Collection '{self.name}' is not loaded")
+        return self.engines[0]
+
+    def __len__(self) -> int:
+        return sum(len(engine.metadata) for engine in self.engines if engine.metadata is not None)
+
+    def load(self) -> bool:
+        with self._lock:
+            layout = self.read_layout()
+            if layout is None:
+                return False
+
+            engines = self._make_engines(layout['shards'])
+            # Shards without documents have no index files.
+            to_load = [
+                engine for engine, chunks in zip(engines, layout.get('shard_chunks', [1] * len(engines)))
+                if chunks
+            ]
+            if not all(self._executor.map(lambda engine: engine.load_index(), to_load)):
+                for engine in to_load:
+                    engine.unload_index()
+                return False
+
+            self.engines = engines
+            self.last_used = time.monotonic()
+            return True
+
+    def unload(self):
+        with self._lock:
+            for engine in self.engines:
+                engine.unload_index()
+            self.engines = []
+
+    def rebuild(self, shards: Optional[int] = None) -> Dict[str, int]:
+        with self._lock:
+            layout = self.read_layout()
+            shard_count = shards or self.target_shards(layout)
+            with telemetry.span("collection_rebuild", collection=self.name, shards=shard_count):
+                return self._rebuild(layout, shard_count)
+
+    def _rebuild(self, layout: Optional[Dict], shard_count: int) -> Dict[str, int]:
+        self.unload()
+        if layout is not None and layout['shards'] != shard_count:
+            self._remove_layout(layout['shards'])
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+        engines = self._make_engines(shard_count)
+        stats = []
+        # One shard at a time: every engine has its own embedding rate limiter.
+        for engine in engines:
+            if has_documents(engine.paths.documents_dir, engine.shard):
+                stats.append(engine.rebuild_index())
+                # Reopen through the memory-mapped metadata store.
+                engine.load_index()
+
+        self.engines = engines
+        self._write_layout()
+        self.last_used = time.monotonic()
+        return self._combine(stats)
+
+    def update(self) -> Dict[str, int]:
+        with self._lock:
+            layout = self.read_layout()
+            if layout is None or layout['shards'] != self.target_shards(layout):
+                return self.rebuild()
+            if not self.engines and not self.load():
+                return self.rebuild()
+
+            with telemetry.span("collection_update", collection=self.name, shards=len(self.engines)):
+                stats = []
+                for engine in self.engines:
+                    if engine.index is None and not has_documents(engine.paths.documents_dir, engine.shard):
+                        continue
+                    stats.append(engine.update_index())
+                    engine.load_index()
+
+                self._write_layout()
+                self.last_used = time.monotonic()
+                return self._combine(stats)
+
+    def _combine(self, shard_stats: List[Dict[str, int]]) -> Dict[str, int]:
+        combined = {
+            key: sum(stats[key] for stats in shard_stats)
+            for key in ('added_documents', 'changed_documents', 'removed_documents', 'added_chunks', 'removed_chunks',
+                        'duplicate_chunks')
+        }
+        combined['full_rebuild'] = any(stats['full_rebuild'] for stats in shard_stats)
+        combined['total_chunks'] = len(self)
+        combined['shards'] = len(self.engines)
+        return combined
+
+    def index_version(self) -> str:
+        return "|".join(engine.index_version() or "-" for engine in self.engines)
+
+    def retrieve_chunks(self, query: str, top_k: int = config.DEFAULT_TOP_K,
+                        nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                        mode: str = config.RETRIEVAL_MODE,
+                        chunk_filter: Optional[ChunkFilter] = None) -> List[Dict]:
+        return self.retrieve_chunks_batch([query], top_k, nprobe, ef_search, mode, chunk_filter=chunk_filter)[0]
+
+    def retrieve_chunks_batch(self, queries: List[str], top_k: int = config.DEFAULT_TOP_K,
+                              nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                              mode: str = config.RETRIEVAL_MODE,
+                              query_embeddings: Optional[np.ndarray] = None,
+                              chunk_filter: Optional[ChunkFilter] = None) -> List[List[Dict]]:
+        loaded = [(shard, engine) for shard, engine in enumerate(self.engines) if engine.index is not None]
+        if not loaded:
+            raise ValueError(f"Collection '{self.name}' is not loaded. Please build or load it first.")
+        if not queries:
+            return []
+        self.last_used = time.monotonic()
+        shards = loaded
+
+        if chunk_filter and chunk_filter.sources is not None and len(self.engines) > 1:
+            # Files are sharded by name, so a source filter rules out the other shards up front.
+            wanted = {shard_of(source, len(self.engines)) for source in chunk_filter.sources}
+            shards = [(shard, engine) for shard, engine in shards if shard in wanted]
+            if not shards:
+                return [[] for _ in queries]
+
+        # Queries are embedded once and the vectors shared by every shard.
+        if mode != "lexical" and query_embeddings is None:
+            query_embeddings = self.primary.generate_embeddings(queries)
+
+        # Shard results are merged by score, so scores must mean the same in every shard.
+        # Cosine similarities do; BM25 scores do once every shard uses the statistics of the
+        # whole collection. Hybrid fusion scores depend on ranks within the fused lists, so
+        # hybrid fetches both rankings from every shard and fuses them here.
+        sharded = len(self.engines) > 1
+        corpus = None
+        if sharded and mode != "dense":
+            corpus = CorpusStats.combine([engine.lexical_index for _, engine in loaded], queries)
+        fuse_here = sharded and mode == "hybrid"
+        depth = top_k * config.HYBRID_CANDIDATE_MULTIPLIER if fuse_here else top_k
+
+        def search(engine: RAGEngine) -> List[List[List[Dict]]]:
+            if not fuse_here:
+                return [engine.retrieve_chunks_batch(
+                    queries, top_k, nprobe, ef_search, mode, query_embeddings, chunk_filter, corpus
+                )]
+            return [
+                engine.retrieve_chunks_batch(queries, depth, nprobe, ef_search, "dense", query_embeddings, chunk_filter),
+                engine.retrieve_chunks_batch(queries, depth, nprobe, ef_search, "lexical", None, chunk_filter, corpus),
+            ]
+
+        with telemetry.span("collection_search", collection=self.name, shards=len(shards), mode=mode):
+            if len(shards) == 1:
+                per_shard = [search(shards[0][1])]
+            else:
+                # FAISS releases the GIL while searching, so shards are searched in parallel.
+                futures = [self._executor.submit(telemetry.wrap(search), engine) for _, engine in shards]
+                per_shard = [future.result() for future in futures]
+
+        def merge(ranking: int, position: int, limit: int) -> List[Dict]:
+            # Chunk ids are only unique within a shard, so results carry their shard number.
+            candidates = [
+                dict(chunk, shard=shard)
+                for (shard, _), results in zip(shards, per_shard)
+                for chunk in results[ranking][position]
+            ]
+            candidates.sort(key=lambda chunk: chunk['score'], reverse=True)
+            return candidates[:limit]
+
+        if not fuse_here:
+            return [merge(0, position, top_k) for position in range(len(queries))]
+        with telemetry.span("fusion"):
+            return [_fuse(merge(0, position, depth), merge(1, position, depth), top_k) for position in range(len(queries))]
+
+    # Answer generation and caching go through the primary shard's engine, so a
+    # collection can be used wherever the app expects a RAGEngine.
+
+    @property
+    def client(self):
+        return self.primary.client
+
+    @property
+    def last_generation_stats(self) -> Optional[Dict]:
+        return self.primary.last_generation_stats
+
+    @property
+    def last_context_stats(self) -> Optional[Dict]:
+        return self.primary.last_context_stats
+
+    def lookup_answer(self, query: str, namespace: str = "",
+                      embedding: Optional[np.ndarray] = None) -> Optional[Dict]:
+        return self.primary.lookup_answer(query, f"{self.name}:{namespace}", embedding, self.index_version())
+
+    def cache_answer(self, query: str, answer: str, chunks: List[Dict], namespace: str = "",
+                     embedding: Optional[np.ndarray] = None):
+        self.primary.cache_answer(query, answer, chunks, f"{self.name}:{namespace}", embedding, self.index_version())
+
+    def generate_answer(self, query: str, chunks: List[Dict]) -> str:
+        return self.primary.generate_answer(query, chunks)
+
+    def generate_answer_stream(self, query: str, chunks: List[Dict]) -> Iterator[str]:
+        return self.primary.generate_answer_stream(query, chunks)
+
+    def sources(self) -> List[str]:
+        return sorted(source for engine in self.engines if engine.metadata is not None
+                      for source in engine.filter_index.keys("source"))
+
+    def memory_report(self) -> Dict:
+        shards = [engine.memory_report() for engine in self.engines]
+        return {
+            'shards': shards,
+            'total_bytes': sum(shard['total_bytes'] for shard in shards)
+        }
+
+
+class CollectionManager:
+    def __init__(self, documents_root: Optional[Path] = None, collections_dir: Optional[Path] = None,
+                 memory_limit: Optional[int] = None):
+        self.documents_root = Path(documents_root or config.DOCUMENTS_DIR)
+        self.collections_dir = Path(collections_dir or config.COLLECTIONS_DIR)
+        self.memory_limit = memory_limit if memory_limit is not None else config.COLLECTION_MEMORY_LIMIT
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.COLLECTION_SEARCH_WORKERS, thread_name_prefix="collection-search"
+        )
+        self._collections: Dict[str, Collection] = {}
+        self._lock = threading.Lock()
+
+    def names(self) -> List[str]:
+        # Every subdirectory of the documents directory is a collection, as is every built index.
+        names = set()
+        if self.documents_root.exists():
+            names.update(path.name for path in self.documents_root.iterdir() if path.is_dir())
+        if self.collections_dir.exists():
+            names.update(path.name for path in self.collections_dir.iterdir() if (path / LAYOUT_FILE).exists())
+        return sorted(name for name in names if COLLECTION_NAME_PATTERN.match(name))
+
+    def collection(self, name: str) -> Collection:
+        if not COLLECTION_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid collection name '{name}'")
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = Collection(
+                    name, self.documents_root / name, self.collections_dir / name, self._executor
+                )
+            return self._collections[name]
+
+    def load(self, name: str) -> Collection:
+        collection = self.collection(name)
+        if not collection.loaded:
+            start = time.perf_counter()
+            if not collection.load():
+                raise ValueError(f"Collection '{name}' has no index yet. Please build it first.")
+            telemetry.record_span("collection_load", time.perf_counter() - start, collection=name)
+        self._enforce_memory_limit(keep=name)
+        return collection
+
+    def unload(self, name: str):
+        self.collection(name).unload()
+
+    def build(self, name: str, shards: Optional[int] = None) -> Dict[str, int]:
+        stats = self.collection(name).rebuild(shards)
+        self._enforce_memory_limit(keep=name)
+        return stats
+
+    def update(self, name: str) -> Dict[str, int]:
+        stats = self.collection(name).update()
+        self._enforce_memory_limit(keep=name)
+        return stats
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return sorted(name for name, collection in self._collections.items() if collection.loaded)
+
+    def memory_report(self) -> Dict[str, Dict]:
+        with self._lock:
+            collections = [collection for collection in self._collections.values() if collection.loaded]
+        return {collection.name: collection.memory_report() for collection in collections}
+
+    def _enforce_memory_limit(self, keep: str):
+        if self.memory_limit is None:
+            return
+        with self._lock:
+            loaded = [collection for collection in self._collections.values() if collection.loaded]
+
+        usage = {collection.name: collection.memory_report()['total_bytes'] for collection in loaded}
+        total = sum(usage.values())
+        # Least recently searched first; the collection just requested is never unloaded.
+        for collection in sorted(loaded, key=lambda collection: collection.last_used):
+            if total <= self.memory_limit:
+                break
+            if collection.name == keep:
+                continue
+            collection.unload()
+            total -= usage[collection.name]
+            print(f"Unloaded collection '{collection.name}' to stay within the memory limit")
+
+    def close(self):
+        for collection in list(self._collections.values()):
+            collection.unload()
+        self._executor.shutdown(wait=False)
@@ -1,19 +1,201 @@
+import os
 from pathlib import Path
+from types import SimpleNamespace
 
 BASE_DIR = Path(__file__).parent
 DOCUMENTS_DIR = BASE_DIR / "documents"
 INDEXES_DIR = BASE_DIR / "indexes"
 
 FAISS_INDEX_PATH = INDEXES_DIR / "faiss_index.bin"
+# Legacy JSON metadata, migrated to the binary store below on first load
 METADATA_PATH = INDEXES_DIR / "metadata.json"
+CHUNK_ROWS_PATH = INDEXES_DIR / "chunks_rows.npy"
+CHUNK_TEXT_PATH = INDEXES_DIR / "chunks_text.bin"
+CHUNK_EXTRA_PATH = INDEXES_DIR / "chunks_extra.bin"
+SOURCES_PATH = INDEXES_DIR / "sources.json"
+LEXICAL_INDEX_PATH = INDEXES_DIR / "lexical_index.npz"
+FILTER_INDEX_PATH = INDEXES_DIR / "filter_index.npz"
+# Full-precision vectors for rescoring when VECTOR_STORAGE is lossy
+FULL_VECTORS_PATH = INDEXES_DIR / "full_vectors.f32"
+FULL_VECTOR_IDS_PATH = INDEXES_DIR / "full_vector_ids.npy"
+DEDUP_INDEX_PATH = INDEXES_DIR / "dedup_index.npz"
+MANIFEST_PATH = INDEXES_DIR / "manifest.json"
+EMBEDDING_CACHE_PATH = INDEXES_DIR / "embedding_cache.sqlite"
+
+INDEX_PATH_SETTINGS = (
+    "FAISS_INDEX_PATH", "METADATA_PATH", "CHUNK_ROWS_PATH", "CHUNK_TEXT_PATH", "CHUNK_EXTRA_PATH",
+    "SOURCES_PATH", "LEXICAL_INDEX_PATH", "FILTER_INDEX_PATH", "FULL_VECTORS_PATH", "FULL_VECTOR_IDS_PATH",
+    "DEDUP_INDEX_PATH", "MANIFEST_PATH", "EMBEDDING_CACHE_PATH",
+)
+
+
+def use_index_dir(index_dir):
+    """Point every index file and collection index at `index_dir`, e.g. for a scratch benchmark index."""
+    global INDEXES_DIR, COLLECTIONS_DIR
+    INDEXES_DIR = Path(index_dir)
+    for name in INDEX_PATH_SETTINGS:
+        globals()[name] = INDEXES_DIR / globals()[name].name
+    COLLECTIONS_DIR = INDEXES_DIR / COLLECTIONS_DIR.name
+
+
+def use_documents_dir(documents_dir):
+    global DOCUMENTS_DIR
+    DOCUMENTS_DIR = Path(documents_dir)
+
+
+def index_paths(index_dir=None, documents_dir=None) -> SimpleNamespace:
+    """The files of one index: the configured ones, or the same file names under `index_dir`.
+
+    Attributes are the settings above without the _PATH suffix, lower-cased (`faiss_index`,
+    `manifest`, ...), plus `index_dir` and `documents_dir`. The embedding cache is not
+    included: it is keyed by text, so every index shares it.
+    """
+    root = INDEXES_DIR if index_dir is None else Path(index_dir)
+    paths = {
+        name[:-len("_PATH")].lower(): globals()[name] if index_dir is None else root / globals()[name].name
+        for name in INDEX_PATH_SETTINGS if name != "EMBEDDING_CACHE_PATH"
+    }
+    return SimpleNamespace(
+        index_dir=root,
+        documents_dir=DOCUMENTS_DIR if documents_dir is None else Path(documents_dir),
+        **paths
+    )
 
 EMBEDDING_MODEL = "text-embedding-3-small"
 LLM_MODEL = "gpt-4o-mini"
+# text-embedding-3 models return shortened embeddings when this is below their
+# native size (1536 for -small, 3072 for -large), e.g. 512 or 256.
 EMBEDDING_DIMENSION = 1536
+# One of "openai", "hashing" (local CPU feature hashing), "fake" (deterministic
+# random vectors for offline benchmarks) or "sentence_transformers" (local model).
+# The hashing and fake providers produce EMBEDDING_DIMENSION-dimensional vectors.
+EMBEDDING_PROVIDER = "openai"
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LOCAL_EMBEDDING_BATCH_SIZE = 256
+FAKE_EMBEDDING_LATENCY = 0.0
+# Requests are packed up to this many inputs and tokens (API limits: 2048 inputs, 300k tokens)
+EMBEDDING_BATCH_SIZE = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 250_000
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_RPM = 3_000
+EMBEDDING_TPM = 1_000_000
+EMBEDDING_MAX_RETRIES = 6
+EMBEDDING_BACKOFF_BASE = 1.0
+EMBEDDING_BACKOFF_MAX = 60.0
+
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# Semantic answer cache: a question whose embedding is at least
+# ANSWER_CACHE_THRESHOLD cosine-similar to a cached one reuses its answer.
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL = 24 * 3600.0
+ANSWER_CACHE_MAX_ENTRIES = 1000
+
+# Memory-map the FAISS index read-only so worker processes share it via the page cache
+INDEX_MMAP = True
+
+# One of "flat", "ivf_flat", "ivf_pq", "hnsw" (see index_factory.py)
+INDEX_TYPE = "flat"
+INDEX_TRAIN_SAMPLE = 100_000
+IVF_NLIST = 1024
+IVF_NPROBE = 16
+PQ_M = 64
+PQ_NBITS = 8
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# "float32", "int8" (scalar quantized, 4x smaller) or "binary" (one bit per dimension,
+# 32x smaller; flat index type only). Lossy storages fetch RESCORE_MULTIPLIER
+# (BINARY_RESCORE_MULTIPLIER) times top_k candidates and rescore them exactly against
+# float32 vectors memory-mapped from FULL_VECTORS_PATH.
+VECTOR_STORAGE = "float32"
+RESCORE_MULTIPLIER = 4
+BINARY_RESCORE_MULTIPLIER = 16
+
+DOCUMENT_EXTENSIONS = (".txt", ".md", ".jsonl")
+# Optional JSON object in the documents directory mapping file names to lists of tags.
+# JSONL records may also carry their own "tags" list.
+DOCUMENT_TAGS_FILE = "tags.json"
+# Larger text files are split at paragraph breaks into sections of about this size
+MAX_SECTION_CHARS = 1_000_000
+
+INGEST_WORKERS = os.cpu_count() or 1
+INGEST_EMBED_BATCH_SIZE = 1000
+INGEST_EMBED_CONCURRENCY = 2
+INGEST_MAX_PENDING_BATCHES = 4
+INGEST_PROGRESS_INTERVAL = 5.0
 
 CHUNK_SIZE = 400
 CHUNK_OVERLAP = 50
+# "tokens" cuts fixed windows; "sentence"/"paragraph" end chunks at the last boundary
+# that still leaves at least CHUNK_MIN_FRACTION of CHUNK_SIZE tokens.
+CHUNK_BOUNDARY = "tokens"
+CHUNK_MIN_FRACTION = 0.5
 
 DEFAULT_TOP_K = 5
+
+# Retrieved chunks are deduplicated, merged with their neighbours and packed
+# by score into at most CONTEXT_TOKEN_BUDGET prompt tokens.
+CONTEXT_TOKEN_BUDGET = 3000
+CONTEXT_DEDUP_THRESHOLD = 0.85
+CONTEXT_SHINGLE_SIZE = 5
 RERANK_TOP_K = 3
 RERANK_INITIAL_K = 10
+RERANK_MAX_CONCURRENCY = 10
+RERANK_CALL_TIMEOUT = 10.0
+RERANK_DEADLINE = 15.0
+# One of "llm", "listwise", "bm25", "cross_encoder" (see reranker.RERANKERS)
+RERANK_BACKEND = "llm"
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# One of "dense", "lexical", "hybrid"
+RETRIEVAL_MODE = "dense"
+# "rrf" (reciprocal rank fusion) or "weighted" (min-max normalised score blend)
+HYBRID_FUSION = "rrf"
+HYBRID_RRF_K = 60
+HYBRID_DENSE_WEIGHT = 0.5
+HYBRID_CANDIDATE_MULTIPLIER = 4
+
+# Duplicate chunks (dedup.py) are collapsed before embedding: exact copies, and chunks
+# whose word-shingle MinHash signatures agree on at least DEDUP_THRESHOLD of their
+# DEDUP_NUM_PERM positions (an estimate of Jaccard similarity). Signatures are split into
+# DEDUP_BANDS bands; chunks sharing a band are compared.
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.8
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+DEDUP_SHINGLE_SIZE = 3
+
+# Metadata filters (chunk_filter.py). Selectors for the most recent filters are kept
+# ready; IVF nprobe and HNSW efSearch grow with filter selectivity up to this factor.
+FILTER_SELECTOR_CACHE_SIZE = 64
+FILTER_MAX_SEARCH_WIDENING = 16
+
+# HTTP service (server.py)
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 8000
+# Concurrent query embeddings are collected for up to SERVER_EMBED_BATCH_WINDOW
+# seconds (or SERVER_EMBED_MAX_BATCH queries) and sent as one API call.
+SERVER_EMBED_BATCH_WINDOW = 0.005
+SERVER_EMBED_MAX_BATCH = 64
+SERVER_MAX_BATCH_QUERIES = 256
+
+# Timing spans and counters (telemetry.py). Exporters: "log" (logger "rag.telemetry"
+# at INFO level) and "otel" (OpenTelemetry, needs opentelemetry-api).
+TELEMETRY_ENABLED = True
+TELEMETRY_EXPORTERS = ("log",)
+
+# Named collections (collection_manager.py). A collection's documents are the files in
+# DOCUMENTS_DIR / <name>; its index lives in COLLECTIONS_DIR / <name>. Collections listed in
+# COLLECTION_SHARDS are split by source file across that many FAISS indexes.
+COLLECTIONS_DIR = INDEXES_DIR / "collections"
+COLLECTION_SHARDS = {}
+DEFAULT_COLLECTION_SHARDS = 1
+COLLECTION_SEARCH_WORKERS = 8
+# Least recently used collections are unloaded to stay under this many bytes (None: no limit).
+COLLECTION_MEMORY_LIMIT = None
@@ -0,0 +1,117 @@
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+import config
+
+WORD_PATTERN = re.compile(r"\w+")
+OVERLAP_PROBE_CHARS = 32
+
+
+def _format_block(source: str, text: str) -> str:
+    return f"[Source: {source}]\n{text}"
+
+
+def _shingles(text: str, size: int) -> Set[Tuple[str, ...]]:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _overlap_length(previous: str, following: str) -> int:
+    # Length of the longest suffix of `previous` that is also a prefix of `following`.
+    probe = following[:OVERLAP_PROBE_CHARS]
+    if not probe:
+        return 0
+
+    position = previous.rfind(probe)
+    while position >= 0:
+        overlap = len(previous) - position
+        if following.startswith(previous[position:]):
+            return overlap
+        position = previous.rfind(probe, 0, position + len(probe) - 1)
+    return 0
+
+
+def _merge_adjacent(chunks: List[Dict]) -> List[Dict]:
+    # Consecutive chunk ids from the same source are neighbouring windows of one
+    # document, which share CHUNK_OVERLAP tokens of text.
+    by_id = sorted(chunks, key=lambda chunk: (chunk['source'], chunk['chunk_id']))
+    blocks = []
+
+    for chunk in by_id:
+        last = blocks[-1] if blocks else None
+        if last and last['source'] == chunk['source'] and chunk['chunk_id'] == last['chunk_ids'][-1] + 1:
+            overlap = _overlap_length(last['text'], chunk['text'])
+            separator = "" if overlap else "\n"
+            last['text'] += separator + chunk['text'][overlap:]
+            last['chunk_ids'].append(chunk['chunk_id'])
+            last['score'] = max(last['score'], chunk['score'])
+        else:
+            blocks.append({
+                'text': chunk['text'],
+                'source': chunk['source'],
+                'chunk_ids': [chunk['chunk_id']],
+                'score': chunk['score']
+            })
+
+    return blocks
+
+
+def build_context(chunks: List[Dict], tokenizer, token_budget: Optional[int] = None,
+                  dedup_threshold: Optional[float] = None) -> Tuple[str, Dict[str, int]]:
+    token_budget = config.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    dedup_threshold = config.CONTEXT_DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+
+    naive_tokens = len(tokenizer.encode_ordinary("\n\n".join(
+        _format_block(chunk['source'], chunk['text']) for chunk in chunks
+    )))
+
+    # Highest-scoring passages are kept first, near-duplicates of them are dropped.
+    ranked = sorted(chunks, key=lambda chunk: chunk.get('score', 0.0), reverse=True)
+    kept, kept_shingles = [], []
+    for chunk in ranked:
+        shingles = _shingles(chunk['text'], config.CONTEXT_SHINGLE_SIZE)
+        if any(_jaccard(shingles, other) >= dedup_threshold for other in kept_shingles):
+            continue
+        kept.append(dict(chunk, score=chunk.get('score', 0.0)))
+        kept_shingles.append(shingles)
+
+    blocks = _merge_adjacent(kept)
+    blocks.sort(key=lambda block: block['score'], reverse=True)
+
+    packed, used, dropped = [], 0, 0
+    separator_tokens = len(tokenizer.encode_ordinary("\n\n"))
+    for block in blocks:
+        formatted = _format_block(block['source'], block['text'])
+        tokens = tokenizer.encode_ordinary(formatted)
+        cost = len(tokens) + (separator_tokens if packed else 0)
+
+        if used + cost <= token_budget:
+            packed.append(formatted)
+            used += cost
+        elif not packed:
+            # Never send an empty context: the best block is truncated to the budget.
+            packed.append(tokenizer.decode(tokens[:token_budget]))
+            used = min(len(tokens), token_budget)
+        else:
+            dropped += 1
+
+    stats = {
+        'input_chunks': len(chunks),
+        'duplicates_removed': len(chunks) - len(kept),
+        'merged_chunks': len(kept) - len(blocks),
+        'blocks': len(packed),
+        'blocks_dropped': dropped,
+        'naive_tokens': naive_tokens,
+        'context_tokens': used,
+        'tokens_saved': max(naive_tokens - used, 0),
+        'token_budget': token_budget
+    }
+    return "\n\n".join(packed), stats
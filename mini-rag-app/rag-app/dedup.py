@@ -0,0 +1,213 @@
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from lexical import tokenize
+
+SHINGLE_PRIME = np.uint64(0x100000001B3)
+
+
+def chunk_sources(chunk: Dict) -> List[str]:
+    """Every source a chunk's text appears in; collapsed duplicates list theirs under 'sources'."""
+    return chunk.get('sources') or [chunk['source']]
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class Deduplicator:
+    """Finds chunks that repeat an earlier one, exactly or nearly.
+
+    Exact copies (ignoring case, punctuation and whitespace) are found by hash. Near
+    copies are found with MinHash signatures over word shingles, split into bands for
+    locality-sensitive hashing: chunks sharing a band are candidates, and a candidate
+    is a duplicate when the signatures agree on at least `threshold` of their positions,
+    an estimate of the Jaccard similarity of the shingle sets. Only chunks with the same
+    tags are compared, so tag filters stay exact after collapsing.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, num_perm: Optional[int] = None,
+                 bands: Optional[int] = None, shingle_size: Optional[int] = None):
+        self.threshold = config.DEDUP_THRESHOLD if threshold is None else threshold
+        self.num_perm = num_perm or config.DEDUP_NUM_PERM
+        self.bands = bands or config.DEDUP_BANDS
+        self.shingle_size = shingle_size or config.DEDUP_SHINGLE_SIZE
+        if self.num_perm % self.bands:
+            raise ValueError(f"DEDUP_NUM_PERM ({self.num_perm}) must be a multiple of DEDUP_BANDS ({self.bands})")
+        self.rows_per_band = self.num_perm // self.bands
+
+        # Multiply-shift hash functions stand in for random permutations. The seed is
+        # fixed, so signatures saved by one build stay comparable in the next.
+        rng = np.random.default_rng(0)
+        self._a = rng.integers(1, 2 ** 63, self.num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, self.num_perm, dtype=np.uint64)
+        self._token_hashes = {}
+
+        self._ids = []
+        self._keys = []
+        self._groups = []
+        self._signatures = []
+        self._exact = {}
+        self._buckets = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _token_hash(self, token: str) -> int:
+        value = self._token_hashes.get(token)
+        if value is None:
+            value = _hash64(token)
+            if len(self._token_hashes) < 1_000_000:
+                self._token_hashes[token] = value
+        return value
+
+    def _signature(self, tokens: List[str]) -> Optional[np.ndarray]:
+        if not tokens:
+            return None
+        hashes = np.array([self._token_hash(token) for token in tokens], dtype=np.uint64)
+        size = min(self.shingle_size, len(hashes))
+        count = len(hashes) - size + 1
+        shingles = np.zeros(count, dtype=np.uint64)
+        for offset in range(size):
+            shingles = shingles * SHINGLE_PRIME + hashes[offset:offset + count]
+        shingles = np.unique(shingles)
+        # The top 32 bits of a*x + b (mod 2^64) are a good universal hash of x.
+        return ((self._a[:, None] * shingles[None, :] + self._b[:, None]) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, group: int, signature: np.ndarray) -> List[Tuple[int, int, bytes]]:
+        width = self.rows_per_band
+        return [(group, band, signature[band * width:(band + 1) * width].tobytes()) for band in range(self.bands)]
+
+    def _register(self, chunk_id: int, key: int, group: int, signature: Optional[np.ndarray]):
+        row = len(self._ids)
+        self._ids.append(chunk_id)
+        self._keys.append(key)
+        self._groups.append(group)
+        self._signatures.append(signature if signature is not None else np.zeros(self.num_perm, dtype=np.uint32))
+        self._exact.setdefault(key, chunk_id)
+        if signature is not None:
+            for band_key in self._band_keys(group, signature):
+                self._buckets.setdefault(band_key, []).append(row)
+
+    def _describe(self, text: str, tags: Optional[Iterable[str]]) -> Tuple[int, int, Optional[np.ndarray]]:
+        tokens = tokenize(text)
+        group = _hash64("\x1f".join(sorted(tags or ())))
+        key = _hash64(" ".join(tokens) + "\x1e" + str(group))
+        return key, group, self._signature(tokens)
+
+    def add(self, chunk_id: int, text: str, tags: Optional[Iterable[str]] = None) -> Optional[Tuple[int, str]]:
+        """Returns (chunk_id of the earlier chunk, "exact" or "near") for a duplicate.
+
+        Anything else is remembered, so later chunks are compared with it.
+        """
+        key, group, signature = self._describe(text, tags)
+        original = self._exact.get(key)
+        if original is not None:
+            return original, "exact"
+
+        if signature is not None:
+            candidates = sorted({
+                row for band_key in self._band_keys(group, signature) for row in self._buckets.get(band_key, ())
+            })
+            for row in candidates:
+                if np.mean(self._signatures[row] == signature) >= self.threshold:
+                    return self._ids[row], "near"
+
+        self._register(chunk_id, key, group, signature)
+        return None
+
+    def register(self, chunk_id: int, text: str, tags: Optional[Iterable[str]] = None):
+        """Remember a chunk without checking it, e.g. one already in an index."""
+        self._register(chunk_id, *self._describe(text, tags))
+
+    def remove(self, chunk_ids: Iterable[int]):
+        remove = set(int(chunk_id) for chunk_id in chunk_ids)
+        if not remove:
+            return
+        rows = [row for row, chunk_id in enumerate(self._ids) if chunk_id not in remove]
+        ids, keys, groups, signatures = self._ids, self._keys, self._groups, self._signatures
+        self._ids, self._keys, self._groups, self._signatures = [], [], [], []
+        self._exact, self._buckets = {}, {}
+        for row in rows:
+            signature = signatures[row] if signatures[row].any() else None
+            self._register(ids[row], keys[row], groups[row], signature)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._ids) * (8 * 3 + 4 * self.num_perm)
+
+    def save(self, path: Path):
+        signatures = np.stack(self._signatures) if self._signatures else np.zeros((0, self.num_perm), dtype=np.uint32)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self._ids, dtype=np.int64),
+                keys=np.array(self._keys, dtype=np.uint64),
+                groups=np.array(self._groups, dtype=np.uint64),
+                signatures=signatures,
+                params=np.array([self.num_perm, self.bands, self.shingle_size], dtype=np.int64),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["Deduplicator"]:
+        """The saved state, or None if it is missing or was built with other MinHash settings."""
+        if not path.exists():
+            return None
+        dedup = cls()
+        with np.load(path, allow_pickle=False) as data:
+            if data["params"].tolist() != [dedup.num_perm, dedup.bands, dedup.shingle_size]:
+                return None
+            for chunk_id, key, group, signature in zip(
+                data["ids"].tolist(), data["keys"].tolist(), data["groups"].tolist(), data["signatures"]
+            ):
+                dedup._register(chunk_id, key, group, signature if signature.any() else None)
+        return dedup
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Dict]) -> "Deduplicator":
+        dedup = cls()
+        for chunk in chunks:
+            dedup.register(chunk['chunk_id'], chunk['text'], chunk.get('tags'))
+        return dedup
+
+
+def collapse_duplicates(chunks: List[Dict], dedup: Deduplicator,
+                        existing: Optional[Dict[int, Dict]] = None) -> Tuple[List[Dict], Dict[str, int]]:
+    """Drop chunks that repeat an earlier one and list their sources on the chunk that is kept.
+
+    `existing` maps chunk ids already indexed to their metadata, which gains the sources
+    of new chunks that duplicate them.
+    """
+    kept = []
+    by_id = dict(existing or {})
+    report = {'chunks': len(chunks), 'exact_duplicates': 0, 'near_duplicates': 0, 'duplicate_tokens': 0}
+
+    for chunk in chunks:
+        match = dedup.add(chunk['chunk_id'], chunk['text'], chunk.get('tags'))
+        original = by_id.get(match[0]) if match is not None else None
+        if original is None:
+            kept.append(chunk)
+            by_id[chunk['chunk_id']] = chunk
+            continue
+
+        sources = chunk_sources(original)
+        if chunk['source'] not in sources:
+            original['sources'] = sources + [chunk['source']]
+        report[f"{match[1]}_duplicates"] += 1
+        report['duplicate_tokens'] += chunk.get('token_count', 0)
+
+    report['duplicate_chunks'] = report['exact_duplicates'] + report['near_duplicates']
+    report['kept_chunks'] = len(kept)
+    return kept, report
+
+
+def print_report(report: Dict[str, int]):
+    removed = report['duplicate_chunks']
+    share = removed / report['chunks'] if report['chunks'] else 0.0
+    print(f"Deduplication: {removed} of {report['chunks']} chunks removed ({share:.1%}; "
+          f"{report['exact_duplicates']} exact, {report['near_duplicates']} near), "
+          f"{report['duplicate_tokens']} tokens not embedded")
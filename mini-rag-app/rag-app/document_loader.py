@@ -1,27 +1,172 @@
-from typing import List, Dict
+import hashlib
+import json
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Dict, Optional, Tuple
 import config
 
+HASH_BLOCK_SIZE = 1 << 20
 
-def load_documents() -> List[Dict[str, str]]:
-    documents = []
+# (shard number, shard count): restricts a listing to the files of one shard.
+Shard = Tuple[int, int]
 
-    if not config.DOCUMENTS_DIR.exists():
+
+def shard_of(filename: str, shard_count: int) -> int:
+    # crc32 rather than hash(), which is salted per process.
+    return zlib.crc32(filename.encode("utf-8")) % shard_count
+
+
+def _list_document_files(documents_dir: Optional[Path] = None, shard: Optional[Shard] = None) -> List[Path]:
+    documents_dir = documents_dir or config.DOCUMENTS_DIR
+    if not documents_dir.exists():
         raise FileNotFoundError(
-            f"Documents directory not found: {config.DOCUMENTS_DIR}"
+            f"Documents directory not found: {documents_dir}"
         )
 
-    txt_files = list(config.DOCUMENTS_DIR.glob("*.txt"))
+    return sorted(
+        path for path in documents_dir.iterdir()
+        if path.is_file() and path.suffix.lower() in config.DOCUMENT_EXTENSIONS
+        and (shard is None or shard_of(path.name, shard[1]) == shard[0])
+    )
+
+
+def has_documents(documents_dir: Optional[Path] = None, shard: Optional[Shard] = None) -> bool:
+    return bool(_list_document_files(documents_dir, shard))
+
+
+def load_tags(documents_dir: Optional[Path] = None) -> Dict[str, List[str]]:
+    path = (documents_dir or config.DOCUMENTS_DIR) / config.DOCUMENT_TAGS_FILE
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            tags = json.load(f)
+    except ValueError as e:
+        print(f"Ignoring {path.name}: {e}")
+        return {}
+    if not isinstance(tags, dict):
+        print(f"Ignoring {path.name}: expected an object mapping file names to tags")
+        return {}
+
+    normalized = {name: _normalize_tags(file_tags) for name, file_tags in tags.items()}
+    return {name: file_tags for name, file_tags in normalized.items() if file_tags}
+
+
+def _normalize_tags(tags) -> List[str]:
+    if isinstance(tags, str):
+        tags = [tags]
+    if not isinstance(tags, list):
+        return []
+    return sorted({str(tag) for tag in tags if tag})
+
+
+def fingerprint_file(file_path: Path) -> Dict:
+    stat = file_path.stat()
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    return {
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "sha256": digest.hexdigest(),
+    }
+
+
+def _iter_text_sections(file_path: Path) -> Iterator[str]:
+    # Large files are cut at paragraph breaks into sections of at most
+    # MAX_SECTION_CHARS, so a single file never has to be held in memory.
+    section, section_chars = [], 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            section.append(line)
+            section_chars += len(line)
+            if section_chars >= config.MAX_SECTION_CHARS and not line.strip():
+                yield "".join(section)
+                section, section_chars = [], 0
+            elif section_chars >= 2 * config.MAX_SECTION_CHARS:
+                yield "".join(section)
+                section, section_chars = [], 0
+
+    if section:
+        yield "".join(section)
 
-    if not txt_files:
-        raise ValueError(f"No .txt files found in {config.DOCUMENTS_DIR}")
 
-    for file_path in txt_files:
+def _iter_jsonl_records(file_path: Path) -> Iterator[Tuple[str, List[str]]]:
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping {file_path.name}:{line_number}: {e}")
+                continue
+            if not isinstance(record, dict):
+                continue
+            text = record.get("text") or record.get("content")
+            if text:
+                yield text, _normalize_tags(record.get("tags"))
+
+
+def iter_file_documents(file_path: Path, fingerprint: Optional[Dict] = None,
+                        tags: Optional[List[str]] = None) -> Iterator[Dict]:
+    fingerprint = fingerprint or fingerprint_file(file_path)
+    if file_path.suffix.lower() == ".jsonl":
+        sections = _iter_jsonl_records(file_path)
+    else:
+        sections = ((section, []) for section in _iter_text_sections(file_path))
+
+    for content, record_tags in sections:
+        document = {"filename": file_path.name, "content": content}
+        document.update(fingerprint)
+        document_tags = sorted(set(tags or ()) | set(record_tags))
+        if document_tags:
+            document["tags"] = document_tags
+        yield document
+
+
+def iter_documents(documents_dir: Optional[Path] = None, shard: Optional[Shard] = None) -> Iterator[Dict]:
+    tags = load_tags(documents_dir)
+    for file_path in _list_document_files(documents_dir, shard):
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                documents.append({"filename": file_path.name, "content": content})
+            yield from iter_file_documents(file_path, tags=tags.get(file_path.name))
         except Exception as e:
             print(f"Error loading {file_path.name}: {e}")
             continue
 
-    return documents
+
+def load_document(file_path: Path, tags: Optional[List[str]] = None) -> List[Dict]:
+    return list(iter_file_documents(file_path, tags=tags))
+
+
+def load_documents(documents_dir: Optional[Path] = None, shard: Optional[Shard] = None) -> List[Dict[str, str]]:
+    if not _list_document_files(documents_dir, shard):
+        if shard is not None:
+            # A shard can legitimately be empty when there are fewer files than shards.
+            return []
+        raise ValueError(
+            f"No supported documents ({', '.join(config.DOCUMENT_EXTENSIONS)}) found in "
+            f"{documents_dir or config.DOCUMENTS_DIR}"
+        )
+
+    return list(iter_documents(documents_dir, shard))
+
+
+def scan_documents(previous: Optional[Dict[str, Dict]] = None, documents_dir: Optional[Path] = None,
+                   shard: Optional[Shard] = None) -> Dict[str, Dict]:
+    previous = previous or {}
+    fingerprints = {}
+
+    for file_path in _list_document_files(documents_dir, shard):
+        stat = file_path.stat()
+        known = previous.get(file_path.name)
+
+        # Only re-hash files whose mtime or size moved since the last scan.
+        if known and known.get("mtime") == stat.st_mtime and known.get("size") == stat.st_size:
+            fingerprints[file_path.name] = dict(known)
+        else:
+            fingerprints[file_path.name] = fingerprint_file(file_path)
+
+    return fingerprints
@@ -0,0 +1,136 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from telemetry import telemetry
+
+
+class EmbeddingCache:
+    def __init__(self, path: Path, max_entries: int):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+
+        with self._lock:
+            # SQLite caps the number of bound parameters per statement.
+            for i in range(0, len(keys), 500):
+                batch = list(set(keys[i:i + 500]))
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                now = time.time_ns()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+        results = {}
+        for i, key in enumerate(keys):
+            if key in found:
+                results[i] = found[key]
+
+        self.hits += len(results)
+        self.misses += len(texts) - len(results)
+        telemetry.increment("embedding_cache_hits", len(results))
+        telemetry.increment("embedding_cache_misses", len(texts) - len(results))
+        return results
+
+    def put_many(self, model: str, texts: List[str], embeddings: np.ndarray):
+        now = time.time_ns()
+        rows = [
+            (self.make_key(model, text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, embeddings)
+        ]
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                """DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+                )""",
+                (overflow,)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self),
+            'max_entries': self.max_entries
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_cache(path: Optional[Path], max_entries: int) -> Optional[EmbeddingCache]:
+    if path is None or max_entries <= 0:
+        return None
+    try:
+        return EmbeddingCache(path, max_entries)
+    except sqlite3.Error as e:
+        print(f"Embedding cache disabled: {e}")
+        return None
@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+
+import config
+from telemetry import telemetry
+
+RATE_WINDOW_SECONDS = 60.0
+NATIVE_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def requested_dimensions(model: str, dimension: int) -> Optional[int]:
+    """The `dimensions` to request from the embeddings API, or None for the model's native size.
+
+    text-embedding-3 models are trained so a prefix of the embedding, renormalized, is itself
+    a good embedding; the API returns that prefix when asked for fewer dimensions.
+    """
+    native = NATIVE_DIMENSIONS.get(model)
+    if native is None or dimension == native:
+        return None
+    if not model.startswith("text-embedding-3") or dimension > native:
+        raise ValueError(f"{model} returns {native}-dimensional embeddings, not {dimension}")
+    return dimension
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque()
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._events and now - self._events[0][0] >= RATE_WINDOW_SECONDS:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def acquire(self, tokens: int):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                # An empty window always admits the request, even one larger than the TPM budget.
+                if not self._events or (
+                    len(self._events) < self.requests_per_minute
+                    and self._tokens_in_window + tokens <= self.tokens_per_minute
+                ):
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                wait = RATE_WINDOW_SECONDS - (now - self._events[0][0])
+            time.sleep(max(wait, 0.05))
+
+
+def pack_batches(token_counts: List[int], max_inputs: int, max_tokens: int) -> List[List[int]]:
+    batches, current, current_tokens = [], [], 0
+
+    for i, tokens in enumerate(token_counts):
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingScheduler:
+    def __init__(self, client, count_tokens: Callable[[str], int], model: Optional[str] = None,
+                 max_inputs: Optional[int] = None, max_tokens: Optional[int] = None,
+                 max_concurrency: Optional[int] = None, requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None, max_retries: Optional[int] = None,
+                 dimension: Optional[int] = None):
+        # Retries are handled here, with rate-limit awareness, instead of in the client.
+        self.client = client.with_options(max_retries=0) if hasattr(client, 'with_options') else client
+        self.count_tokens = count_tokens
+        # Unset limits are read from config when the scheduler is built, not when this module is imported.
+        self.model = model or config.EMBEDDING_MODEL
+        self.dimension = dimension or config.EMBEDDING_DIMENSION
+        self.dimensions = requested_dimensions(self.model, self.dimension)
+        self.max_inputs = max_inputs or config.EMBEDDING_BATCH_SIZE
+        self.max_tokens = max_tokens or config.EMBEDDING_MAX_BATCH_TOKENS
+        self.max_concurrency = max_concurrency or config.EMBEDDING_MAX_CONCURRENCY
+        self.max_retries = config.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.rate_limiter = RateLimiter(
+            requests_per_minute or config.EMBEDDING_RPM, tokens_per_minute or config.EMBEDDING_TPM
+        )
+        self.requests = 0
+        self.retries = 0
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        # "Full jitter" exponential backoff.
+        cap = min(config.EMBEDDING_BACKOFF_MAX, config.EMBEDDING_BACKOFF_BASE * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    def _embed_batch(self, texts: List[str], tokens: int) -> np.ndarray:
+        for attempt in range(self.max_retries + 1):
+            with telemetry.span("embedding_rate_limit_wait"):
+                self.rate_limiter.acquire(tokens)
+            try:
+                self.requests += 1
+                telemetry.increment("embedding_requests")
+                with telemetry.span("embedding_request", inputs=len(texts), tokens=tokens, attempt=attempt):
+                    if self.dimensions is None:
+                        response = self.client.embeddings.create(model=self.model, input=texts)
+                    else:
+                        response = self.client.embeddings.create(
+                            model=self.model, input=texts, dimensions=self.dimensions
+                        )
+                telemetry.increment("embedding_tokens", tokens)
+                return np.array([item.embedding for item in response.data], dtype=np.float32)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    telemetry.increment("embedding_errors", error=e.__class__.__name__)
+                    raise
+                delay = self._backoff(attempt, e)
+                self.retries += 1
+                telemetry.increment("embedding_retries", error=e.__class__.__name__)
+                print(f"Embedding request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed(self, texts: List[str], token_counts: Optional[List[int]] = None,
+              on_batch: Optional[Callable[[List[int], np.ndarray], None]] = None) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        if token_counts is None:
+            token_counts = [self.count_tokens(text) for text in texts]
+
+        batches = pack_batches(token_counts, self.max_inputs, self.max_tokens)
+        results = [None] * len(texts)
+
+        def run(batch: List[int]):
+            vectors = self._embed_batch([texts[i] for i in batch], sum(token_counts[i] for i in batch))
+            # on_batch lets callers checkpoint each finished batch, e.g. into the embedding cache.
+            if on_batch is not None:
+                on_batch(batch, vectors)
+            for i, vector in zip(batch, vectors):
+                results[i] = vector
+
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            for batch in batches:
+                run(batch)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                for future in [executor.submit(telemetry.wrap(run), batch) for batch in batches]:
+                    future.result()
+
+        return np.stack(results)
@@ -0,0 +1,173 @@
+import hashlib
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from embedding_scheduler import requested_dimensions
+from lexical import tokenize
+
+BatchCallback = Callable[[List[int], np.ndarray], None]
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingProvider:
+    name = ""
+    # Whether vectors are worth keeping in the on-disk embedding cache.
+    cacheable = True
+
+    def __init__(self, model: str, dimension: int, batch_size: int):
+        self.model = model
+        self.dimension = dimension
+        self.batch_size = batch_size
+
+    @property
+    def cache_namespace(self) -> str:
+        return f"{self.name}:{self.model}:{self.dimension}"
+
+    def describe(self) -> Dict:
+        return {'provider': self.name, 'model': self.model, 'dimension': self.dimension}
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed(self, texts: List[str], token_counts: Optional[List[int]] = None,
+              on_batch: Optional[BatchCallback] = None) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        results = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(range(start, min(start + self.batch_size, len(texts))))
+            vectors = np.asarray(self._embed_batch([texts[i] for i in batch]), dtype=np.float32)
+            if on_batch is not None:
+                on_batch(batch, vectors)
+            results.append(vectors)
+        return np.concatenate(results)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, scheduler: Callable, model: str = config.EMBEDDING_MODEL,
+                 dimension: int = config.EMBEDDING_DIMENSION):
+        super().__init__(model, dimension, config.EMBEDDING_BATCH_SIZE)
+        # A factory rather than a scheduler, so the client is still built on first use.
+        self._scheduler = scheduler
+
+    @property
+    def cache_namespace(self) -> str:
+        # Kept as the bare model name, so caches written before providers existed stay valid.
+        if requested_dimensions(self.model, self.dimension) is None:
+            return self.model
+        return f"{self.model}:{self.dimension}"
+
+    def embed(self, texts: List[str], token_counts: Optional[List[int]] = None,
+              on_batch: Optional[BatchCallback] = None) -> np.ndarray:
+        return self._scheduler().embed(texts, token_counts, on_batch)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    name = "hashing"
+    cacheable = False
+
+    def __init__(self, dimension: int = config.EMBEDDING_DIMENSION,
+                 batch_size: int = config.LOCAL_EMBEDDING_BATCH_SIZE):
+        super().__init__("unigram-bigram", dimension, batch_size)
+        self._buckets = {}
+
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        # Signed feature hashing with a stable hash (Python's hash() is salted per process).
+        bucket = self._buckets.get(feature)
+        if bucket is None:
+            value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            bucket = ((value >> 1) % self.dimension, 1.0 if value & 1 else -1.0)
+            if len(self._buckets) < 1_000_000:
+                self._buckets[feature] = bucket
+        return bucket
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            features = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+            for feature in features:
+                column, sign = self._bucket(feature)
+                rows.append(row)
+                columns.append(column)
+                signs.append(sign)
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(vectors, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)),
+                  np.array(signs, dtype=np.float32))
+        # Sublinear term frequency, as in TF-IDF, so repeated words do not dominate.
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        return _normalize_rows(vectors)
+
+
+class FakeEmbeddingProvider(EmbeddingProvider):
+    name = "fake"
+    cacheable = False
+
+    def __init__(self, dimension: int = config.EMBEDDING_DIMENSION,
+                 batch_size: int = config.LOCAL_EMBEDDING_BATCH_SIZE,
+                 latency: float = config.FAKE_EMBEDDING_LATENCY):
+        super().__init__("sha256-gaussian", dimension, batch_size)
+        self.latency = latency
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        # Optional fixed per-request latency, to model a remote API reproducibly.
+        if self.latency:
+            time.sleep(self.latency)
+
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vectors[row] = np.random.default_rng(seed).standard_normal(self.dimension, dtype=np.float32)
+        return _normalize_rows(vectors)
+
+
+class SentenceTransformerProvider(EmbeddingProvider):
+    name = "sentence_transformers"
+
+    def __init__(self, model: str = config.LOCAL_EMBEDDING_MODEL,
+                 batch_size: int = config.LOCAL_EMBEDDING_BATCH_SIZE):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "The sentence_transformers embedding provider requires sentence-transformers "
+                "(pip install sentence-transformers)"
+            )
+        self._model = SentenceTransformer(model, device="cpu")
+        super().__init__(model, self._model.get_sentence_embedding_dimension(), batch_size)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                  convert_to_numpy=True)
+
+
+EMBEDDING_PROVIDERS = ("openai", "hashing", "fake", "sentence_transformers")
+
+
+def get_provider(name: Optional[str] = None, scheduler: Optional[Callable] = None) -> EmbeddingProvider:
+    # Settings are read at call time, so scripts can override them in config first.
+    name = name or config.EMBEDDING_PROVIDER
+    if name == "openai":
+        if scheduler is None:
+            raise ValueError("The openai embedding provider needs an embedding scheduler factory")
+        return OpenAIEmbeddingProvider(scheduler, config.EMBEDDING_MODEL, config.EMBEDDING_DIMENSION)
+    if name == "hashing":
+        return HashingEmbeddingProvider(config.EMBEDDING_DIMENSION, config.LOCAL_EMBEDDING_BATCH_SIZE)
+    if name == "fake":
+        return FakeEmbeddingProvider(
+            config.EMBEDDING_DIMENSION, config.LOCAL_EMBEDDING_BATCH_SIZE, config.FAKE_EMBEDDING_LATENCY
+        )
+    if name == "sentence_transformers":
+        return SentenceTransformerProvider(config.LOCAL_EMBEDDING_MODEL, config.LOCAL_EMBEDDING_BATCH_SIZE)
+    raise ValueError(f"Unknown embedding provider '{name}', expected one of {EMBEDDING_PROVIDERS}")
@@ -0,0 +1,121 @@
+import os
+from types import SimpleNamespace
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class FullVectorsWriter:
+    """Streams float32 vectors to disk in ascending chunk_id order.
+
+    Rows go to temporary files that replace the previous side file on close(),
+    so an interrupted build never leaves vectors that disagree with their ids.
+    """
+
+    def __init__(self, paths: SimpleNamespace):
+        self.paths = paths
+        self.dimension = None
+        self.count = 0
+        self._ids = []
+        self._last_id = -1
+        self._tmp_vectors = paths.full_vectors.with_name(paths.full_vectors.name + ".tmp")
+        self._file = open(self._tmp_vectors, "wb")
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        if ids[0] <= self._last_id or np.any(np.diff(ids) <= 0):
+            raise ValueError("Full vectors must be appended in ascending chunk_id order")
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.dimension = vectors.shape[1]
+        self._file.write(vectors.tobytes())
+        self._ids.append(ids)
+        self._last_id = int(ids[-1])
+        self.count += len(ids)
+
+    def close(self):
+        self._file.close()
+        ids = np.concatenate(self._ids) if self._ids else np.zeros(0, dtype=np.int64)
+        tmp_ids = self.paths.full_vector_ids.with_name(self.paths.full_vector_ids.name + ".tmp")
+        with open(tmp_ids, "wb") as f:
+            np.save(f, ids)
+        os.replace(self._tmp_vectors, self.paths.full_vectors)
+        os.replace(tmp_ids, self.paths.full_vector_ids)
+
+    def abort(self):
+        self._file.close()
+        self._tmp_vectors.unlink(missing_ok=True)
+
+
+class FullVectors:
+    """Float32 vectors memory-mapped beside a lossy index, for exact rescoring.
+
+    Only the rows of rescored candidates are read, so the file stays in the page
+    cache rather than in process memory.
+    """
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray):
+        self.ids = ids
+        self.vectors = vectors
+
+    @classmethod
+    def write(cls, paths: SimpleNamespace, ids: np.ndarray, vectors: np.ndarray):
+        order = np.argsort(ids)
+        writer = FullVectorsWriter(paths)
+        writer.append(np.asarray(ids)[order], np.asarray(vectors)[order])
+        writer.close()
+
+    @classmethod
+    def open(cls, paths: SimpleNamespace, dimension: int) -> Optional["FullVectors"]:
+        if not paths.full_vectors.exists() or not paths.full_vector_ids.exists():
+            return None
+        ids = np.load(paths.full_vector_ids)
+        if paths.full_vectors.stat().st_size != len(ids) * dimension * 4:
+            print("Full vectors do not match their ids; rescoring is disabled until the index is rebuilt")
+            return None
+        if not len(ids):
+            return cls(ids, np.zeros((0, dimension), dtype=np.float32))
+        vectors = np.memmap(paths.full_vectors, dtype=np.float32, mode="r", shape=(len(ids), dimension))
+        return cls(ids, vectors)
+
+    @staticmethod
+    def remove(paths: SimpleNamespace):
+        paths.full_vectors.unlink(missing_ok=True)
+        paths.full_vector_ids.unlink(missing_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.ids.nbytes
+
+    def get(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectors for `ids` and a mask of which ids were found."""
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, ids), max(len(self.ids) - 1, 0))
+        found = (self.ids[positions] == ids) if len(self.ids) else np.zeros(len(ids), dtype=bool)
+        vectors = np.zeros((len(ids), self.vectors.shape[1]), dtype=np.float32)
+        if found.any():
+            vectors[found] = self.vectors[positions[found]]
+        return vectors, found
+
+    def rescore(self, queries: np.ndarray, candidates: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact inner products of each query with its candidate ids (-1 padded), best top_k first."""
+        scores = np.full(candidates.shape, -np.inf, dtype=np.float32)
+        flat = candidates.ravel()
+        valid = flat >= 0
+        vectors, found = self.get(flat[valid])
+        rows = np.repeat(np.arange(len(candidates)), candidates.shape[1])[valid]
+        flat_scores = scores.ravel()
+        positions = np.flatnonzero(valid)[found]
+        flat_scores[positions] = np.einsum('ij,ij->i', vectors[found], queries[rows[found]])
+        scores = flat_scores.reshape(candidates.shape)
+
+        top_k = min(top_k, candidates.shape[1])
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+        top_scores = np.take_along_axis(scores, order, axis=1)
+        top_ids = np.take_along_axis(candidates, order, axis=1)
+        top_ids[~np.isfinite(top_scores)] = -1
+        return top_scores, top_ids
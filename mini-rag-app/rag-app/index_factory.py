@@ -0,0 +1,282 @@
+import math
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import config
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+VECTOR_STORAGES = ("float32", "int8", "binary")
+
+# FAISS warns when k-means gets fewer than ~39 training points per centroid.
+MIN_POINTS_PER_CENTROID = 39
+
+
+def _ivf_nlist(n_vectors: int) -> int:
+    return max(1, min(config.IVF_NLIST, n_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def _check_storage(index_type: str, storage: str, dimension: int):
+    if storage not in VECTOR_STORAGES:
+        raise ValueError(f"Unknown vector storage '{storage}', expected one of {VECTOR_STORAGES}")
+    if storage == "float32":
+        return
+    if index_type == "ivf_pq":
+        raise ValueError("ivf_pq already stores compressed codes; use VECTOR_STORAGE = \"float32\" with it")
+    if storage == "binary" and index_type != "flat":
+        # FAISS's binary IVF and HNSW indexes cannot apply ID selectors, which metadata filters need.
+        raise ValueError("Binary vector storage supports only the flat index type")
+    if storage == "binary" and dimension % 8:
+        raise ValueError(f"Binary vector storage needs a dimension divisible by 8, got {dimension}")
+
+
+def needs_training(index_type: Optional[str] = None, storage: Optional[str] = None) -> bool:
+    # Scalar quantizers learn each dimension's value range.
+    return (index_type or config.INDEX_TYPE) in ("ivf_flat", "ivf_pq") or (storage or config.VECTOR_STORAGE) == "int8"
+
+
+def build_index(dimension: int, n_vectors: int, index_type: Optional[str] = None,
+                storage: Optional[str] = None):
+    index_type = index_type or config.INDEX_TYPE
+    storage = storage or config.VECTOR_STORAGE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    _check_storage(index_type, storage, dimension)
+
+    if index_type == "ivf_pq" and n_vectors < 2 ** config.PQ_NBITS:
+        print(f"Only {n_vectors} vectors, too few to train a {config.PQ_NBITS}-bit PQ; using ivf_flat")
+        index_type = "ivf_flat"
+
+    if storage == "binary":
+        # One bit per dimension (the sign), compared by Hamming distance.
+        return faiss.IndexBinaryFlat(dimension)
+
+    sq8 = faiss.ScalarQuantizer.QT_8bit
+    if index_type == "flat":
+        if storage == "int8":
+            return faiss.IndexScalarQuantizer(dimension, sq8, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexFlatIP(dimension)
+
+    if index_type == "hnsw":
+        if storage == "int8":
+            index = faiss.IndexHNSWSQ(dimension, sq8, config.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, config.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = config.HNSW_EF_SEARCH
+        return index
+
+    quantizer = faiss.IndexFlatIP(dimension)
+    nlist = _ivf_nlist(n_vectors)
+    if index_type == "ivf_flat" and storage == "int8":
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, sq8, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        if dimension % config.PQ_M != 0:
+            raise ValueError(f"PQ_M={config.PQ_M} must divide the embedding dimension {dimension}")
+        index = faiss.IndexIVFPQ(
+            quantizer, dimension, nlist, config.PQ_M, config.PQ_NBITS, faiss.METRIC_INNER_PRODUCT
+        )
+    index.nprobe = min(config.IVF_NPROBE, nlist)
+    return index
+
+
+def _is_binary(index) -> bool:
+    return isinstance(index, faiss.IndexBinary)
+
+
+def _encode(index, vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if _is_binary(index):
+        return np.packbits(vectors > 0, axis=1)
+    return vectors
+
+
+def train_index(index, vectors: np.ndarray):
+    if index.is_trained:
+        return
+
+    sample = vectors
+    if len(vectors) > config.INDEX_TRAIN_SAMPLE:
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), config.INDEX_TRAIN_SAMPLE, replace=False)]
+
+    index.train(_encode(index, sample))
+
+
+def id_map(index):
+    # Vectors are addressed by chunk_id so updates can remove them later.
+    return faiss.IndexBinaryIDMap2(index) if _is_binary(index) else faiss.IndexIDMap2(index)
+
+
+def is_id_mapped(index) -> bool:
+    return isinstance(index, (faiss.IndexIDMap2, faiss.IndexBinaryIDMap2))
+
+
+def add_vectors(index, vectors: np.ndarray, ids: np.ndarray):
+    index.add_with_ids(_encode(index, vectors), ids)
+
+
+def search_index(index, queries: np.ndarray, top_k: int,
+                 params: Optional[faiss.SearchParameters] = None) -> Tuple[np.ndarray, np.ndarray]:
+    scores, ids = index.search(_encode(index, queries), top_k, params=params)
+    if _is_binary(index):
+        # Hamming distance to the fraction of agreeing signs, rescaled to [-1, 1] like a cosine.
+        scores = 1.0 - 2.0 * scores.astype(np.float32) / index.d
+    return scores, ids
+
+
+def write_index_file(index, path: Path):
+    if _is_binary(index):
+        faiss.write_index_binary(index, str(path))
+    else:
+        faiss.write_index(index, str(path))
+
+
+def read_index_file(path: Path, flags: int = 0):
+    # Binary index files are tagged with a fourcc starting "IB".
+    with open(path, 'rb') as f:
+        binary = f.read(2) == b"IB"
+    if binary:
+        return faiss.read_index_binary(str(path), flags)
+    return faiss.read_index(str(path), flags)
+
+
+def base_index(index):
+    if isinstance(index, faiss.IndexBinaryIDMap):
+        return faiss.downcast_IndexBinary(index.index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index) -> str:
+    base = base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def storage_of(index) -> str:
+    base = base_index(index)
+    if _is_binary(base):
+        return "binary"
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    if isinstance(base, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "int8"
+    return "float32"
+
+
+def rescore_depth(index, top_k: int) -> int:
+    """How many first-pass candidates are rescored against full vectors to return top_k."""
+    storage = storage_of(index)
+    if storage == "binary":
+        return top_k * config.BINARY_RESCORE_MULTIPLIER
+    if storage == "int8":
+        return top_k * config.RESCORE_MULTIPLIER
+    return top_k
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    return index_type_of(index) != "hnsw"
+
+
+def make_id_selector(ids: np.ndarray) -> faiss.IDSelector:
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    # IDSelectorBatch copies the ids into a hash set, so the array need not outlive it.
+    return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+
+
+def make_search_params(index: faiss.Index, nprobe: Optional[int] = None,
+                       ef_search: Optional[int] = None, selector: Optional[faiss.IDSelector] = None,
+                       selectivity: float = 1.0) -> Optional[faiss.SearchParameters]:
+    base = base_index(index)
+    # With only a fraction of the vectors eligible, IVF and HNSW must visit
+    # proportionally more of the index to find top_k of them.
+    widen = min(1.0 / max(selectivity, 1e-9), config.FILTER_MAX_SEARCH_WIDENING)
+
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = min(math.ceil((nprobe or config.IVF_NPROBE) * widen), base.nlist)
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = math.ceil((ef_search or config.HNSW_EF_SEARCH) * widen)
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+
+    if selector is not None:
+        # IndexIDMap translates the selector from chunk ids to internal positions.
+        params.sel = selector
+    return params
+
+
+# (queries, top_k, nprobe, ef_search) -> ids of the top_k results per query
+SearchFunction = Callable[[np.ndarray, int, Optional[int], Optional[int]], np.ndarray]
+
+
+def _index_search(index) -> SearchFunction:
+    def search(queries: np.ndarray, top_k: int, nprobe: Optional[int], ef_search: Optional[int]) -> np.ndarray:
+        return search_index(index, queries, top_k, make_search_params(index, nprobe, ef_search))[1]
+    return search
+
+
+def recall_at_k(index, vectors: np.ndarray, ids: np.ndarray, top_k: int,
+                n_queries: int = 100, nprobe: Optional[int] = None,
+                ef_search: Optional[int] = None, search: Optional[SearchFunction] = None) -> Dict[str, float]:
+    rng = np.random.default_rng(0)
+    n_queries = min(n_queries, len(vectors))
+    queries = vectors[rng.choice(len(vectors), n_queries, replace=False)]
+
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+
+    start = time.perf_counter()
+    _, exact_positions = flat.search(queries, top_k)
+    flat_seconds = time.perf_counter() - start
+    exact = ids[exact_positions]
+
+    search = search or _index_search(index)
+    start = time.perf_counter()
+    approx = search(queries, top_k, nprobe, ef_search)
+    approx_seconds = time.perf_counter() - start
+
+    hits = sum(
+        len(set(exact_row.tolist()) & set(approx_row.tolist()))
+        for exact_row, approx_row in zip(exact, approx)
+    )
+
+    return {
+        'recall': hits / float(n_queries * min(top_k, len(vectors))),
+        'flat_ms_per_query': 1000 * flat_seconds / n_queries,
+        'index_ms_per_query': 1000 * approx_seconds / n_queries
+    }
+
+
+def recall_sweep(index, vectors: np.ndarray, ids: np.ndarray, top_k: int, n_queries: int = 100,
+                 search: Optional[SearchFunction] = None) -> List[Dict[str, float]]:
+    index_type = index_type_of(index)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = base_index(index).nlist
+        settings = [{'nprobe': n} for n in (1, 4, 16, 64, 256) if n <= nlist]
+    elif index_type == "hnsw":
+        settings = [{'ef_search': ef} for ef in (16, 32, 64, 128, 256)]
+    else:
+        settings = [{}]
+
+    rows = []
+    for setting in settings:
+        row = dict(setting)
+        row.update(recall_at_k(index, vectors, ids, top_k, n_queries, search=search, **setting))
+        rows.append(row)
+    return rows
@@ -0,0 +1,238 @@
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import config
+from chunking import chunk_texts, token_byte_lengths
+from dedup import Deduplicator, chunk_sources
+from document_loader import iter_documents
+from full_vectors import FullVectors, FullVectorsWriter
+from index_factory import build_index, train_index, id_map, add_vectors, needs_training
+from metadata_store import MetadataStore, MetadataStoreWriter
+
+_worker_tokenizer = None
+
+
+def _init_worker():
+    global _worker_tokenizer
+    import tiktoken
+    _worker_tokenizer = tiktoken.encoding_for_model("gpt-4")
+    token_byte_lengths(_worker_tokenizer)
+
+
+def _chunk_section(text: str) -> List[Tuple[str, int]]:
+    return chunk_texts(_worker_tokenizer, [text])[0]
+
+
+class StreamingIndexBuilder:
+    def __init__(self, dimension: int, index_type: Optional[str] = None, storage: Optional[str] = None,
+                 full_vectors: Optional[FullVectorsWriter] = None):
+        self.dimension = dimension
+        self.index_type = index_type or config.INDEX_TYPE
+        self.storage = storage or config.VECTOR_STORAGE
+        # Lossy storages keep the float32 vectors on disk for rescoring.
+        self.full_vectors = full_vectors
+        self.index = None
+        self._pending = []
+        self._pending_count = 0
+
+        # IVF/PQ and scalar quantizers need a training sample first; other types can take vectors right away.
+        if not needs_training(self.index_type, self.storage):
+            self.index = id_map(build_index(dimension, 0, self.index_type, self.storage))
+
+    def add(self, embeddings: np.ndarray, ids: np.ndarray):
+        if self.full_vectors is not None:
+            self.full_vectors.append(ids, embeddings)
+        if self.index is not None:
+            add_vectors(self.index, embeddings, ids)
+            return
+
+        self._pending.append((embeddings, ids))
+        self._pending_count += len(ids)
+        if self._pending_count >= config.INDEX_TRAIN_SAMPLE:
+            self._train()
+
+    def _train(self):
+        embeddings = np.concatenate([batch for batch, _ in self._pending])
+        ids = np.concatenate([batch_ids for _, batch_ids in self._pending])
+        self._pending = []
+
+        base = build_index(self.dimension, len(embeddings), self.index_type, self.storage)
+        train_index(base, embeddings)
+        self.index = id_map(base)
+        add_vectors(self.index, embeddings, ids)
+
+    def finish(self) -> faiss.Index:
+        if self.index is None:
+            if not self._pending_count:
+                raise ValueError("No chunks were produced, nothing to index")
+            self._train()
+        return self.index
+
+
+class IngestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = set()
+        self.sections = 0
+        self.characters = 0
+        self.chunks = 0
+        self.duplicates = 0
+        self.embedded = 0
+
+    def as_dict(self) -> Dict[str, float]:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            'files': len(self.files),
+            'sections': self.sections,
+            'chunks': self.chunks,
+            'duplicate_chunks': self.duplicates,
+            'embedded': self.embedded,
+            'characters': self.characters,
+            'elapsed': elapsed,
+            'chunks_per_second': self.embedded / elapsed,
+            'mb_per_second': self.characters / elapsed / 1e6
+        }
+
+
+def print_progress(stats: Dict[str, float]):
+    print(
+        f"  {stats['files']} files, {stats['sections']} sections, "
+        f"{stats['chunks']} chunks ({stats['embedded']} embedded, {stats['duplicate_chunks']} duplicates) "
+        f"in {stats['elapsed']:.1f}s - "
+        f"{stats['chunks_per_second']:.0f} chunks/s, {stats['mb_per_second']:.2f} MB/s"
+    )
+
+
+def _add_duplicate_sources(paths, duplicate_sources: Dict[int, List[str]]):
+    # Kept chunks were written before their duplicates turned up, so the store is rewritten once.
+    metadata = MetadataStore.open(paths)
+    writer = MetadataStoreWriter(paths)
+    for chunk in metadata:
+        extra = duplicate_sources.get(chunk['chunk_id'])
+        if extra:
+            sources = chunk_sources(chunk)
+            chunk['sources'] = sources + [source for source in dict.fromkeys(extra) if source not in sources]
+        writer.add(chunk)
+    writer.close()
+    metadata.close()
+
+
+def ingest_documents(rag, documents: Optional[Iterable[Dict]] = None,
+                     workers: int = config.INGEST_WORKERS,
+                     batch_size: int = config.INGEST_EMBED_BATCH_SIZE,
+                     progress: Optional[Callable[[Dict[str, float]], None]] = print_progress) -> Dict[str, float]:
+    """Chunk, embed and index `documents` (the documents directory by default) as a stream.
+
+    Document text, sections and embedding batches in flight are bounded. What is kept for
+    the whole corpus still grows linearly with the number of chunks: the vector index, the
+    dedup signatures and LSH buckets, and the lexical and filter indexes, which are built
+    from the metadata store after the last batch (holding every chunk's text while the
+    lexical index is built).
+    """
+    documents = iter_documents(rag.paths.documents_dir, rag.shard) if documents is None else documents
+    stats = IngestStats()
+    writer = MetadataStoreWriter(rag.paths)
+    full_vectors = FullVectorsWriter(rag.paths) if config.VECTOR_STORAGE != "float32" else None
+    builder = StreamingIndexBuilder(rag.embedding_provider.dimension, full_vectors=full_vectors)
+    dedup = Deduplicator() if config.DEDUP_ENABLED else None
+    # chunk_id of a kept chunk -> sources of its later duplicates
+    duplicate_sources = {}
+    fingerprints = {}
+    batch = []
+    embed_futures = deque()
+    next_chunk_id = 0
+    last_report = time.perf_counter()
+
+    def drain(max_in_flight: int):
+        while len(embed_futures) > max_in_flight:
+            embeddings, ids = embed_futures.popleft().result()
+            builder.add(embeddings, ids)
+            stats.embedded += len(ids)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as chunk_pool, \
+            ThreadPoolExecutor(max_workers=config.INGEST_EMBED_CONCURRENCY) as embed_pool:
+
+        def collect(source: str, tags: Optional[List[str]], future):
+            nonlocal batch, next_chunk_id, last_report
+            for text, token_count in future.result():
+                chunk_id = next_chunk_id
+                next_chunk_id += 1
+                stats.chunks += 1
+                match = dedup.add(chunk_id, text, tags) if dedup is not None else None
+                if match is not None:
+                    duplicate_sources.setdefault(match[0], []).append(source)
+                    stats.duplicates += 1
+                    continue
+
+                record = {'text': text, 'source': source, 'chunk_id': chunk_id}
+                if tags:
+                    record['tags'] = tags
+                writer.add(record)
+                batch.append(dict(record, token_count=token_count))
+
+                if len(batch) >= batch_size:
+                    # Embedding runs in the background while later sections are chunked.
+                    embed_futures.append(embed_pool.submit(rag._embed_chunks, batch))
+                    batch = []
+                    drain(config.INGEST_MAX_PENDING_BATCHES)
+
+            stats.sections += 1
+            if progress and time.perf_counter() - last_report >= config.INGEST_PROGRESS_INTERVAL:
+                progress(stats.as_dict())
+                last_report = time.perf_counter()
+
+        # Results are collected in submission order so chunk ids are deterministic,
+        # and at most 2 sections per worker are held in memory at once.
+        pending = deque()
+        for doc in documents:
+            fingerprints[doc['filename']] = {key: doc[key] for key in ('mtime', 'size', 'sha256')}
+            stats.files.add(doc['filename'])
+            stats.characters += len(doc['content'])
+            pending.append((doc['filename'], doc.get('tags'), chunk_pool.submit(_chunk_section, doc['content'])))
+            if len(pending) >= 2 * workers:
+                collect(*pending.popleft())
+
+        while pending:
+            collect(*pending.popleft())
+
+        if batch:
+            embed_futures.append(embed_pool.submit(rag._embed_chunks, batch))
+            batch = []
+        drain(0)
+
+    index = builder.finish()
+    writer.close()
+    if duplicate_sources:
+        _add_duplicate_sources(rag.paths, duplicate_sources)
+    metadata = MetadataStore.open(rag.paths)
+    if full_vectors is not None:
+        full_vectors.close()
+    else:
+        FullVectors.remove(rag.paths)
+
+    rag._write_faiss_index(index)
+    lexical_index = rag._build_lexical_index(metadata)
+    lexical_index.save(rag.paths.lexical_index)
+    filter_index = rag._build_filter_index(metadata)
+    filter_index.save(rag.paths.filter_index)
+    if dedup is not None:
+        dedup.save(rag.paths.dedup_index)
+    else:
+        rag.paths.dedup_index.unlink(missing_ok=True)
+    rag._write_manifest({'next_chunk_id': next_chunk_id, 'documents': fingerprints})
+
+    rag.index = index
+    rag.metadata = metadata
+    rag._saved_lexical = (metadata, lexical_index)
+    rag._saved_filter = (metadata, filter_index)
+    rag._full_vectors = FullVectors.open(rag.paths, index.d) if full_vectors is not None else None
+
+    final_stats = stats.as_dict()
+    if progress:
+        progress(final_stats)
+    return final_stats
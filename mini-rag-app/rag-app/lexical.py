@@ -0,0 +1,203 @@
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import config
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-.]\w+)*")
+MAX_TERM_LENGTH = 64
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if len(term) <= MAX_TERM_LENGTH]
+
+
+def bm25_scores(query: str, documents: List[str], k1: float = config.BM25_K1,
+                b: float = config.BM25_B) -> List[float]:
+    query_terms = set(tokenize(query))
+    doc_terms = [Counter(tokenize(text)) for text in documents]
+    if not doc_terms or not query_terms:
+        return [0.0] * len(documents)
+
+    n_docs = len(doc_terms)
+    avg_length = sum(sum(terms.values()) for terms in doc_terms) / n_docs or 1.0
+
+    scores = []
+    for terms in doc_terms:
+        length = sum(terms.values())
+        score = 0.0
+        for term in query_terms:
+            tf = terms.get(term, 0)
+            if not tf:
+                continue
+            df = sum(1 for other in doc_terms if term in other)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+        scores.append(score)
+
+    return scores
+
+
+class LexicalIndex:
+    def __init__(self, terms: np.ndarray, term_offsets: np.ndarray, postings_docs: np.ndarray,
+                 postings_tf: np.ndarray, doc_ids: np.ndarray, doc_lengths: np.ndarray):
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.vocabulary = {term: i for i, term in enumerate(terms.tolist())}
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+        self.total_length = int(doc_lengths.sum())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (
+            self.terms, self.term_offsets, self.postings_docs, self.postings_tf, self.doc_ids, self.doc_lengths
+        ))
+
+    @classmethod
+    def build(cls, chunk_ids: List[int], texts: List[str]) -> "LexicalIndex":
+        vocabulary = {}
+        term_ids, doc_positions, frequencies = [], [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+
+        for position, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths[position] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_positions.append(position)
+                frequencies.append(tf)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=term_offsets[1:])
+
+        terms = np.array(sorted(vocabulary, key=vocabulary.get), dtype=str)
+        return cls(
+            terms,
+            term_offsets,
+            np.array(doc_positions, dtype=np.int32)[order],
+            np.array(frequencies, dtype=np.int32)[order],
+            np.array(chunk_ids, dtype=np.int64),
+            doc_lengths
+        )
+
+    def save(self, path: Path):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=self.terms,
+                term_offsets=self.term_offsets,
+                postings_docs=self.postings_docs,
+                postings_tf=self.postings_tf,
+                doc_ids=self.doc_ids,
+                doc_lengths=self.doc_lengths
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["terms"],
+                data["term_offsets"],
+                data["postings_docs"],
+                data["postings_tf"],
+                data["doc_ids"],
+                data["doc_lengths"]
+            )
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def document_frequency(self, term: str) -> int:
+        term_id = self.vocabulary.get(term)
+        return 0 if term_id is None else int(self.term_offsets[term_id + 1] - self.term_offsets[term_id])
+
+    def search(self, query: str, top_k: int, k1: float = config.BM25_K1, b: float = config.BM25_B,
+               allowed_ids: Optional[np.ndarray] = None,
+               corpus: Optional["CorpusStats"] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # `corpus` replaces this index's own statistics when it holds one part of a larger corpus.
+        n_docs = len(self.doc_ids) if corpus is None else corpus.n_docs
+        avg_length = self.avg_length if corpus is None else corpus.avg_length
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+
+            df = end - start if corpus is None else corpus.document_frequencies.get(term, end - start)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * self.doc_lengths[docs] / avg_length)
+            # Each term appears at most once per document, so plain fancy-index add is safe.
+            scores[docs] += idf * tf * (k1 + 1) / (tf + norm)
+
+        matched = np.flatnonzero(scores)
+        if allowed_ids is not None:
+            # Only documents that matched a query term are checked against the filter.
+            matched = matched[np.isin(self.doc_ids[matched], allowed_ids)]
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+
+        return self.doc_ids[matched], scores[matched]
+
+
+class CorpusStats:
+    """BM25 statistics of a corpus split across several lexical indexes, e.g. collection shards.
+
+    Scores computed with them are the ones a single index over the whole corpus would give,
+    so results from different indexes can be merged by score.
+    """
+
+    def __init__(self, n_docs: int, avg_length: float, document_frequencies: Dict[str, int]):
+        self.n_docs = n_docs
+        self.avg_length = avg_length
+        self.document_frequencies = document_frequencies
+
+    @classmethod
+    def combine(cls, indexes: List[LexicalIndex], queries: Iterable[str]) -> "CorpusStats":
+        """The statistics of all `indexes` together, for the terms of `queries`."""
+        n_docs = sum(len(index) for index in indexes)
+        total_length = sum(index.total_length for index in indexes)
+        terms = {term for query in queries for term in tokenize(query)}
+        return cls(
+            n_docs,
+            total_length / n_docs if n_docs else 1.0,
+            {term: sum(index.document_frequency(term) for index in indexes) for term in terms}
+        )
+
+
+def fuse_rankings(dense: List[Tuple[int, float]], lexical: List[Tuple[int, float]], top_k: int,
+                  method: Optional[str] = None) -> List[Tuple[int, float]]:
+    method = method or config.HYBRID_FUSION
+    fused = {}
+
+    if method == "rrf":
+        for ranking in (dense, lexical):
+            for rank, (chunk_id, _) in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (config.HYBRID_RRF_K + rank + 1)
+    elif method == "weighted":
+        for ranking, weight in ((dense, config.HYBRID_DENSE_WEIGHT), (lexical, 1 - config.HYBRID_DENSE_WEIGHT)):
+            if not ranking:
+                continue
+            scores = [score for _, score in ranking]
+            low, high = min(scores), max(scores)
+            for chunk_id, score in ranking:
+                normalised = (score - low) / (high - low) if high > low else 1.0
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + weight * normalised
+    else:
+        raise ValueError(f"Unknown fusion method '{method}', expected 'rrf' or 'weighted'")
+
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
@@ -0,0 +1,178 @@
+import json
+import mmap
+import os
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+import config
+
+CORE_FIELDS = ('text', 'source', 'chunk_id')
+
+ROW_BLOCK_SIZE = 65536
+
+ROW_DTYPE = np.dtype([
+    ('chunk_id', '<i8'),
+    ('text_offset', '<i8'),
+    ('text_length', '<i4'),
+    ('source', '<i4'),
+    ('extra_offset', '<i8'),
+    ('extra_length', '<i4'),
+])
+
+
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(path.name + ".tmp")
+
+
+def _map_file(path: Path):
+    if path.stat().st_size == 0:
+        return b""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MetadataStoreWriter:
+    def __init__(self, paths: Optional[SimpleNamespace] = None):
+        self._paths = paths = paths or config.index_paths()
+        paths.index_dir.mkdir(parents=True, exist_ok=True)
+        self._text_file = open(_tmp_path(paths.chunk_text), 'wb')
+        self._extra_file = open(_tmp_path(paths.chunk_extra), 'wb')
+        self._row_blocks = []
+        self._block = np.zeros(ROW_BLOCK_SIZE, dtype=ROW_DTYPE)
+        self._block_fill = 0
+        self._sources = {}
+        self._text_offset = 0
+        self._extra_offset = 0
+        self._last_chunk_id = None
+
+    def add(self, record: Dict):
+        if self._last_chunk_id is not None and record['chunk_id'] <= self._last_chunk_id:
+            raise ValueError("Records must be added in increasing chunk_id order")
+        self._last_chunk_id = record['chunk_id']
+
+        text = record['text'].encode('utf-8')
+        extra_fields = {key: value for key, value in record.items() if key not in CORE_FIELDS}
+        extra = json.dumps(extra_fields, separators=(',', ':')).encode('utf-8') if extra_fields else b""
+
+        if self._block_fill == ROW_BLOCK_SIZE:
+            self._row_blocks.append(self._block)
+            self._block = np.zeros(ROW_BLOCK_SIZE, dtype=ROW_DTYPE)
+            self._block_fill = 0
+        self._block[self._block_fill] = (
+            record['chunk_id'],
+            self._text_offset, len(text),
+            self._sources.setdefault(record['source'], len(self._sources)),
+            self._extra_offset, len(extra)
+        )
+        self._block_fill += 1
+        self._text_file.write(text)
+        self._extra_file.write(extra)
+        self._text_offset += len(text)
+        self._extra_offset += len(extra)
+
+    def close(self):
+        self._text_file.close()
+        self._extra_file.close()
+
+        paths = self._paths
+        rows = np.concatenate(self._row_blocks + [self._block[:self._block_fill]])
+        with open(_tmp_path(paths.chunk_rows), 'wb') as f:
+            np.save(f, rows)
+        with open(_tmp_path(paths.sources), 'w', encoding='utf-8') as f:
+            json.dump(list(self._sources), f)
+
+        # Rename into place rather than rewriting, so processes that have the
+        # old files memory-mapped keep a consistent view until they reload.
+        for path in (paths.chunk_text, paths.chunk_extra, paths.sources, paths.chunk_rows):
+            os.replace(_tmp_path(path), path)
+
+
+class MetadataStore:
+    def __init__(self, rows: np.ndarray, text_blob, extra_blob, sources: List[str]):
+        self.rows = rows
+        self.sources = sources
+        self._text_blob = text_blob
+        self._extra_blob = extra_blob
+
+    @staticmethod
+    def exists(paths: Optional[SimpleNamespace] = None) -> bool:
+        paths = paths or config.index_paths()
+        return all(path.exists() for path in (
+            paths.chunk_rows, paths.chunk_text, paths.chunk_extra, paths.sources
+        ))
+
+    @staticmethod
+    def write(records: Iterable[Dict], paths: Optional[SimpleNamespace] = None):
+        writer = MetadataStoreWriter(paths)
+        for record in sorted(records, key=lambda record: record['chunk_id']):
+            writer.add(record)
+        writer.close()
+
+    @classmethod
+    def open(cls, paths: Optional[SimpleNamespace] = None) -> "MetadataStore":
+        paths = paths or config.index_paths()
+        rows = np.load(paths.chunk_rows, mmap_mode='r')
+        with open(paths.sources, 'r', encoding='utf-8') as f:
+            sources = json.load(f)
+        return cls(rows, _map_file(paths.chunk_text), _map_file(paths.chunk_extra), sources)
+
+    @classmethod
+    def migrate_json(cls, json_path: Path, paths: Optional[SimpleNamespace] = None) -> "MetadataStore":
+        with open(json_path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        cls.write(records, paths)
+        os.replace(json_path, json_path.with_name(json_path.name + ".migrated"))
+        print(f"Migrated {len(records)} chunks from {json_path.name} to the binary metadata store")
+        return cls.open(paths)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, position: int) -> Dict:
+        row = self.rows[position]
+        start = int(row['text_offset'])
+        record = {
+            'text': self._text_blob[start:start + int(row['text_length'])].decode('utf-8'),
+            'source': self.sources[int(row['source'])],
+            'chunk_id': int(row['chunk_id'])
+        }
+
+        extra_length = int(row['extra_length'])
+        if extra_length:
+            start = int(row['extra_offset'])
+            record.update(json.loads(self._extra_blob[start:start + extra_length]))
+        return record
+
+    def __iter__(self) -> Iterator[Dict]:
+        for position in range(len(self.rows)):
+            yield self[position]
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self.rows['chunk_id']
+
+    def source_of(self, position: int) -> str:
+        return self.sources[int(self.rows[position]['source'])]
+
+    def position_of(self, chunk_id: int) -> Optional[int]:
+        chunk_ids = self.rows['chunk_id']
+        position = int(np.searchsorted(chunk_ids, chunk_id))
+        if position < len(chunk_ids) and chunk_ids[position] == chunk_id:
+            return position
+        return None
+
+    def get_by_id(self, chunk_id: int) -> Optional[Dict]:
+        position = self.position_of(chunk_id)
+        return None if position is None else self[position]
+
+    @property
+    def nbytes(self) -> int:
+        return self.rows.nbytes + len(self._text_blob) + len(self._extra_blob)
+
+    def close(self):
+        for blob in (self._text_blob, self._extra_blob):
+            if isinstance(blob, mmap.mmap):
+                blob.close()
@@ -1,141 +1,857 @@
 import os
 import json
+import time
+import threading
 import numpy as np
 import faiss
-import tiktoken
-from typing import List, Dict, Tuple, Optional
-from openai import OpenAI
+from pathlib import Path
+from typing import Iterable, Iterator, List, Dict, Tuple, Optional
 from dotenv import load_dotenv
 import config
+from embedding_cache import open_cache
+from answer_cache import AnswerCache
+from index_factory import (
+    build_index, train_index, id_map, is_id_mapped, add_vectors, search_index, read_index_file,
+    write_index_file, storage_of, rescore_depth, make_search_params, supports_removal, recall_sweep
+)
+from full_vectors import FullVectors, FullVectorsWriter
+from dedup import Deduplicator, chunk_sources, collapse_duplicates
+from document_loader import Shard, load_document, load_documents, load_tags, scan_documents
+from lexical import CorpusStats, LexicalIndex, fuse_rankings
+from chunk_filter import ChunkFilter, FilterIndex
+from metadata_store import MetadataStore
+from chunking import chunk_texts
+from context_builder import build_context
+from embedding_scheduler import EmbeddingScheduler
+from embeddings import EmbeddingProvider, get_provider
+from telemetry import telemetry
 
 load_dotenv()
 
+# Manifests written before embedding providers existed were always built with OpenAI.
+LEGACY_EMBEDDING = {
+    'provider': "openai",
+    'model': config.EMBEDDING_MODEL,
+    'dimension': config.EMBEDDING_DIMENSION
+}
+
 class RAGEngine:
-    def __init__(self):
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
+    def __init__(self, index_dir: Optional[Path] = None, documents_dir: Optional[Path] = None,
+                 shard: Optional[Shard] = None):
+        start = time.perf_counter()
+        # Where this engine's index and documents live; the configured locations by default.
+        self.paths = config.index_paths(index_dir, documents_dir)
+        self.shard = shard
+        self._api_key = os.getenv('OPENAI_API_KEY')
+        # Local embedding providers can build and search indexes without an API key.
+        if not self._api_key and config.EMBEDDING_PROVIDER == "openai":
             raise ValueError("OPENAI_API_KEY not found in environment")
 
-        self.client = OpenAI(api_key=api_key)
-        self.tokenizer = tiktoken.encoding_for_model("gpt-4")
-        self.index = None
-        self.metadata = None
+        # The OpenAI client and tokenizer are slow to import and build, so they
+        # are created on first use instead of at startup.
+        self._client = None
+        self._tokenizer = None
+        self._embedding_scheduler = None
+        self._embedding_scheduler_client = None
+        self._embedding_provider = None
+        self.startup_timings = {}
+        self._index = None
+        self._index_mmapped = False
+        self._metadata = None
+        self._id_positions = None
+        self._lexical_index = None
+        self._saved_lexical = None
+        self._filter_index = None
+        self._saved_filter = None
+        # Float32 vectors for rescoring a lossy index, and those of a built index not yet saved.
+        self._full_vectors = None
+        self._pending_full_vectors = None
+        # Duplicate detection state for the chunks about to be saved, and what the last pass removed.
+        self._pending_dedup = None
+        self.last_dedup_report = None
+        # Per-thread, so concurrent requests in the HTTP service each see their own stats.
+        self._request_stats = threading.local()
+        self.embedding_cache = open_cache(
+            config.EMBEDDING_CACHE_PATH if config.EMBEDDING_CACHE_ENABLED else None,
+            config.EMBEDDING_CACHE_MAX_ENTRIES
+        )
+        self.answer_cache = AnswerCache(
+            config.ANSWER_CACHE_THRESHOLD, config.ANSWER_CACHE_TTL, config.ANSWER_CACHE_MAX_ENTRIES
+        ) if config.ANSWER_CACHE_ENABLED else None
+        self.startup_timings['engine_init'] = time.perf_counter() - start
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self._api_key:
+                raise ValueError("OPENAI_API_KEY not found in environment")
+            start = time.perf_counter()
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self._api_key)
+            self.startup_timings['client_init'] = time.perf_counter() - start
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def last_generation_stats(self) -> Optional[Dict]:
+        return getattr(self._request_stats, 'generation', None)
+
+    @last_generation_stats.setter
+    def last_generation_stats(self, stats: Optional[Dict]):
+        self._request_stats.generation = stats
+
+    @property
+    def last_context_stats(self) -> Optional[Dict]:
+        return getattr(self._request_stats, 'context', None)
+
+    @last_context_stats.setter
+    def last_context_stats(self, stats: Optional[Dict]):
+        self._request_stats.context = stats
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            start = time.perf_counter()
+            import tiktoken
+            self._tokenizer = tiktoken.encoding_for_model("gpt-4")
+            self.startup_timings['tokenizer_load'] = time.perf_counter() - start
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    @property
+    def index(self) -> Optional[faiss.Index]:
+        return self._index
+
+    @index.setter
+    def index(self, index: Optional[faiss.Index]):
+        self._index = index
+        self._index_mmapped = False
+
+    @property
+    def metadata(self) -> Optional[List[Dict]]:
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata: Optional[List[Dict]]):
+        self._metadata = metadata
+        self._id_positions = None
+        self._lexical_index = None
+        self._filter_index = None
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        if self._lexical_index is None:
+            if self._saved_lexical is not None and self._saved_lexical[0] is self._metadata:
+                self._lexical_index = self._saved_lexical[1]
+            else:
+                self._lexical_index = self._build_lexical_index(self._metadata)
+        return self._lexical_index
+
+    @staticmethod
+    def _build_lexical_index(metadata: List[Dict]) -> LexicalIndex:
+        return LexicalIndex.build(
+            [chunk['chunk_id'] for chunk in metadata],
+            [chunk['text'] for chunk in metadata]
+        )
+
+    @property
+    def filter_index(self) -> FilterIndex:
+        if self._filter_index is None:
+            if self._saved_filter is not None and self._saved_filter[0] is self._metadata:
+                self._filter_index = self._saved_filter[1]
+            else:
+                self._filter_index = self._build_filter_index(self._metadata)
+        return self._filter_index
+
+    @staticmethod
+    def _build_filter_index(metadata: List[Dict]) -> FilterIndex:
+        chunk_ids, sources, tags = [], [], []
+        for chunk in metadata:
+            chunk_ids.append(chunk['chunk_id'])
+            sources.append(chunk_sources(chunk))
+            tags.append(chunk.get('tags', ()))
+        return FilterIndex.build(chunk_ids, sources, tags)
+
+    def sources(self) -> List[str]:
+        return self.filter_index.keys("source") if self._metadata is not None else []
+
+    def _chunk_for_id(self, chunk_id: int) -> Optional[Dict]:
+        if isinstance(self._metadata, MetadataStore):
+            return self._metadata.get_by_id(int(chunk_id))
+
+        if self._id_positions is None:
+            self._id_positions = {
+                chunk['chunk_id']: position
+                for position, chunk in enumerate(self._metadata)
+            }
+        position = self._id_positions.get(int(chunk_id))
+        return None if position is None else self._metadata[position].copy()
 
     def count_tokens(self, text: str) -> int:
         return len(self.tokenizer.encode(text))
 
-    def chunk_documents(self, documents: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    def chunk_documents(self, documents: List[Dict[str, str]], start_id: int = 0) -> List[Dict[str, str]]:
         chunks = []
-        chunk_id = 0
+        chunk_id = start_id
 
-        for doc in documents:
-            text = doc['content']
-            source = doc['filename']
-
-            tokens = self.tokenizer.encode(text)
-            total_tokens = len(tokens)
-
-            start = 0
-            while start < total_tokens:
-                end = min(start + config.CHUNK_SIZE, total_tokens)
-                chunk_tokens = tokens[start:end]
-                chunk_text = self.tokenizer.decode(chunk_tokens)
-
-                chunks.append({
+        with telemetry.span("chunk", documents=len(documents)):
+            pieces = chunk_texts(self.tokenizer, [doc['content'] for doc in documents])
+        for doc, doc_pieces in zip(documents, pieces):
+            for chunk_text, token_count in doc_pieces:
+                chunk = {
                     'text': chunk_text,
-                    'source': source,
+                    'source': doc['filename'],
                     'chunk_id': chunk_id,
-                    'token_count': len(chunk_tokens)
-                })
-
+                    'token_count': token_count
+                }
+                if doc.get('tags'):
+                    chunk['tags'] = doc['tags']
+                chunks.append(chunk)
                 chunk_id += 1
-                start += config.CHUNK_SIZE - config.CHUNK_OVERLAP
 
         return chunks
 
-    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
-        embeddings = []
-        batch_size = 100
-
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            response = self.client.embeddings.create(
-                model=config.EMBEDDING_MODEL,
-                input=batch
-            )
-            batch_embeddings = [item.embedding for item in response.data]
-            embeddings.extend(batch_embeddings)
-
-        return np.array(embeddings, dtype=np.float32)
-
-    def create_index(self, chunks: List[Dict[str, str]]) -> Tuple[faiss.Index, List[Dict]]:
+    def deduplicate(self, chunks: List[Dict[str, str]], dedup: Optional[Deduplicator] = None,
+                    existing: Optional[Dict[int, Dict]] = None) -> List[Dict[str, str]]:
+        """Collapse repeated chunks before they are embedded (see dedup.py).
+
+        Kept chunks list the sources of their duplicates under 'sources'; chunks in
+        `existing` (chunk_id -> metadata) can absorb new duplicates too.
+        """
+        if not config.DEDUP_ENABLED:
+            return chunks
+        dedup = dedup if dedup is not None else Deduplicator()
+        with telemetry.span("dedup", chunks=len(chunks)) as span:
+            kept, report = collapse_duplicates(chunks, dedup, existing)
+            span.set(duplicates=report['duplicate_chunks'])
+        telemetry.increment("dedup_removed_chunks", report['duplicate_chunks'])
+        self.last_dedup_report = report
+        self._pending_dedup = dedup
+        return kept
+
+    @property
+    def embedding_scheduler(self) -> EmbeddingScheduler:
+        if self._embedding_scheduler is None or self._embedding_scheduler_client is not self.client:
+            self._embedding_scheduler = EmbeddingScheduler(self.client, self.count_tokens)
+            self._embedding_scheduler_client = self.client
+        return self._embedding_scheduler
+
+    @property
+    def embedding_provider(self) -> EmbeddingProvider:
+        if self._embedding_provider is None:
+            start = time.perf_counter()
+            self._embedding_provider = get_provider(scheduler=lambda: self.embedding_scheduler)
+            self.startup_timings['embedding_provider_init'] = time.perf_counter() - start
+        return self._embedding_provider
+
+    @embedding_provider.setter
+    def embedding_provider(self, provider: EmbeddingProvider):
+        self._embedding_provider = provider
+
+    def generate_embeddings(self, texts: List[str], token_counts: Optional[List[int]] = None) -> np.ndarray:
+        with telemetry.span("embed", texts=len(texts)) as span:
+            embeddings = self._generate_embeddings(texts, token_counts, span)
+        return embeddings
+
+    def _generate_embeddings(self, texts: List[str], token_counts: Optional[List[int]], span) -> np.ndarray:
+        provider = self.embedding_provider
+        span.set(provider=provider.name)
+        if self.embedding_cache is None or not provider.cacheable:
+            return provider.embed(texts, token_counts)
+
+        embeddings = np.empty((len(texts), provider.dimension), dtype=np.float32)
+        cached = self.embedding_cache.get_many(provider.cache_namespace, texts)
+        for i, vector in cached.items():
+            embeddings[i] = vector
+
+        missing = [i for i in range(len(texts)) if i not in cached]
+        span.set(cache_hits=len(cached))
+        if missing:
+            # Embed each distinct text once, even if it appears several times.
+            first_seen = {}
+            for i in missing:
+                first_seen.setdefault(texts[i], i)
+            unique_texts = list(first_seen)
+            unique_counts = None if token_counts is None else [token_counts[i] for i in first_seen.values()]
+
+            # Every finished batch is written to the cache straight away, so a
+            # crashed build resumes from the last completed batch.
+            def checkpoint(batch: List[int], vectors: np.ndarray):
+                self.embedding_cache.put_many(
+                    provider.cache_namespace, [unique_texts[i] for i in batch], vectors
+                )
+
+            fresh = provider.embed(unique_texts, unique_counts, on_batch=checkpoint)
+
+            positions = {text: row for row, text in enumerate(unique_texts)}
+            for i in missing:
+                embeddings[i] = fresh[positions[texts[i]]]
+
+        return embeddings
+
+    def _embed_chunks(self, chunks: List[Dict[str, str]]) -> Tuple[np.ndarray, np.ndarray]:
         texts = [chunk['text'] for chunk in chunks]
-        embeddings = self.generate_embeddings(texts)
+        token_counts = [chunk['token_count'] for chunk in chunks] if all('token_count' in chunk for chunk in chunks) else None
+        embeddings = self.generate_embeddings(texts, token_counts)
 
-        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        ids = np.array([chunk['chunk_id'] for chunk in chunks], dtype=np.int64)
 
-        index = faiss.IndexFlatIP(config.EMBEDDING_DIMENSION)
-        index.add(embeddings)
+        return embeddings, ids
 
-        metadata = [
+    @staticmethod
+    def _chunk_metadata(chunks: List[Dict[str, str]]) -> List[Dict]:
+        # Tags and duplicate sources are not core fields, so the metadata store keeps them with the chunk's extras.
+        return [
             {
-                'text': chunk['text'],
-                'source': chunk['source'],
-                'chunk_id': chunk['chunk_id']
+                key: chunk[key] for key in ('text', 'source', 'chunk_id', 'tags', 'sources') if key in chunk
             }
             for chunk in chunks
         ]
 
-        return index, metadata
-
-    def save_index(self, index: faiss.Index, metadata: List[Dict]):
-        config.INDEXES_DIR.mkdir(parents=True, exist_ok=True)
-
-        faiss.write_index(index, str(config.FAISS_INDEX_PATH))
+    def create_index(self, chunks: List[Dict[str, str]]) -> Tuple[faiss.Index, List[Dict]]:
+        chunks = self.deduplicate(chunks)
+        embeddings, ids = self._embed_chunks(chunks)
+        return self._build_faiss_index(embeddings, ids), self._chunk_metadata(chunks)
+
+    def _build_faiss_index(self, embeddings: np.ndarray, ids: np.ndarray) -> faiss.Index:
+        with telemetry.span("index_build", vectors=len(embeddings)):
+            base = build_index(embeddings.shape[1], len(embeddings))
+            train_index(base, embeddings)
+
+            index = id_map(base)
+            add_vectors(index, embeddings, ids)
+
+        if storage_of(index) != "float32":
+            order = np.argsort(ids)
+            self._pending_full_vectors = (index, [(ids[order], embeddings[order])])
+        return index
+
+    def save_index(self, index: faiss.Index, metadata: List[Dict], documents: Optional[List[Dict]] = None):
+        with telemetry.span("save_index", chunks=len(metadata)):
+            self._save_index(index, metadata, documents)
+
+    def _save_index(self, index: faiss.Index, metadata: List[Dict], documents: Optional[List[Dict]] = None):
+        self._write_faiss_index(index)
+
+        MetadataStore.write(metadata, self.paths)
+
+        lexical_index = self._build_lexical_index(metadata)
+        lexical_index.save(self.paths.lexical_index)
+        self._saved_lexical = (metadata, lexical_index)
+
+        filter_index = self._build_filter_index(metadata)
+        filter_index.save(self.paths.filter_index)
+        self._saved_filter = (metadata, filter_index)
+
+        self._save_full_vectors(index)
+        self._save_dedup_index(metadata)
+
+        if documents is not None:
+            self._write_manifest({
+                'next_chunk_id': max((chunk['chunk_id'] for chunk in metadata), default=-1) + 1,
+                'documents': self._document_fingerprints(documents)
+            })
+
+    def _write_faiss_index(self, index: faiss.Index):
+        self.paths.index_dir.mkdir(parents=True, exist_ok=True)
+
+        # Replace the file instead of rewriting it: other processes may have it memory-mapped.
+        tmp_path = self.paths.faiss_index.with_name(self.paths.faiss_index.name + ".tmp")
+        write_index_file(index, tmp_path)
+        os.replace(tmp_path, self.paths.faiss_index)
+
+    def _save_dedup_index(self, metadata: List[Dict]):
+        dedup, self._pending_dedup = self._pending_dedup, None
+        if not config.DEDUP_ENABLED:
+            self.paths.dedup_index.unlink(missing_ok=True)
+            return
+        # Indexes built with dedup disabled start from their chunks as they are.
+        if dedup is None or len(dedup) != len(metadata):
+            dedup = Deduplicator.from_chunks(metadata)
+        dedup.save(self.paths.dedup_index)
+
+    def _save_full_vectors(self, index: faiss.Index):
+        pending, self._pending_full_vectors = self._pending_full_vectors, None
+        if storage_of(index) == "float32" or pending is None or pending[0] is not index:
+            # Without vectors matching this index, an old side file would rescore stale rows.
+            FullVectors.remove(self.paths)
+            self._full_vectors = None
+            return
+
+        writer = FullVectorsWriter(self.paths)
+        try:
+            for ids, vectors in pending[1]:
+                writer.append(ids, vectors)
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+        self._full_vectors = FullVectors.open(self.paths, index.d)
+
+    @staticmethod
+    def _document_fingerprints(documents: Iterable[Dict]) -> Dict[str, Dict]:
+        return {
+            doc['filename']: {
+                'mtime': doc['mtime'],
+                'size': doc['size'],
+                'sha256': doc['sha256']
+            }
+            for doc in documents
+        }
 
-        with open(config.METADATA_PATH, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2)
+    def _read_manifest(self) -> Optional[Dict]:
+        if not self.paths.manifest.exists():
+            return None
+        try:
+            with open(self.paths.manifest, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading manifest: {e}")
+            return None
+
+    def _write_manifest(self, manifest: Dict):
+        # Vectors from different providers are not comparable, so the manifest records which one built the index.
+        # Tags are recorded too: retagging a file in DOCUMENT_TAGS_FILE changes its chunks' metadata.
+        manifest = dict(manifest, embedding=self.embedding_provider.describe(),
+                        tags=load_tags(self.paths.documents_dir))
+        with open(self.paths.manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    def rebuild_index(self) -> Dict[str, int]:
+        with telemetry.span("rebuild_index"):
+            return self._rebuild_index()
+
+    def _rebuild_index(self) -> Dict[str, int]:
+        documents = load_documents(self.paths.documents_dir, self.shard)
+        chunks = self.chunk_documents(documents)
+        index, metadata = self.create_index(chunks)
+        self.save_index(index, metadata, documents)
+        self.index = index
+        self.metadata = metadata
+
+        return {
+            'full_rebuild': True,
+            'added_documents': len(documents),
+            'changed_documents': 0,
+            'removed_documents': 0,
+            'added_chunks': len(metadata),
+            'removed_chunks': 0,
+            'duplicate_chunks': len(chunks) - len(metadata),
+            'total_chunks': len(metadata)
+        }
+
+    def update_index(self) -> Dict[str, int]:
+        with telemetry.span("update_index") as span:
+            stats = self._update_index()
+            span.set(full_rebuild=stats['full_rebuild'], added_chunks=stats['added_chunks'],
+                     removed_chunks=stats['removed_chunks'])
+        return stats
+
+    def _update_index(self) -> Dict[str, int]:
+        manifest = self._read_manifest()
+        if manifest is None or (self.index is None and not self.load_index()):
+            return self.rebuild_index()
+        if not is_id_mapped(self.index):
+            # Indexes saved before ID mapping cannot delete vectors in place.
+            return self.rebuild_index()
+        if manifest.get('embedding', LEGACY_EMBEDDING) != self.embedding_provider.describe():
+            return self.rebuild_index()
+        if self._index_mmapped:
+            self._read_faiss_index(mmap=False)
+
+        previous = manifest['documents']
+        current = scan_documents(previous, self.paths.documents_dir, self.shard)
+        previous_tags = manifest.get('tags', {})
+        current_tags = load_tags(self.paths.documents_dir)
+
+        added = [name for name in current if name not in previous]
+        changed = [
+            name for name in current
+            if name in previous and (current[name]['sha256'] != previous[name]['sha256']
+                                     or current_tags.get(name) != previous_tags.get(name))
+        ]
+        removed = [name for name in previous if name not in current]
+
+        stale_sources = set(changed) | set(removed)
+        if stale_sources and not supports_removal(self.index):
+            return self.rebuild_index()
+
+        # A collapsed chunk stays while any of its sources does.
+        kept, stale_ids = [], []
+        for chunk in map(dict, self.metadata):
+            sources = chunk_sources(chunk)
+            live = [source for source in sources if source not in stale_sources]
+            if not live:
+                stale_ids.append(chunk['chunk_id'])
+                continue
+            if len(live) < len(sources):
+                chunk['source'] = live[0]
+                chunk.pop('sources')
+                if len(live) > 1:
+                    chunk['sources'] = live
+            kept.append(chunk)
+        stale_ids = np.array(stale_ids, dtype=np.int64)
+        if len(stale_ids):
+            self.index.remove_ids(stale_ids)
+
+        # Kept rows are copied over; new chunk ids are all above them, so order is preserved.
+        full_vectors = []
+        if self._full_vectors is not None:
+            keep = ~np.isin(self._full_vectors.ids, stale_ids)
+            full_vectors.append((self._full_vectors.ids[keep], self._full_vectors.vectors[keep]))
+
+        documents = [
+            doc for name in added + changed
+            for doc in load_document(self.paths.documents_dir / name, current_tags.get(name))
+        ]
+        new_chunks = self.chunk_documents(documents, start_id=manifest['next_chunk_id'])
+        next_chunk_id = manifest['next_chunk_id'] + len(new_chunks)
+        chunk_count = len(new_chunks)
+        if config.DEDUP_ENABLED:
+            # New chunks repeating a kept one only add their source to it.
+            dedup = Deduplicator.load(self.paths.dedup_index)
+            if dedup is None:
+                dedup = Deduplicator.from_chunks(self.metadata)
+            dedup.remove(stale_ids.tolist())
+            new_chunks = self.deduplicate(new_chunks, dedup, {chunk['chunk_id']: chunk for chunk in kept})
+        if new_chunks:
+            embeddings, ids = self._embed_chunks(new_chunks)
+            add_vectors(self.index, embeddings, ids)
+            full_vectors.append((ids, embeddings))
+        if self._full_vectors is not None:
+            self._pending_full_vectors = (self.index, full_vectors)
+
+        current.update(self._document_fingerprints(documents))
+
+        metadata = kept + self._chunk_metadata(new_chunks)
+        self.save_index(self.index, metadata)
+        self._write_manifest({
+            'next_chunk_id': next_chunk_id,
+            'documents': current
+        })
+        self.metadata = metadata
+
+        return {
+            'full_rebuild': False,
+            'added_documents': len(added),
+            'changed_documents': len(changed),
+            'removed_documents': len(removed),
+            'added_chunks': len(new_chunks),
+            'removed_chunks': len(stale_ids),
+            'duplicate_chunks': chunk_count - len(new_chunks),
+            'total_chunks': len(metadata)
+        }
 
     def load_index(self) -> bool:
-        if not config.FAISS_INDEX_PATH.exists() or not config.METADATA_PATH.exists():
+        if not self.paths.faiss_index.exists():
+            return False
+        if not MetadataStore.exists(self.paths) and not self.paths.metadata.exists():
             return False
 
         try:
-            self.index = faiss.read_index(str(config.FAISS_INDEX_PATH))
-
-            with open(config.METADATA_PATH, 'r', encoding='utf-8') as f:
-                self.metadata = json.load(f)
+            start = time.perf_counter()
+            self._read_faiss_index(config.INDEX_MMAP)
+            self.startup_timings['faiss_load'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if MetadataStore.exists(self.paths):
+                self.metadata = MetadataStore.open(self.paths)
+            else:
+                self.metadata = MetadataStore.migrate_json(self.paths.metadata, self.paths)
+            self.startup_timings['metadata_load'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if self.paths.lexical_index.exists():
+                self._lexical_index = LexicalIndex.load(self.paths.lexical_index)
+            self.startup_timings['lexical_load'] = time.perf_counter() - start
+
+            # Indexes built before metadata filters get theirs on the first filtered query.
+            start = time.perf_counter()
+            if self.paths.filter_index.exists():
+                self._filter_index = FilterIndex.load(self.paths.filter_index)
+            self.startup_timings['filter_load'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            self._full_vectors = None
+            if storage_of(self.index) != "float32":
+                self._full_vectors = FullVectors.open(self.paths, self.index.d)
+                if self._full_vectors is None:
+                    print("No full vectors for this index; results are ranked by its compressed codes only")
+            self.startup_timings['full_vectors_load'] = time.perf_counter() - start
 
             return True
         except Exception as e:
             print(f"Error loading index: {e}")
             return False
 
-    def retrieve_chunks(self, query: str, top_k: int = config.DEFAULT_TOP_K) -> List[Dict]:
+    def _read_faiss_index(self, mmap: bool):
+        path = self.paths.faiss_index
+        if mmap:
+            # Read-only mappings let every worker process share the vectors
+            # through the page cache instead of holding a private copy.
+            flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            flags |= getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+            try:
+                self.index = read_index_file(path, flags)
+                self._index_mmapped = True
+                return
+            except RuntimeError as e:
+                print(f"Memory-mapped index load failed, reading into memory: {e}")
+
+        self.index = read_index_file(path)
+
+    def startup_report(self) -> Dict[str, float]:
+        report = dict(self.startup_timings)
+        report['index_mmapped'] = self._index_mmapped
+        report['index_vectors'] = self.index.ntotal if self.index is not None else 0
+        return report
+
+    def memory_report(self) -> Dict[str, int]:
+        # The serialized size of a FAISS index is close to its size in memory. Memory-mapped
+        # files are counted in full, although only the pages touched by searches are resident.
+        index_bytes = 0
+        if self.index is not None and self.paths.faiss_index.exists():
+            index_bytes = self.paths.faiss_index.stat().st_size
+
+        if isinstance(self._metadata, MetadataStore):
+            metadata_bytes = self._metadata.nbytes
+        else:
+            metadata_bytes = sum(len(chunk['text']) for chunk in self._metadata or ())
+
+        lexical_bytes = self._lexical_index.nbytes if self._lexical_index is not None else 0
+        filter_bytes = self._filter_index.nbytes if self._filter_index is not None else 0
+        return {
+            'index_bytes': index_bytes,
+            'metadata_bytes': metadata_bytes,
+            'lexical_bytes': lexical_bytes,
+            'filter_bytes': filter_bytes,
+            'total_bytes': index_bytes + metadata_bytes + lexical_bytes + filter_bytes,
+            'mmapped': self._index_mmapped,
+            'vector_storage': storage_of(self.index) if self.index is not None else None,
+            # What the vectors alone take as float32, to compare index_bytes with.
+            'float32_vector_bytes': 4 * self.index.ntotal * self.index.d if self.index is not None else 0,
+            # Memory-mapped and read only for rescored candidates, so not part of the total.
+            'rescore_bytes': self._full_vectors.nbytes if self._full_vectors is not None else 0
+        }
+
+    def unload_index(self):
+        if isinstance(self._metadata, MetadataStore):
+            self._metadata.close()
+        self.index = None
+        self.metadata = None
+        self._saved_lexical = None
+        self._saved_filter = None
+        self._full_vectors = None
+
+    def retrieve_chunks(self, query: str, top_k: int = config.DEFAULT_TOP_K,
+                        nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                        mode: str = config.RETRIEVAL_MODE,
+                        chunk_filter: Optional[ChunkFilter] = None) -> List[Dict]:
+        return self.retrieve_chunks_batch([query], top_k, nprobe, ef_search, mode, chunk_filter=chunk_filter)[0]
+
+    def retrieve_chunks_batch(self, queries: List[str], top_k: int = config.DEFAULT_TOP_K,
+                              nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                              mode: str = config.RETRIEVAL_MODE,
+                              query_embeddings: Optional[np.ndarray] = None,
+                              chunk_filter: Optional[ChunkFilter] = None,
+                              corpus: Optional[CorpusStats] = None) -> List[List[Dict]]:
+        """`corpus` gives BM25 the statistics of a larger corpus this index is one shard of."""
         if self.index is None or self.metadata is None:
             raise ValueError("Index not loaded. Please create or load an index first.")
+        if mode not in ("dense", "lexical", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected 'dense', 'lexical' or 'hybrid'")
+        if not queries:
+            return []
+
+        with telemetry.span("retrieve", mode=mode, top_k=top_k, queries=len(queries),
+                            filter=chunk_filter.describe() if chunk_filter else None):
+            return self._retrieve(queries, top_k, nprobe, ef_search, mode, query_embeddings, chunk_filter or None,
+                                  corpus)
+
+    def _retrieve(self, queries: List[str], top_k: int, nprobe: Optional[int], ef_search: Optional[int],
+                  mode: str, query_embeddings: Optional[np.ndarray],
+                  chunk_filter: Optional[ChunkFilter], corpus: Optional[CorpusStats]) -> List[List[Dict]]:
+        allowed_ids = None
+        if chunk_filter is not None:
+            _, allowed_ids = self.filter_index.selector(chunk_filter)
+            if not len(allowed_ids):
+                return [[] for _ in queries]
+
+        # Lexical lookups never touch the embeddings API.
+        if mode == "lexical":
+            with telemetry.span("lexical_search"):
+                return [self._resolve(self._lexical_ranking(query, top_k, allowed_ids, corpus)) for query in queries]
+
+        depth = top_k * config.HYBRID_CANDIDATE_MULTIPLIER if mode == "hybrid" else top_k
+        if query_embeddings is None:
+            query_embeddings = self.generate_embeddings(queries)
+        dense_results = self.search_embeddings(query_embeddings, depth, nprobe, ef_search, chunk_filter)
+        if mode == "dense":
+            return dense_results
+
+        with telemetry.span("lexical_search"):
+            lexical_rankings = [self._lexical_ranking(query, depth, allowed_ids, corpus) for query in queries]
+
+        with telemetry.span("fusion"):
+            return [
+                self._fuse(dense, lexical_ranking, top_k)
+                for dense, lexical_ranking in zip(dense_results, lexical_rankings)
+            ]
+
+    def _fuse(self, dense: List[Dict], lexical_ranking: List[Tuple[int, float]], top_k: int) -> List[Dict]:
+        dense_ranking = [(chunk['chunk_id'], chunk['score']) for chunk in dense]
+        fused = self._resolve(fuse_rankings(dense_ranking, lexical_ranking, top_k))
+
+        dense_scores = dict(dense_ranking)
+        lexical_scores = dict(lexical_ranking)
+        for chunk in fused:
+            chunk['dense_score'] = dense_scores.get(chunk['chunk_id'])
+            chunk['lexical_score'] = lexical_scores.get(chunk['chunk_id'])
+        return fused
+
+    def _lexical_ranking(self, query: str, top_k: int, allowed_ids: Optional[np.ndarray] = None,
+                         corpus: Optional[CorpusStats] = None) -> List[Tuple[int, float]]:
+        chunk_ids, scores = self.lexical_index.search(query, top_k, allowed_ids=allowed_ids, corpus=corpus)
+        return list(zip(chunk_ids.tolist(), scores.tolist()))
+
+    def _resolve(self, ranking: Iterable[Tuple[int, float]]) -> List[Dict]:
+        results = []
+        for chunk_id, score in ranking:
+            chunk = self._chunk_for_id(chunk_id) if chunk_id >= 0 else None
+            if chunk is not None:
+                chunk['score'] = float(score)
+                results.append(chunk)
+        return results
 
-        query_embedding = self.generate_embeddings([query])
-        query_embedding = query_embedding / np.linalg.norm(query_embedding, axis=1, keepdims=True)
+    def search_embeddings(self, query_embeddings: np.ndarray, top_k: int = config.DEFAULT_TOP_K,
+                          nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                          chunk_filter: Optional[ChunkFilter] = None) -> List[List[Dict]]:
+        if self.index is None or self.metadata is None:
+            raise ValueError("Index not loaded. Please create or load an index first.")
 
-        scores, indices = self.index.search(query_embedding, top_k)
+        if query_embeddings.shape[1] != self.index.d:
+            raise ValueError(
+                f"The index holds {self.index.d}-dimensional vectors but the query embeddings have "
+                f"{query_embeddings.shape[1]} dimensions. Rebuild the index after changing EMBEDDING_PROVIDER."
+            )
 
-        results = []
-        for idx, score in zip(indices[0], scores[0]):
-            if idx < len(self.metadata):
-                result = self.metadata[idx].copy()
-                result['score'] = float(score)
-                results.append(result)
+        query_embeddings = query_embeddings / np.maximum(np.linalg.norm(query_embeddings, axis=1, keepdims=True), 1e-12)
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
 
-        return results
+        scores, indices = self._search(query_embeddings, top_k, nprobe, ef_search, chunk_filter)
+        return [
+            self._resolve(zip(row_indices.tolist(), row_scores.tolist()))
+            for row_indices, row_scores in zip(indices, scores)
+        ]
 
-    def generate_answer(self, query: str, chunks: List[Dict]) -> str:
-        context = "\n\n".join([
-            f"[Source: {chunk['source']}]\n{chunk['text']}"
+    def _search(self, query_embeddings: np.ndarray, top_k: int, nprobe: Optional[int],
+                ef_search: Optional[int], chunk_filter: Optional[ChunkFilter] = None,
+                rescore: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        selector, selectivity = None, 1.0
+        if chunk_filter:
+            # Filtering happens inside the FAISS search, so all top_k results match the filter.
+            selector, allowed_ids = self.filter_index.selector(chunk_filter)
+            selectivity = len(allowed_ids) / max(len(self.filter_index), 1)
+
+        # Compressed codes only shortlist candidates; their order comes from the full vectors.
+        rescore = rescore and self._full_vectors is not None
+        depth = rescore_depth(self.index, top_k) if rescore else top_k
+
+        params = make_search_params(self.index, nprobe, ef_search, selector, selectivity)
+        with telemetry.span("faiss_search", queries=len(query_embeddings), top_k=depth,
+                            filtered=selector is not None):
+            scores, indices = search_index(self.index, query_embeddings, depth, params)
+
+        if rescore:
+            with telemetry.span("rescore", queries=len(query_embeddings), candidates=depth):
+                scores, indices = self._full_vectors.rescore(query_embeddings, indices, top_k)
+        return scores, indices
+
+    def evaluate_recall(self, top_k: int = config.DEFAULT_TOP_K, n_queries: int = 100) -> List[Dict[str, float]]:
+        if self.index is None or self.metadata is None:
+            raise ValueError("Index not loaded. Please create or load an index first.")
+
+        if self._full_vectors is not None:
+            ids = self._full_vectors.ids
+            embeddings = np.ascontiguousarray(self._full_vectors.vectors)
+        else:
+            # Served from the embedding cache for any chunk that was indexed through it.
+            embeddings, ids = self._embed_chunks(self.metadata)
+
+        def search(rescore: bool):
+            return lambda queries, k, nprobe, ef_search: self._search(
+                queries, k, nprobe, ef_search, rescore=rescore
+            )[1]
+
+        rows = recall_sweep(self.index, embeddings, ids, top_k, n_queries, search(rescore=True))
+        if self._full_vectors is not None:
+            # Recall of the compressed codes alone, to show what rescoring recovers.
+            first_pass = recall_sweep(self.index, embeddings, ids, top_k, n_queries, search(rescore=False))
+            for row, first_pass_row in zip(rows, first_pass):
+                row['first_pass_recall'] = first_pass_row['recall']
+        return rows
+
+    def index_version(self) -> Optional[str]:
+        # Every build replaces the index file, so its identity changes on rebuilds
+        # and updates, including those made by other processes.
+        try:
+            stat = self.paths.faiss_index.stat()
+        except OSError:
+            return None
+        return f"{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}"
+
+    def lookup_answer(self, query: str, namespace: str = "", embedding: Optional[np.ndarray] = None,
+                      index_version: Optional[str] = None) -> Optional[Dict]:
+        if self.answer_cache is None:
+            return None
+
+        start = time.perf_counter()
+        if embedding is None:
+            embedding = self.generate_embeddings([query])[0]
+        with telemetry.span("answer_cache_lookup"):
+            entry = self.answer_cache.lookup(embedding, namespace, index_version or self.index_version())
+        if entry is None:
+            telemetry.increment("answer_cache_misses")
+            return None
+        telemetry.increment("answer_cache_hits")
+
+        total = time.perf_counter() - start
+        self.last_generation_stats = {
+            'streamed': False,
+            'cached': True,
+            'time_to_first_token': total,
+            'total_time': total
+        }
+        return entry
+
+    def cache_answer(self, query: str, answer: str, chunks: List[Dict], namespace: str = "",
+                     embedding: Optional[np.ndarray] = None, index_version: Optional[str] = None):
+        if self.answer_cache is None or not answer:
+            return
+
+        if embedding is None:
+            # The query was already embedded by lookup_answer, so this is an embedding cache hit.
+            embedding = self.generate_embeddings([query])[0]
+        sources = [
+            {key: chunk[key] for key in ('text', 'source', 'chunk_id', 'score') if key in chunk}
             for chunk in chunks
-        ])
+        ]
+        self.answer_cache.put(embedding, query, answer, sources, namespace, index_version or self.index_version())
+
+    def _answer_messages(self, query: str, chunks: List[Dict]) -> List[Dict[str, str]]:
+        with telemetry.span("context_build", chunks=len(chunks)) as span:
+            context, self.last_context_stats = build_context(chunks, self.tokenizer)
+            span.set(context_tokens=self.last_context_stats['context_tokens'],
+                     tokens_saved=self.last_context_stats['tokens_saved'])
 
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": "You are a helpful assistant. Answer the question based on the provided context. If the context doesn't contain enough information to answer the question, say so."
@@ -146,11 +862,65 @@ class RAGEngine:
             }
         ]
 
-        response = self.client.chat.completions.create(
+    def generate_answer(self, query: str, chunks: List[Dict]) -> str:
+        messages = self._answer_messages(query, chunks)
+        start = time.perf_counter()
+        telemetry.increment("llm_requests", purpose="answer")
+        with telemetry.span("llm_generate", streamed=False):
+            response = self.client.chat.completions.create(
+                model=config.LLM_MODEL,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=500
+            )
+        total = time.perf_counter() - start
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            telemetry.increment("llm_prompt_tokens", usage.prompt_tokens or 0, purpose="answer")
+            telemetry.increment("llm_completion_tokens", usage.completion_tokens or 0, purpose="answer")
+
+        self.last_generation_stats = {
+            'streamed': False,
+            'time_to_first_token': total,
+            'total_time': total
+        }
+        return response.choices[0].message.content
+
+    def generate_answer_stream(self, query: str, chunks: List[Dict]) -> Iterator[str]:
+        messages = self._answer_messages(query, chunks)
+        start = time.perf_counter()
+        first_token = None
+        self.last_generation_stats = None
+
+        telemetry.increment("llm_requests", purpose="answer")
+        stream = self.client.chat.completions.create(
             model=config.LLM_MODEL,
             messages=messages,
             temperature=0.7,
-            max_tokens=500
+            max_tokens=500,
+            stream=True
         )
 
-        return response.choices[0].message.content
+        pieces = []
+        for event in stream:
+            if not event.choices:
+                continue
+            token = event.choices[0].delta.content
+            if token:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                pieces.append(token)
+                yield token
+
+        total = time.perf_counter() - start
+        # The stream is consumed by the caller, so the span is recorded once it is drained.
+        telemetry.record_span("llm_generate", total, streamed=True,
+                              time_to_first_token_ms=round((first_token or total) * 1000, 1))
+        telemetry.increment("llm_prompt_tokens", sum(self.count_tokens(m['content']) for m in messages),
+                            purpose="answer")
+        telemetry.increment("llm_completion_tokens", self.count_tokens("".join(pieces)), purpose="answer")
+        self.last_generation_stats = {
+            'streamed': True,
+            'time_to_first_token': first_token if first_token is not None else total,
+            'total_time': total
+        }
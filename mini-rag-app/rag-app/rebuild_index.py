@@ -1,40 +1,174 @@
+import argparse
+from typing import Optional
+import config
 from rag_engine import RAGEngine
 from document_loader import load_documents
+from ingest import ingest_documents
+from embeddings import EMBEDDING_PROVIDERS
+from index_factory import VECTOR_STORAGES
+from dedup import print_report
 
-print("Loading RAG engine...")
-rag = RAGEngine()
-
-print("Loading documents...")
-documents = load_documents()
-print(f"Loaded {len(documents)} documents:")
-for doc in documents:
-    print(f"  - {doc['filename']}: {len(doc['content'])} characters")
-
-print("\nChunking documents...")
-chunks = rag.chunk_documents(documents)
-print(f"Created {len(chunks)} chunks:")
-chunk_by_source = {}
-for chunk in chunks:
-    source = chunk['source']
-    chunk_by_source[source] = chunk_by_source.get(source, 0) + 1
-for source, count in chunk_by_source.items():
-    print(f"  - {source}: {count} chunks")
-
-print("\nCreating index and generating embeddings...")
-index, metadata = rag.create_index(chunks)
-print(f"Index created with {index.ntotal} vectors")
-
-print("\nSaving index...")
-rag.save_index(index, metadata)
-print("Index saved successfully!")
-
-print("\nVerifying saved index...")
-rag.index = index
-rag.metadata = metadata
-test_query = "What are the vacation policies?"
-results = rag.retrieve_chunks(test_query, top_k=3)
-print(f"\nTest query: '{test_query}'")
-print(f"Retrieved {len(results)} chunks:")
-for i, result in enumerate(results, 1):
-    print(f"\n{i}. Source: {result['source']} (Score: {result['score']:.4f})")
-    print(f"   Text preview: {result['text'][:150]}...")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the FAISS index for the mini RAG app")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only re-embed new or changed documents and drop removed ones"
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="Full rebuild through the streaming pipeline (parallel chunking, bounded memory)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=config.INGEST_WORKERS,
+        help="Chunking processes for --stream"
+    )
+    parser.add_argument(
+        "--recall", action="store_true",
+        help="Report recall@k of the configured index type against an exact flat search"
+    )
+    parser.add_argument(
+        "--embedding-provider", choices=EMBEDDING_PROVIDERS, default=config.EMBEDDING_PROVIDER,
+        help="Embedding backend; hashing and fake run locally without an API key"
+    )
+    parser.add_argument(
+        "--embedding-dimension", type=int, default=config.EMBEDDING_DIMENSION,
+        help="Embedding size; below the model's native size, text-embedding-3 returns shortened embeddings"
+    )
+    parser.add_argument(
+        "--vector-storage", choices=VECTOR_STORAGES, default=config.VECTOR_STORAGE,
+        help="How the index stores vectors; int8 and binary rescore candidates against full vectors"
+    )
+    parser.add_argument(
+        "--collection",
+        help="Build the named collection (documents/<name>/) instead of the default index"
+    )
+    parser.add_argument(
+        "--shards", type=int,
+        help="Number of shards for --collection (default: COLLECTION_SHARDS or 1)"
+    )
+    args = parser.parse_args()
+    config.EMBEDDING_PROVIDER = args.embedding_provider
+    config.EMBEDDING_DIMENSION = args.embedding_dimension
+    config.VECTOR_STORAGE = args.vector_storage
+
+    if args.collection:
+        if args.stream or args.recall:
+            parser.error("--stream and --recall are not supported with --collection")
+        build_collection(args.collection, args.shards, args.incremental)
+        return
+
+    print("Loading RAG engine...")
+    rag = RAGEngine()
+    print(f"Embedding provider: {args.embedding_provider} ({rag.embedding_provider.model}, "
+          f"{rag.embedding_provider.dimension} dimensions)")
+
+    if args.incremental:
+        print("\nUpdating index from changed documents...")
+        stats = rag.update_index()
+        if stats['full_rebuild']:
+            print("No usable manifest found, performed a full rebuild.")
+        print(f"Documents: +{stats['added_documents']} added, "
+              f"~{stats['changed_documents']} changed, -{stats['removed_documents']} removed")
+        print(f"Chunks: +{stats['added_chunks']} added, -{stats['removed_chunks']} removed, "
+              f"{stats['total_chunks']} total")
+        if rag.last_dedup_report is not None:
+            print_report(rag.last_dedup_report)
+        index, metadata = rag.index, rag.metadata
+    elif args.stream:
+        print(f"\nStreaming documents through {args.workers} chunking workers...")
+        stats = ingest_documents(rag, workers=args.workers)
+        print(f"Indexed {stats['embedded']} chunks from {stats['files']} files "
+              f"in {stats['elapsed']:.1f}s ({stats['chunks_per_second']:.0f} chunks/s), "
+              f"{stats['duplicate_chunks']} of {stats['chunks']} chunks collapsed as duplicates")
+        index, metadata = rag.index, rag.metadata
+    else:
+        print("Loading documents...")
+        documents = load_documents()
+        print(f"Loaded {len(documents)} documents:")
+        for doc in documents:
+            print(f"  - {doc['filename']}: {len(doc['content'])} characters")
+
+        print("\nChunking documents...")
+        chunks = rag.chunk_documents(documents)
+        print(f"Created {len(chunks)} chunks:")
+        chunk_by_source = {}
+        for chunk in chunks:
+            source = chunk['source']
+            chunk_by_source[source] = chunk_by_source.get(source, 0) + 1
+        for source, count in chunk_by_source.items():
+            print(f"  - {source}: {count} chunks")
+
+        print("\nCreating index and generating embeddings...")
+        index, metadata = rag.create_index(chunks)
+        if rag.last_dedup_report is not None:
+            print_report(rag.last_dedup_report)
+        print(f"Index created with {index.ntotal} vectors")
+
+        print("\nSaving index...")
+        rag.save_index(index, metadata, documents)
+        print("Index saved successfully!")
+
+    if rag.embedding_cache is not None:
+        stats = rag.embedding_cache.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['entries']}/{stats['max_entries']} entries)")
+
+    print("\nVerifying saved index...")
+    rag.index = index
+    rag.metadata = metadata
+    test_query = "What are the vacation policies?"
+    results = rag.retrieve_chunks(test_query, top_k=3)
+    print(f"\nTest query: '{test_query}'")
+    print(f"Retrieved {len(results)} chunks:")
+    for i, result in enumerate(results, 1):
+        print(f"\n{i}. Source: {result['source']} (Score: {result['score']:.4f})")
+        print(f"   Text preview: {result['text'][:150]}...")
+
+    if args.recall:
+        memory = rag.memory_report()
+        print(f"\nVector storage: {memory['vector_storage']}, {index.d} dimensions")
+        print(f"  index {memory['index_bytes'] / 2 ** 20:.2f} MB vs. "
+              f"{memory['float32_vector_bytes'] / 2 ** 20:.2f} MB of float32 vectors"
+              + (f", {memory['rescore_bytes'] / 2 ** 20:.2f} MB memory-mapped for rescoring"
+                 if memory['rescore_bytes'] else ""))
+
+        print(f"\nRecall@{config.DEFAULT_TOP_K} of '{config.INDEX_TYPE}' index vs. flat float32 baseline:")
+        for row in rag.evaluate_recall(top_k=config.DEFAULT_TOP_K):
+            knobs = ", ".join(f"{key}={row[key]}" for key in ("nprobe", "ef_search") if key in row)
+            first_pass = f" (before rescoring {row['first_pass_recall']:.3f})" if 'first_pass_recall' in row else ""
+            print(f"  {knobs or 'default':<14} recall={row['recall']:.3f}{first_pass}  "
+                  f"{row['index_ms_per_query']:.3f} ms/query (flat {row['flat_ms_per_query']:.3f} ms/query)")
+
+
+def build_collection(name: str, shards: Optional[int], incremental: bool):
+    from collection_manager import CollectionManager
+    manager = CollectionManager()
+
+    if incremental:
+        if shards:
+            config.COLLECTION_SHARDS[name] = shards
+        print(f"Updating collection '{name}' from changed documents...")
+        stats = manager.update(name)
+    else:
+        print(f"Building collection '{name}'...")
+        stats = manager.build(name, shards)
+
+    collection = manager.collection(name)
+    print(f"Chunks: +{stats['added_chunks']} added, -{stats['removed_chunks']} removed, "
+          f"{stats['total_chunks']} total in {stats['shards']} shard(s), "
+          f"{stats['duplicate_chunks']} duplicates collapsed")
+    for shard, report in enumerate(collection.memory_report()['shards']):
+        print(f"  shard {shard}: {report['total_bytes'] / 2 ** 20:.1f} MB")
+
+    test_query = "What are the vacation policies?"
+    results = collection.retrieve_chunks(test_query, top_k=3)
+    print(f"\nTest query: '{test_query}'")
+    for i, result in enumerate(results, 1):
+        print(f"{i}. Source: {result['source']} (shard {result['shard']}, score: {result['score']:.4f})")
+    manager.close()
+
+
+# The guard keeps spawned chunking workers (--stream) from re-running the build.
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
-from typing import List, Dict
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List, Dict, Optional
 from openai import OpenAI
 import config
+from lexical import bm25_scores
+from telemetry import telemetry
+
+MAX_RELEVANCE_SCORE = 10
+SCORE_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+def _parse_score(text: str) -> float:
+    match = SCORE_PATTERN.search(text)
+    if match is None:
+        raise ValueError(f"No score in model response: {text!r}")
+    return max(0, min(MAX_RELEVANCE_SCORE, float(match.group())))
 
-def rerank_chunks(client: OpenAI, query: str, chunks: List[Dict], top_k: int = config.RERANK_TOP_K) -> List[Dict]:
-    scored_chunks = []
 
-    for chunk in chunks:
-        prompt = f"""Rate the relevance of this text chunk to the question on a scale from 0 (completely irrelevant) to 10 (perfectly relevant).
+def _score_chunk(client: OpenAI, query: str, chunk: Dict, timeout: float) -> float:
+    prompt = f"""Rate the relevance of this text chunk to the question on a scale from 0 (completely irrelevant) to 10 (perfectly relevant).
 
 Question: {query}
 
@@ -14,27 +28,87 @@ Text: {chunk['text']}
 
 Provide only a single number from 0 to 10 as your response."""
 
+    telemetry.increment("llm_requests", purpose="rerank")
+    with telemetry.span("rerank_call"):
+        response = client.chat.completions.create(
+            model=config.LLM_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a relevance scoring assistant. Respond with only a number from 0 to 10."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            max_tokens=10,
+            timeout=timeout
+        )
+    _count_usage(response, "rerank")
+
+    return _parse_score(response.choices[0].message.content)
+
+
+def _count_usage(response, purpose: str):
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        telemetry.increment("llm_prompt_tokens", usage.prompt_tokens or 0, purpose=purpose)
+        telemetry.increment("llm_completion_tokens", usage.completion_tokens or 0, purpose=purpose)
+
+
+def _top_k_final(scores: Dict[int, float], total: int, top_k: int) -> bool:
+    if len(scores) == total or top_k <= 0:
+        return True
+    if len(scores) < top_k:
+        return False
+    # Pending chunks can at best tie the maximum score, so once the k-th best
+    # finished score is the maximum, the top-k cannot change.
+    kth_best = sorted(scores.values(), reverse=True)[top_k - 1]
+    return kth_best >= MAX_RELEVANCE_SCORE
+
+
+def rerank_chunks(client: OpenAI, query: str, chunks: List[Dict], top_k: int = config.RERANK_TOP_K,
+                  max_concurrency: int = config.RERANK_MAX_CONCURRENCY,
+                  call_timeout: float = config.RERANK_CALL_TIMEOUT,
+                  deadline: Optional[float] = config.RERANK_DEADLINE) -> List[Dict]:
+    scores = {}
+
+    if chunks:
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(chunks))))
+        futures = {
+            executor.submit(telemetry.wrap(_score_chunk), client, query, chunk, call_timeout): i
+            for i, chunk in enumerate(chunks)
+        }
+        pending = set(futures)
+        expires_at = time.monotonic() + deadline if deadline else None
+
         try:
-            response = client.chat.completions.create(
-                model=config.LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a relevance scoring assistant. Respond with only a number from 0 to 10."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                max_tokens=10
-            )
+            while pending:
+                remaining = None if expires_at is None else expires_at - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    print(f"Reranking deadline reached, {len(pending)} chunk(s) keep their vector score")
+                    telemetry.increment("rerank_deadline_skips", len(pending))
+                    break
+
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        scores[futures[future]] = future.result()
+                    except Exception as e:
+                        print(f"Error scoring chunk: {e}")
+                        telemetry.increment("rerank_failures")
 
-            score_text = response.choices[0].message.content.strip()
-            score = float(score_text)
-            score = max(0, min(10, score))
+                if _top_k_final(scores, len(chunks), top_k):
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
 
-        except Exception as e:
-            print(f"Error scoring chunk: {e}")
-            score = chunk.get('score', 0)
+    return _apply_scores(chunks, scores, top_k)
 
+
+def _apply_scores(chunks: List[Dict], scores: Dict[int, float], top_k: int) -> List[Dict]:
+    scored_chunks = []
+    for i, chunk in enumerate(chunks):
         chunk_copy = chunk.copy()
-        chunk_copy['rerank_score'] = score
+        chunk_copy['rerank_score'] = scores.get(i, chunk.get('score', 0))
         chunk_copy['original_score'] = chunk['score']
         scored_chunks.append(chunk_copy)
 
@@ -46,3 +120,94 @@ Provide only a single number from 0 to 10 as your response."""
         chunk['score'] = chunk['rerank_score']
 
     return top_chunks
+
+
+def rerank_listwise(client: OpenAI, query: str, chunks: List[Dict], top_k: int = config.RERANK_TOP_K) -> List[Dict]:
+    passages = "\n\n".join(f"[{i}] {chunk['text']}" for i, chunk in enumerate(chunks))
+    prompt = f"""Rate the relevance of each numbered passage to the question on a scale from 0 (completely irrelevant) to 10 (perfectly relevant).
+
+Question: {query}
+
+Passages:
+{passages}
+
+Respond with a JSON object of the form {{"scores": [s0, s1, ...]}} containing exactly one score per passage, in passage order."""
+
+    scores = {}
+    try:
+        telemetry.increment("llm_requests", purpose="rerank")
+        with telemetry.span("rerank_call", passages=len(chunks)):
+            response = client.chat.completions.create(
+                model=config.LLM_MODEL,
+                messages=[
+                    {"role": "system", "content": "You are a relevance scoring assistant. Respond only with JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0,
+                max_tokens=8 * len(chunks) + 20,
+                response_format={"type": "json_object"},
+                timeout=config.RERANK_CALL_TIMEOUT
+            )
+        _count_usage(response, "rerank")
+        values = json.loads(response.choices[0].message.content)["scores"]
+        if len(values) != len(chunks):
+            print(f"Listwise reranker returned {len(values)} scores for {len(chunks)} chunks")
+        for i, value in enumerate(values[:len(chunks)]):
+            scores[i] = max(0, min(MAX_RELEVANCE_SCORE, float(value)))
+    except Exception as e:
+        print(f"Error scoring chunks: {e}")
+        telemetry.increment("rerank_failures")
+
+    return _apply_scores(chunks, scores, top_k)
+
+
+def rerank_bm25(client: Optional[OpenAI], query: str, chunks: List[Dict], top_k: int = config.RERANK_TOP_K) -> List[Dict]:
+    raw_scores = bm25_scores(query, [chunk['text'] for chunk in chunks])
+    best = max(raw_scores, default=0.0)
+    if best <= 0:
+        return _apply_scores(chunks, {}, top_k)
+
+    # Rescale to the 0-10 range used by the LLM rerankers.
+    scores = {i: MAX_RELEVANCE_SCORE * score / best for i, score in enumerate(raw_scores)}
+    return _apply_scores(chunks, scores, top_k)
+
+
+_cross_encoder = None
+
+
+def rerank_cross_encoder(client: Optional[OpenAI], query: str, chunks: List[Dict], top_k: int = config.RERANK_TOP_K) -> List[Dict]:
+    global _cross_encoder
+    if _cross_encoder is None:
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise ImportError(
+                "The cross_encoder reranker requires sentence-transformers (pip install sentence-transformers)"
+            )
+        _cross_encoder = CrossEncoder(config.CROSS_ENCODER_MODEL, device="cpu")
+
+    logits = _cross_encoder.predict([(query, chunk['text']) for chunk in chunks])
+    scores = {i: float(score) for i, score in enumerate(logits)}
+    return _apply_scores(chunks, scores, top_k)
+
+
+RERANKERS: Dict[str, Callable[..., List[Dict]]] = {
+    "llm": rerank_chunks,
+    "listwise": rerank_listwise,
+    "bm25": rerank_bm25,
+    "cross_encoder": rerank_cross_encoder,
+}
+# Backends that call the LLM; the others run locally and are passed no client.
+LLM_RERANKERS = ("llm", "listwise")
+
+
+def get_reranker(name: str = config.RERANK_BACKEND) -> Callable[..., List[Dict]]:
+    if name not in RERANKERS:
+        raise ValueError(f"Unknown reranker '{name}', expected one of {sorted(RERANKERS)}")
+    rerank = RERANKERS[name]
+
+    def timed_rerank(client: Optional[OpenAI], query: str, chunks: List[Dict], top_k: int = config.RERANK_TOP_K) -> List[Dict]:
+        with telemetry.span("rerank", backend=name, candidates=len(chunks)):
+            return rerank(client, query, chunks, top_k)
+
+    return timed_rerank
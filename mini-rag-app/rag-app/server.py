@@ -0,0 +1,314 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+import config
+from chunk_filter import ChunkFilter
+from telemetry import telemetry
+
+
+class FilterSpec(BaseModel):
+    # Chunks must come from one of `sources`, carry one of `tags` and have a
+    # chunk_id in [start, end); omitted fields do not restrict.
+    sources: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    chunk_range: Optional[Tuple[int, int]] = None
+
+    def to_chunk_filter(self) -> ChunkFilter:
+        return ChunkFilter(self.sources, self.tags, self.chunk_range)
+
+
+class RetrieveRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    top_k: int = Field(config.DEFAULT_TOP_K, ge=1, le=100)
+    mode: str = config.RETRIEVAL_MODE
+    filter: Optional[FilterSpec] = None
+
+
+class BatchRetrieveRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=config.SERVER_MAX_BATCH_QUERIES)
+    top_k: int = Field(config.DEFAULT_TOP_K, ge=1, le=100)
+    mode: str = config.RETRIEVAL_MODE
+    filter: Optional[FilterSpec] = None
+
+
+class AnswerRequest(RetrieveRequest):
+    # Name of a reranker backend (see reranker.RERANKERS), or None to skip reranking.
+    rerank: Optional[str] = None
+
+
+class QueryEmbeddingBatcher:
+    def __init__(self, embed: Callable[[List[str]], np.ndarray],
+                 max_batch: int = config.SERVER_EMBED_MAX_BATCH,
+                 window: float = config.SERVER_EMBED_BATCH_WINDOW):
+        self._embed = embed
+        self.max_batch = max_batch
+        self.window = window
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.queries = 0
+
+    async def embed(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        # Requests arriving within one window share a single embeddings call.
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.queries += len(batch)
+        try:
+            vectors = await run_in_threadpool(self._embed, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'mean_batch_size': self.queries / self.batches if self.batches else 0.0
+        }
+
+
+def _chunk_filter(request) -> Optional[ChunkFilter]:
+    return request.filter.to_chunk_filter() if request.filter is not None else None
+
+
+def _cache_namespace(request: AnswerRequest) -> str:
+    # Same scheme as the Streamlit app, so both share cached answers.
+    if request.rerank:
+        namespace = f"{request.mode}:rerank:{request.rerank}"
+    else:
+        namespace = f"{request.mode}:{request.top_k}"
+    chunk_filter = _chunk_filter(request)
+    if chunk_filter:
+        namespace += f":{chunk_filter.describe()}"
+    return namespace
+
+
+def create_app(engine=None) -> FastAPI:
+    state = {'engine': engine, 'batcher': None, 'started': time.time()}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if state['engine'] is None:
+            from rag_engine import RAGEngine
+            try:
+                rag = RAGEngine()
+            except ValueError as e:
+                print(f"{e}. Serving health checks only.")
+                rag = None
+            else:
+                if not rag.load_index():
+                    print("No index found, run rebuild_index.py first. Serving health checks only.")
+            state['engine'] = rag
+
+        rag = state['engine']
+        if rag is not None:
+            # One client (and HTTP connection pool) and tokenizer per process, built
+            # before the first request rather than during it. Without an API key only
+            # local embeddings, retrieval and reranking are served, so there is no client.
+            if os.getenv('OPENAI_API_KEY'):
+                rag.client
+            rag.tokenizer
+            state['batcher'] = QueryEmbeddingBatcher(rag.generate_embeddings)
+        yield
+
+    app = FastAPI(title="Mini RAG service", lifespan=lifespan)
+
+    def ready_engine():
+        rag = state['engine']
+        if rag is None or rag.index is None or rag.metadata is None:
+            raise HTTPException(status_code=503, detail="Index not loaded")
+        return rag
+
+    def openai_client(rag):
+        try:
+            return rag.client
+        except ValueError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    def check_mode(mode: str):
+        if mode not in ("dense", "lexical", "hybrid"):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown retrieval mode '{mode}', expected 'dense', 'lexical' or 'hybrid'"
+            )
+
+    async def embed_query(query: str, mode: str) -> Optional[np.ndarray]:
+        if mode == "lexical":
+            return None
+        return await state['batcher'].embed(query)
+
+    async def retrieve(rag, query: str, top_k: int, mode: str, embedding: Optional[np.ndarray],
+                       chunk_filter: Optional[ChunkFilter] = None) -> List[Dict]:
+        embeddings = None if embedding is None else embedding[np.newaxis, :]
+        results = await run_in_threadpool(
+            rag.retrieve_chunks_batch, [query], top_k, None, None, mode, embeddings, chunk_filter
+        )
+        return results[0]
+
+    async def answer_chunks(rag, request: AnswerRequest, embedding: Optional[np.ndarray]) -> List[Dict]:
+        chunk_filter = _chunk_filter(request)
+        if not request.rerank:
+            return await retrieve(rag, request.query, request.top_k, request.mode, embedding, chunk_filter)
+
+        from reranker import LLM_RERANKERS, get_reranker
+        try:
+            rerank = get_reranker(request.rerank)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        client = openai_client(rag) if request.rerank in LLM_RERANKERS else None
+        initial = await retrieve(rag, request.query, config.RERANK_INITIAL_K, request.mode, embedding, chunk_filter)
+        return await run_in_threadpool(rerank, client, request.query, initial, config.RERANK_TOP_K)
+
+    @app.get("/health")
+    async def health():
+        rag = state['engine']
+        loaded = rag is not None and rag.index is not None and rag.metadata is not None
+        return {
+            'status': "ok" if loaded else "no_index",
+            'index_loaded': loaded,
+            'vectors': rag.index.ntotal if loaded else 0,
+            'chunks': len(rag.metadata) if loaded else 0,
+            'uptime': time.time() - state['started'],
+            'embedding_batches': state['batcher'].stats() if state['batcher'] else None,
+            'answer_cache': rag.answer_cache.stats() if rag is not None and rag.answer_cache is not None else None
+        }
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        # Prometheus text exposition format.
+        return PlainTextResponse(telemetry.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+    @app.post("/retrieve")
+    async def retrieve_endpoint(request: RetrieveRequest):
+        rag = ready_engine()
+        check_mode(request.mode)
+        embedding = await embed_query(request.query, request.mode)
+        return {'chunks': await retrieve(
+            rag, request.query, request.top_k, request.mode, embedding, _chunk_filter(request)
+        )}
+
+    @app.post("/retrieve/batch")
+    async def retrieve_batch_endpoint(request: BatchRetrieveRequest):
+        rag = ready_engine()
+        check_mode(request.mode)
+        # A batch is already a single embeddings call, so it bypasses the micro-batcher.
+        results = await run_in_threadpool(
+            rag.retrieve_chunks_batch, request.queries, request.top_k, None, None, request.mode, None,
+            _chunk_filter(request)
+        )
+        return {'results': results}
+
+    @app.post("/answer")
+    async def answer_endpoint(request: AnswerRequest):
+        rag = ready_engine()
+        check_mode(request.mode)
+        namespace = _cache_namespace(request)
+        # The answer cache is keyed on query embeddings, so keyword-only requests skip it
+        # rather than make an embedding call.
+        embedding = await embed_query(request.query, request.mode)
+
+        def cached_answer():
+            entry = rag.lookup_answer(request.query, namespace, embedding)
+            return entry, rag.last_generation_stats
+
+        entry = None
+        if embedding is not None:
+            entry, generation = await run_in_threadpool(cached_answer)
+        if entry is not None:
+            return {
+                'answer': entry['answer'],
+                'sources': entry['sources'],
+                'cached': True,
+                'similarity': entry['similarity'],
+                'generation': generation,
+                'context': None
+            }
+
+        # Generation needs the OpenAI client, so a keyless deployment answers 503 up front.
+        openai_client(rag)
+        chunks = await answer_chunks(rag, request, embedding)
+
+        def generate():
+            answer = rag.generate_answer(request.query, chunks)
+            if embedding is not None:
+                rag.cache_answer(request.query, answer, chunks, namespace, embedding)
+            return answer, rag.last_generation_stats, rag.last_context_stats
+
+        answer, generation, context = await run_in_threadpool(generate)
+        return {
+            'answer': answer,
+            'sources': chunks,
+            'cached': False,
+            'similarity': None,
+            'generation': generation,
+            'context': context
+        }
+
+    @app.post("/answer/stream")
+    async def answer_stream_endpoint(request: AnswerRequest):
+        rag = ready_engine()
+        check_mode(request.mode)
+        namespace = _cache_namespace(request)
+        embedding = await embed_query(request.query, request.mode)
+
+        if embedding is not None:
+            entry = await run_in_threadpool(rag.lookup_answer, request.query, namespace, embedding)
+            if entry is not None:
+                return StreamingResponse(iter([entry['answer']]), media_type="text/plain; charset=utf-8")
+
+        openai_client(rag)
+        chunks = await answer_chunks(rag, request, embedding)
+
+        def tokens() -> Iterator[str]:
+            parts = []
+            for token in rag.generate_answer_stream(request.query, chunks):
+                parts.append(token)
+                yield token
+            if embedding is not None:
+                rag.cache_answer(request.query, "".join(parts), chunks, namespace, embedding)
+
+        # Starlette iterates synchronous generators in its thread pool.
+        return StreamingResponse(tokens(), media_type="text/plain; charset=utf-8")
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=config.SERVER_HOST, port=config.SERVER_PORT)
@@ -0,0 +1,258 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import config
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Span:
+    __slots__ = ('name', 'attributes', 'start', 'duration', 'depth', 'handle')
+
+    def __init__(self, name: str, attributes: Dict, depth: int):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration = None
+        self.depth = depth
+        # Exporter-specific state, e.g. the matching OpenTelemetry span.
+        self.handle = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans: List[Span] = []
+        self.counters: Dict[str, float] = {}
+
+    def breakdown(self) -> List[Dict]:
+        return [
+            {
+                'span': span.name,
+                'depth': span.depth,
+                'offset_ms': (span.start - self.start) * 1000,
+                'duration_ms': span.duration * 1000,
+                'attributes': dict(span.attributes)
+            }
+            for span in sorted(self.spans, key=lambda span: span.start)
+        ]
+
+
+class LogExporter:
+    def __init__(self, logger_name: str = "rag.telemetry"):
+        self.logger = logging.getLogger(logger_name)
+
+    def span_started(self, span: Span):
+        pass
+
+    def span_finished(self, span: Span):
+        if self.logger.isEnabledFor(logging.INFO):
+            attributes = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+            self.logger.info("span=%s duration_ms=%.2f %s", span.name, span.duration * 1000, attributes)
+
+
+class OpenTelemetryExporter:
+    def __init__(self, tracer_name: str = "mini-rag"):
+        try:
+            from opentelemetry import context, trace
+        except ImportError:
+            raise ImportError(
+                "The otel telemetry exporter requires opentelemetry-api (pip install opentelemetry-api opentelemetry-sdk)"
+            )
+        self._context = context
+        self._trace = trace
+        self.tracer = trace.get_tracer(tracer_name)
+
+    def span_started(self, span: Span):
+        otel_span = self.tracer.start_span(span.name)
+        # Attaching the span makes spans opened inside it its children.
+        token = self._context.attach(self._trace.set_span_in_context(otel_span))
+        span.handle = (otel_span, token)
+
+    def span_finished(self, span: Span):
+        if span.handle is None:
+            # Recorded after the fact (see Telemetry.record_span).
+            otel_span = self.tracer.start_span(span.name, start_time=time.time_ns() - int(span.duration * 1e9))
+            otel_span.set_attributes(_otel_attributes(span.attributes))
+            otel_span.end()
+            return
+
+        otel_span, token = span.handle
+        otel_span.set_attributes(_otel_attributes(span.attributes))
+        self._context.detach(token)
+        otel_span.end()
+
+
+def _otel_attributes(attributes: Dict) -> Dict:
+    return {
+        key: value if isinstance(value, (bool, int, float, str)) else str(value)
+        for key, value in attributes.items() if value is not None
+    }
+
+
+EXPORTERS = {
+    "log": LogExporter,
+    "otel": OpenTelemetryExporter,
+}
+
+
+class Telemetry:
+    def __init__(self, enabled: bool = True, exporters: Tuple = ()):
+        self.enabled = enabled
+        self.exporters = list(exporters)
+        # The current trace and open spans live in context variables rather than
+        # thread-locals, so work handed to a pool through wrap() reports to them too.
+        self._trace = contextvars.ContextVar("trace", default=None)
+        self._stack = contextvars.ContextVar("span_stack", default=())
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._durations: Dict[str, List] = {}
+
+    @property
+    def current_trace(self) -> Optional[Trace]:
+        return self._trace.get()
+
+    @contextmanager
+    def trace(self, name: str) -> Iterator[Trace]:
+        # Collects every span and counter recorded in this context until the block exits,
+        # including those of pool threads the work was handed to through wrap().
+        trace = Trace(name)
+        previous = self.current_trace
+        self._trace.set(trace)
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - trace.start
+            self._trace.set(previous)
+
+    @staticmethod
+    def wrap(fn: Callable) -> Callable:
+        """`fn`, run in a copy of the caller's context when called from a pool thread.
+
+        Its spans then join the caller's trace and nest under the caller's open span.
+        A context can only be entered by one thread at a time, so wrap each submission.
+        """
+        return functools.partial(contextvars.copy_context().run, fn)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        stack = self._stack.get()
+        span = Span(name, attributes, len(stack))
+        if not self.enabled:
+            yield span
+            return
+
+        for exporter in self.exporters:
+            exporter.span_started(span)
+        self._stack.set(stack + (span,))
+        try:
+            yield span
+        except Exception as e:
+            span.attributes['error'] = e.__class__.__name__
+            raise
+        finally:
+            self._stack.set(stack)
+            span.duration = time.perf_counter() - span.start
+            self._finish(span)
+
+    def record_span(self, name: str, duration: float, **attributes):
+        # For work that cannot be wrapped in a block, such as a generator consumed elsewhere.
+        if not self.enabled:
+            return
+        span = Span(name, attributes, len(self._stack.get()))
+        span.start -= duration
+        span.duration = duration
+        self._finish(span)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            histogram = self._durations.setdefault(span.name, [[0] * len(DURATION_BUCKETS), 0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += span.duration
+            histogram[2] += 1
+
+            # Pool threads can report to the same trace at once.
+            trace = self.current_trace
+            if trace is not None:
+                trace.spans.append(span)
+        for exporter in self.exporters:
+            exporter.span_finished(span)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        if not self.enabled or not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+            trace = self.current_trace
+            if trace is not None:
+                trace.counters[name] = trace.counters.get(name, 0) + value
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            totals = {}
+            for (name, _), value in self._counters.items():
+                totals[name] = totals.get(name, 0) + value
+            return totals
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            durations = sorted(self._durations.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"rag_{name}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+        if durations:
+            lines.append("# TYPE rag_span_duration_seconds histogram")
+        for name, (buckets, total, count) in durations:
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="{bound:g}"}} {bucket_count}')
+            lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+            lines.append(f'rag_span_duration_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'rag_span_duration_seconds_count{{span="{name}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._durations = {}
+
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _from_config() -> Telemetry:
+    exporters = []
+    for name in config.TELEMETRY_EXPORTERS:
+        try:
+            exporters.append(EXPORTERS[name]())
+        except (KeyError, ImportError) as e:
+            print(f"Telemetry exporter '{name}' disabled: {e}")
+    return Telemetry(config.TELEMETRY_ENABLED, exporters)
+
+
+telemetry = _from_config()
@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from answer_cache import AnswerCache
+
+
+class AnswerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = AnswerCache(threshold=0.95, ttl=3600, max_entries=100, search_k=4)
+        self.vector = np.random.default_rng(0).standard_normal(16).astype(np.float32)
+
+    def test_hit_in_every_namespace_beyond_search_k(self):
+        namespaces = [f"dense:{top_k}" for top_k in range(1, 11)]
+        for namespace in namespaces:
+            self.cache.put(self.vector, "q", f"answer for {namespace}", [], namespace)
+
+        for namespace in namespaces:
+            entry = self.cache.lookup(self.vector, namespace)
+            self.assertIsNotNone(entry, namespace)
+            self.assertEqual(entry['answer'], f"answer for {namespace}")
+        self.assertIsNone(self.cache.lookup(self.vector, "lexical:5"))
+
+    def test_eviction_and_version_change(self):
+        cache = AnswerCache(threshold=0.95, ttl=3600, max_entries=2)
+        for namespace in ("a", "b", "c"):
+            cache.put(self.vector, "q", namespace, [], namespace, index_version="v1")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.lookup(self.vector, "a", index_version="v1"))
+        self.assertEqual(cache.lookup(self.vector, "c", index_version="v1")['answer'], "c")
+
+        self.assertIsNone(cache.lookup(self.vector, "c", index_version="v2"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_dissimilar_query_misses(self):
+        self.cache.put(self.vector, "q", "answer", [], "dense:5")
+        self.assertIsNone(self.cache.lookup(-self.vector, "dense:5"))
+
+
+if __name__ == "__main__":
+    unittest.main()
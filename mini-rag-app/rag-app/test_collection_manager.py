@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import config
+from collection_manager import CollectionManager
+from test_server import DOCUMENTS_DIR, TEST_CONFIG, byte_tokenizer
+
+QUERIES = ["How do I reset my password?", "vacation days policy", "neural network training", "remote work"]
+
+
+class ShardedRetrievalTest(unittest.TestCase):
+    """A sharded collection ranks like the same documents in a single index."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._patches = [
+            mock.patch.multiple(config, **TEST_CONFIG, DEDUP_ENABLED=False, COLLECTION_SHARDS={"sharded": 3}),
+            mock.patch("tiktoken.encoding_for_model", return_value=byte_tokenizer()),
+        ]
+        for patch in cls._patches:
+            patch.start()
+        cls._tmp = tempfile.TemporaryDirectory()
+        root = Path(cls._tmp.name)
+
+        # One file per paragraph, so the shards split the corpus finely.
+        paragraphs = [
+            paragraph
+            for path in sorted(DOCUMENTS_DIR.glob("*.txt"))
+            for paragraph in path.read_text(encoding="utf-8").split("\n\n")
+            if len(paragraph.split()) >= 5
+        ]
+        for name in ("single", "sharded"):
+            (root / "docs" / name).mkdir(parents=True)
+            for i, paragraph in enumerate(paragraphs):
+                (root / "docs" / name / f"{i:03d}.txt").write_text(paragraph, encoding="utf-8")
+
+        manager = CollectionManager(root / "docs", root / "collections")
+        manager.build("single")
+        manager.build("sharded")
+        cls.single = manager.load("single")
+        cls.sharded = manager.load("sharded")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+        for patch in reversed(cls._patches):
+            patch.stop()
+
+    def assertSameRanking(self, mode: str):
+        for query in QUERIES:
+            expected = [(chunk['source'], round(chunk['score'], 5)) for chunk in self.single.retrieve_chunks(query, 5, mode=mode)]
+            actual = [(chunk['source'], round(chunk['score'], 5)) for chunk in self.sharded.retrieve_chunks(query, 5, mode=mode)]
+            self.assertEqual(actual, expected, f"{mode}: {query}")
+
+    def test_shards(self):
+        self.assertEqual(len(self.sharded.engines), 3)
+
+    def test_dense(self):
+        self.assertSameRanking("dense")
+
+    def test_lexical(self):
+        self.assertSameRanking("lexical")
+
+    def test_hybrid(self):
+        for fusion in ("rrf", "weighted"):
+            with mock.patch.object(config, 'HYBRID_FUSION', fusion):
+                self.assertSameRanking("hybrid")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import tiktoken
+from fastapi.testclient import TestClient
+
+import config
+from rag_engine import RAGEngine
+from server import QueryEmbeddingBatcher, create_app
+
+DOCUMENTS_DIR = Path(__file__).parent / "documents"
+
+# Local embeddings and no API key or network: the OpenAI client is always the fake below.
+TEST_CONFIG = {
+    'EMBEDDING_PROVIDER': "hashing",
+    'EMBEDDING_DIMENSION': 64,
+    'EMBEDDING_CACHE_ENABLED': False,
+    'ANSWER_CACHE_ENABLED': True,
+}
+
+
+def byte_tokenizer() -> tiktoken.Encoding:
+    """A byte-level encoding, so tests do not download the gpt-4 one."""
+    return tiktoken.Encoding(
+        name="test-bytes",
+        pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+
+
+class FakeChatCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        words = ["Take", "the", "vacation."]
+        if stream:
+            return iter([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+                for word in words
+            ])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=" ".join(words)))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=3),
+        )
+
+
+class FakeClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=FakeChatCompletions())
+
+
+class ServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._patches = [
+            mock.patch.multiple(config, **TEST_CONFIG),
+            mock.patch.dict(os.environ, {'OPENAI_API_KEY': ""}),
+        ]
+        for patch in cls._patches:
+            patch.start()
+        cls._tmp = tempfile.TemporaryDirectory()
+
+        cls.rag = RAGEngine(index_dir=cls._tmp.name, documents_dir=DOCUMENTS_DIR)
+        cls.rag.tokenizer = byte_tokenizer()
+        cls.rag.rebuild_index()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+        for patch in reversed(cls._patches):
+            patch.stop()
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.rag.client = self.client
+        self.rag.answer_cache.clear()
+
+    def test_health(self):
+        with TestClient(create_app(self.rag)) as client:
+            health = client.get("/health").json()
+        self.assertEqual(health['status'], "ok")
+        self.assertEqual(health['chunks'], len(self.rag.metadata))
+        self.assertEqual(health['answer_cache']['entries'], 0)
+
+    def test_retrieve(self):
+        with TestClient(create_app(self.rag)) as client:
+            chunks = client.post("/retrieve", json={"query": "vacation days", "top_k": 3}).json()['chunks']
+            self.assertEqual(len(chunks), 3)
+
+            response = client.post("/retrieve", json={
+                "query": "vacation days", "top_k": 3, "mode": "hybrid",
+                "filter": {"sources": ["product_faq.txt"]},
+            })
+            self.assertEqual({chunk['source'] for chunk in response.json()['chunks']}, {"product_faq.txt"})
+
+            response = client.post("/retrieve", json={"query": "vacation", "mode": "semantic"})
+            self.assertEqual(response.status_code, 400)
+
+    def test_retrieve_batch(self):
+        with TestClient(create_app(self.rag)) as client:
+            response = client.post("/retrieve/batch", json={
+                "queries": ["vacation days", "remote work"], "top_k": 2, "mode": "lexical",
+                "filter": {"sources": ["company_handbook.txt"]},
+            })
+        results = response.json()['results']
+        self.assertEqual(len(results), 2)
+        for chunks in results:
+            self.assertTrue(chunks)
+            self.assertEqual({chunk['source'] for chunk in chunks}, {"company_handbook.txt"})
+
+    def test_answer_cache_miss_then_hit(self):
+        with TestClient(create_app(self.rag)) as client:
+            first = client.post("/answer", json={"query": "How many vacation days do I get?"}).json()
+            second = client.post("/answer", json={"query": "How many vacation days do I get?"}).json()
+
+        self.assertFalse(first['cached'])
+        self.assertEqual(first['answer'], "Take the vacation.")
+        self.assertTrue(first['sources'])
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['answer'], first['answer'])
+        self.assertEqual(self.client.chat.completions.calls, 1)
+
+    def test_answer_stream(self):
+        with TestClient(create_app(self.rag)) as client:
+            response = client.post("/answer/stream", json={"query": "How do I reset my password?", "rerank": "bm25"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "Take the vacation. ")
+
+    def test_unknown_reranker(self):
+        with TestClient(create_app(self.rag)) as client:
+            response = client.post("/answer", json={"query": "vacation", "rerank": "nope"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.chat.completions.calls, 0)
+
+    def test_keyless_deployment(self):
+        self.rag.client = None
+        with TestClient(create_app(self.rag)) as client:
+            self.assertEqual(client.post("/retrieve", json={"query": "vacation"}).status_code, 200)
+            self.assertEqual(client.post("/answer", json={"query": "vacation", "rerank": "bm25"}).status_code, 503)
+
+        # The default openai provider cannot start without a key; health checks are still served.
+        with mock.patch.object(config, 'EMBEDDING_PROVIDER', "openai"):
+            with TestClient(create_app()) as client:
+                self.assertEqual(client.get("/health").json()['status'], "no_index")
+                self.assertEqual(client.post("/retrieve", json={"query": "vacation"}).status_code, 503)
+
+
+class QueryEmbeddingBatcherTest(unittest.TestCase):
+    def test_concurrent_queries_share_one_call(self):
+        calls = []
+
+        def embed(texts):
+            calls.append(list(texts))
+            return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+        async def run():
+            batcher = QueryEmbeddingBatcher(embed, max_batch=32, window=0.05)
+            queries = [f"question {'x' * i}" for i in range(10)]
+            vectors = await asyncio.gather(*(batcher.embed(query) for query in queries))
+            return batcher, queries, vectors
+
+        batcher, queries, vectors = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(calls[0]), sorted(queries))
+        self.assertEqual([float(vector[0]) for vector in vectors], [float(len(query)) for query in queries])
+        self.assertEqual(batcher.stats()['batches'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
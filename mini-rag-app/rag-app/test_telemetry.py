@@ -0,0 +1,52 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from reranker import rerank_chunks
+from telemetry import Telemetry, telemetry
+
+
+class FakeScoringClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="7"))],
+            usage=SimpleNamespace(prompt_tokens=20, completion_tokens=1),
+        )
+
+
+class TraceTest(unittest.TestCase):
+    def test_span_from_pool_thread_joins_trace(self):
+        tel = Telemetry()
+
+        def work(n):
+            with tel.span("worker", n=n):
+                tel.increment("work_items")
+
+        with tel.trace("query") as trace:
+            with tel.span("parent"), ThreadPoolExecutor(max_workers=2) as executor:
+                for future in [executor.submit(tel.wrap(work), n) for n in range(3)]:
+                    future.result()
+                # Without wrap() the pool thread has no trace to report to.
+                executor.submit(work, 3).result()
+
+        rows = trace.breakdown()
+        self.assertEqual([row['span'] for row in rows], ["parent", "worker", "worker", "worker"])
+        self.assertEqual([row['depth'] for row in rows], [0, 1, 1, 1])
+        self.assertEqual(trace.counters, {"work_items": 3})
+        self.assertIsNone(tel.current_trace)
+
+    def test_rerank_calls_are_traced(self):
+        chunks = [{'text': f"chunk {i}", 'score': 0.5} for i in range(4)]
+        with telemetry.trace("query") as trace:
+            rerank_chunks(FakeScoringClient(), "question", chunks, top_k=2, max_concurrency=4)
+
+        self.assertEqual(sum(row['span'] == "rerank_call" for row in trace.breakdown()), 4)
+        self.assertEqual(trace.counters['llm_requests'], 4)
+        self.assertEqual(trace.counters['llm_prompt_tokens'], 80)
+
+
+if __name__ == "__main__":
+    unittest.main()
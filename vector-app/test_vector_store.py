@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from vector_store import LocalStore
+
+
+def vector(vector_id, values):
+    return {"id": vector_id, "values": values, "metadata": {"text": f"text of {vector_id}"}}
+
+
+class LocalStoreTornWriteTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        store = LocalStore("test", root=self.root)
+        store.create(3)
+        store.upsert([vector("a", [1, 0, 0]), vector("b", [0, 1, 0])])
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _file(self, name):
+        return os.path.join(self.root, "test", name)
+
+    def _tear(self):
+        """Leave what an upsert of "c" killed before writing its id leaves behind."""
+        with open(self._file("metadata.jsonl"), "ab") as f:
+            f.write(b'{"text": "orphan"}\n')
+        with open(self._file("vectors.f32"), "ab") as f:
+            f.write(b"\0" * 6)
+        with open(self._file("ids.txt"), "a", encoding="utf-8") as f:
+            f.write("c")
+
+    def test_query_ignores_torn_rows(self):
+        self._tear()
+        store = LocalStore("test", root=self.root)
+        self.assertEqual(store.stats()["total_vector_count"], 2)
+        self.assertEqual([match.id for match in store.query([0, 1, 0], 5)], ["b", "a"])
+
+    def test_upsert_after_torn_write_stays_aligned(self):
+        self._tear()
+        store = LocalStore("test", root=self.root)
+        store.upsert([vector("c", [0, 0, 1]), vector("d", [1, 1, 0])])
+
+        self.assertEqual(os.path.getsize(self._file("vectors.f32")), 4 * 3 * 4)
+        self.assertEqual(os.path.getsize(self._file("metadata.offsets")), 4 * 8)
+        self.assertEqual(store.stats()["total_vector_count"], 4)
+
+        top = store.query([0, 0, 1], 1)[0]
+        self.assertEqual((top.id, top.metadata), ("c", {"text": "text of c"}))
+        top = store.query([1, 1, 0], 1)[0]
+        self.assertEqual((top.id, top.metadata), ("d", {"text": "text of d"}))
+        self.assertAlmostEqual(top.score, 1.0, places=5)
+
+    def test_upsert_after_torn_first_write(self):
+        store = LocalStore("empty", root=self.root)
+        store.create(3)
+        with open(os.path.join(self.root, "empty", "metadata.jsonl"), "ab") as f:
+            f.write(b'{"text": "orphan"}\n')
+
+        store = LocalStore("empty", root=self.root)
+        store.upsert([vector("a", [1, 0, 0])])
+        self.assertEqual(store.query([1, 0, 0], 1)[0].metadata, {"text": "text of a"})
+
+
+if __name__ == "__main__":
+    unittest.main()
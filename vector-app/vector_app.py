@@ -1,15 +1,42 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import csv
+import sys
+import json
+import math
+import time
+import random
+import hashlib
 import argparse
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
-from openai import OpenAI
+from vector_store import BACKENDS, PineconeStore, make_store
 
 load_dotenv()
 
 INDEX_NAME = "article-embeddings"
 EMBEDDING_DIMENSION = 1536
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BATCH_SIZE = 100
+# Pinecone recommends at most 100 vectors and allows at most 2 MB per upsert request.
+# Batches are bounded by both, measured as JSON, leaving some room for the request envelope.
+UPSERT_BATCH_SIZE = 100
+UPSERT_MAX_BYTES = 1_900_000
+IMPORT_WORKERS = 8
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+# Keeps each text under the embedding model's input limit and each record under
+# Pinecone's 40 KB metadata limit.
+MAX_EMBED_CHARS = 20000
+MAX_METADATA_CHARS = 10000
+PROGRESS_FILE = ".import-progress.json"
+LOCAL_STORE_PATH = ".vector-store"
 
 SAMPLE_ARTICLES = [
     {
@@ -54,90 +81,352 @@ SAMPLE_ARTICLES = [
     },
 ]
 
+DEMO_QUERIES = [
+    "How is AI being used in medicine?",
+    "What are the latest developments in clean energy?",
+    "Tell me about working from home",
+    "What's happening with electric cars?",
+]
 
-class VectorDB:
-    def __init__(self):
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.pc = None
-        self.index = None
 
-    def initialize_pinecone(self):
-        api_key = os.getenv("PINECONE_API_KEY")
-        if not api_key:
-            raise ValueError("PINECONE_API_KEY not found in .env file")
+class OpenAIEmbedder:
+    def __init__(self, model=EMBEDDING_MODEL):
+        self.model = model
+        self.dimension = EMBEDDING_DIMENSION
+        self._client = None
 
-        self.pc = Pinecone(api_key=api_key)
+    def embed(self, texts):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-    def create_index(self):
-        if not self.pc:
-            self.initialize_pinecone()
-
-        existing_indexes = [index.name for index in self.pc.list_indexes()]
-
-        if INDEX_NAME not in existing_indexes:
-            print(f"Creating new index '{INDEX_NAME}'...")
-            self.pc.create_index(
-                name=INDEX_NAME,
-                dimension=EMBEDDING_DIMENSION,
-                metric="cosine",
-                spec=ServerlessSpec(cloud="aws", region="us-east-1"),
-            )
-            print(f"Index '{INDEX_NAME}' created successfully!")
+        response = self._client.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in response.data]
+
+
+class HashingEmbedder:
+    """Local, offline embeddings: signed feature hashing of words and word pairs."""
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION):
+        self.model = "hashing"
+        self.dimension = dimension
+
+    def _embed_one(self, text):
+        words = re.findall(r"\w+", text.lower())
+        vector = [0.0] * self.dimension
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[(value >> 1) % self.dimension] += 1.0 if value & 1 else -1.0
+
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed(self, texts):
+        return [self._embed_one(text) for text in texts]
+
+
+class FakeEmbedder:
+    """Deterministic random unit vectors, for benchmarking without network access."""
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION):
+        self.model = "fake"
+        self.dimension = dimension
+
+    def _embed_one(self, text):
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.dimension)]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed(self, texts):
+        return [self._embed_one(text) for text in texts]
+
+
+EMBEDDERS = {
+    "openai": OpenAIEmbedder,
+    "hashing": HashingEmbedder,
+    "fake": FakeEmbedder,
+}
+
+
+def make_embedder(name, dimension=EMBEDDING_DIMENSION):
+    if name == "openai":
+        return OpenAIEmbedder()
+    return EMBEDDERS[name](dimension)
+
+
+def article_id(title, content):
+    return hashlib.sha256(f"{title}\n{content}".encode("utf-8")).hexdigest()[:32]
+
+
+def iter_articles(path, skip=0):
+    """Stream (position, article) pairs from a JSONL or CSV file, starting at record `skip`.
+
+    Records need a `content` (or `text`) field; `title` and `id` are optional. Without an
+    id, one is derived from the title and content, so re-importing a file overwrites
+    the same vectors.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if extension == ".csv":
+            csv.field_size_limit(sys.maxsize)
+            records = itertools.islice(csv.DictReader(f), skip, None)
+        elif extension in (".jsonl", ".ndjson"):
+            lines = itertools.islice((line for line in f if line.strip()), skip, None)
+            records = (_parse_json_record(line, path) for line in lines)
         else:
-            print(f"Index '{INDEX_NAME}' already exists.")
+            raise ValueError(f"Unsupported file type '{extension}', expected .jsonl or .csv")
+
+        for position, record in enumerate(records, skip):
+            content = (record or {}).get("content") or (record or {}).get("text")
+            if not content:
+                yield position, None
+                continue
+            title = record.get("title") or ""
+            yield position, {
+                "id": str(record.get("id") or article_id(title, content)),
+                "title": title,
+                "content": content,
+            }
+
+
+def _parse_json_record(line, path):
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        print(f"Skipping invalid record in {path}: {e}")
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def _is_retryable(error):
+    """Rate limits, server errors, timeouts and dropped connections; not e.g. auth or bad requests."""
+    # OpenAI errors carry `status_code`, Pinecone's `status`.
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Client libraries define their own timeout and connection error classes.
+    return any("Timeout" in cls.__name__ or "Connection" in cls.__name__ for cls in type(error).__mro__)
+
+
+def _with_retries(call, description, stats=None):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == MAX_RETRIES or not _is_retryable(e):
+                raise
+            # Exponential backoff with jitter, so concurrent workers do not retry in lockstep.
+            delay = random.uniform(0.5, 1.0) * min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            print(f"{description} failed ({e.__class__.__name__}: {e}), retrying in {delay:.1f}s")
+            if stats:
+                stats.add(retries=1)
+            time.sleep(delay)
+
+
+def _upsert_batches(vectors, max_count=UPSERT_BATCH_SIZE, max_bytes=UPSERT_MAX_BYTES):
+    """Split vectors into requests of at most `max_count` records and `max_bytes` of JSON."""
+    batch, size = [], 0
+    for vector in vectors:
+        record_size = len(json.dumps(vector))
+        if batch and (len(batch) == max_count or size + record_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(vector)
+        size += record_size
+    if batch:
+        yield batch
+
+
+class ImportProgress:
+    """Records, per input file, how many records have been imported, so an interrupted import can resume."""
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.files = {}
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def done(self, key):
+        return self.files.get(key, 0)
+
+    def advance(self, key, position):
+        self.files[key] = position
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"index": INDEX_NAME, "files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class ImportStats:
+    def __init__(self):
+        self.articles = 0
+        self.invalid = 0
+        self.resumed_from = 0
+        self.embed_requests = 0
+        self.embed_seconds = 0.0
+        self.upsert_requests = 0
+        self.upsert_seconds = 0.0
+        self.retries = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        lines = [
+            f"Imported {self.articles} articles in {elapsed:.1f}s ({self.articles / elapsed if elapsed else 0:.0f} articles/s)",
+            f"  Embedding: {self.embed_requests} requests, "
+            f"{self.embed_seconds / max(self.embed_requests, 1) * 1000:.0f} ms average",
+            f"  Upserts:   {self.upsert_requests} requests, "
+            f"{self.upsert_seconds / max(self.upsert_requests, 1) * 1000:.0f} ms average",
+            f"  Retries: {self.retries}, records without content: {self.invalid}",
+        ]
+        if self.resumed_from:
+            lines.append(f"  Resumed after {self.resumed_from} previously imported records")
+        return "\n".join(lines)
 
-        self.index = self.pc.Index(INDEX_NAME)
+
+class VectorDB:
+    def __init__(self, embedder=None, store=None):
+        self.embedder = embedder or OpenAIEmbedder()
+        self.store = store or PineconeStore(INDEX_NAME)
+
+    def create_index(self):
+        self.store.create(self.embedder.dimension)
 
     def get_embedding(self, text):
-        response = self.openai_client.embeddings.create(
-            model="text-embedding-ada-002", input=text
+        return self.embedder.embed([text])[0]
+
+    def get_embeddings(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            embeddings.extend(self.embedder.embed(texts[start:start + EMBEDDING_BATCH_SIZE]))
+        return embeddings
+
+    @staticmethod
+    def _to_vector(article, embedding):
+        return {
+            "id": article["id"],
+            "values": embedding,
+            "metadata": {
+                "title": article["title"],
+                "content": article["content"][:MAX_METADATA_CHARS],
+            },
+        }
+
+    def upsert_vectors(self, vectors, stats=None):
+        for batch in _upsert_batches(vectors):
+            began = time.perf_counter()
+            _with_retries(lambda: self.store.upsert(batch), "Upsert", stats)
+            if stats:
+                stats.add(upsert_requests=1, upsert_seconds=time.perf_counter() - began)
+
+    def _import_batch(self, articles, stats):
+        if not articles:
+            return
+        texts = [f"{article['title']}. {article['content']}"[:MAX_EMBED_CHARS] for article in articles]
+        began = time.perf_counter()
+        embeddings = _with_retries(lambda: self.embedder.embed(texts), "Embedding", stats)
+        stats.add(embed_requests=1, embed_seconds=time.perf_counter() - began)
+
+        self.upsert_vectors(
+            [self._to_vector(article, embedding) for article, embedding in zip(articles, embeddings)], stats
         )
-        return response.data[0].embedding
+        stats.add(articles=len(articles))
 
     def insert_articles(self, articles=None):
-        if not self.index:
-            self.create_index()
+        self.create_index()
 
         if articles is None:
             articles = SAMPLE_ARTICLES
 
         print(f"\nInserting {len(articles)} articles into the vector database...")
 
+        texts = [f"{article['title']}. {article['content']}" for article in articles]
+        embeddings = self.get_embeddings(texts)
+
         vectors = []
-        for article in articles:
-            text = f"{article['title']}. {article['content']}"
-            embedding = self.get_embedding(text)
-
-            vectors.append(
-                {
-                    "id": article["id"],
-                    "values": embedding,
-                    "metadata": {
-                        "title": article["title"],
-                        "content": article["content"],
-                    },
-                }
-            )
+        for article, embedding in zip(articles, embeddings):
+            vectors.append(self._to_vector(article, embedding))
             print(f"  - Embedded: {article['title']}")
 
-        self.index.upsert(vectors=vectors)
+        self.upsert_vectors(vectors)
         print(f"\nSuccessfully inserted {len(articles)} articles!")
 
-    def query(self, query_text, top_k=3):
-        if not self.index:
-            self.index = self.pc.Index(INDEX_NAME)
+    def import_articles(self, paths, workers=IMPORT_WORKERS, progress_path=PROGRESS_FILE, resume=True):
+        self.create_index()
+
+        progress = ImportProgress(progress_path, resume)
+        stats = ImportStats()
+        last_report = time.perf_counter()
+
+        # Batches are retired in submission order, so the saved position never passes a
+        # batch that is still in flight. At most 2 batches per worker are held in memory.
+        pending = deque()
+
+        def retire_oldest():
+            key, end, future = pending.popleft()
+            future.result()
+            progress.advance(key, end)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for path in paths:
+                    key = os.path.abspath(path)
+                    skip = progress.done(key)
+                    stats.resumed_from += skip
+                    print(f"Importing {path}" + (f" from record {skip}" if skip else "") + "...")
+
+                    batch, end = [], skip
+                    for position, article in iter_articles(path, skip):
+                        end = position + 1
+                        if article is None:
+                            stats.add(invalid=1)
+                            continue
+
+                        batch.append(article)
+                        if len(batch) == EMBEDDING_BATCH_SIZE:
+                            pending.append((key, end, executor.submit(self._import_batch, batch, stats)))
+                            batch = []
+                            while len(pending) >= 2 * workers:
+                                retire_oldest()
+
+                        if time.perf_counter() - last_report >= 10:
+                            print(f"  {stats.articles} articles imported...")
+                            last_report = time.perf_counter()
+
+                    if batch or end > skip:
+                        pending.append((key, end, executor.submit(self._import_batch, batch, stats)))
+
+                while pending:
+                    retire_oldest()
+            except BaseException:
+                for _, _, future in pending:
+                    future.cancel()
+                print(f"Import stopped. Progress is saved in {progress_path}; rerun the same command to resume.")
+                raise
+
+        print("\n" + stats.summary())
+        return stats
 
+    def query(self, query_text, top_k=3):
         print(f"\nQuerying: '{query_text}'")
         print(f"Finding top {top_k} matches...\n")
 
         query_embedding = self.get_embedding(query_text)
 
-        results = self.index.query(
-            vector=query_embedding, top_k=top_k, include_metadata=True
-        )
+        results = self.store.query(query_embedding, top_k)
 
         print("=" * 80)
-        for i, match in enumerate(results.matches, 1):
+        for i, match in enumerate(results, 1):
             print(f"\nMatch {i} (Score: {match.score:.4f})")
             print(f"Title: {match.metadata['title']}")
             print(f"Content: {match.metadata['content']}")
@@ -146,33 +435,74 @@ class VectorDB:
         return results
 
     def get_stats(self):
-        if not self.index:
-            self.index = self.pc.Index(INDEX_NAME)
-
-        stats = self.index.describe_index_stats()
-        print("\nIndex Statistics:")
-        print(f"  Total vectors: {stats.total_vector_count}")
-        print(f"  Dimension: {stats.dimension}")
+        stats = self.store.stats()
+        print(f"\nIndex Statistics ({self.store.name}):")
+        print(f"  Total vectors: {stats['total_vector_count']}")
+        print(f"  Dimension: {stats['dimension']}")
+
+    def benchmark_queries(self, queries, top_k=3, repeats=5):
+        """Time embedding and store lookups separately, so backends can be compared like for like."""
+        embed_times, store_times = [], []
+        # One untimed query first, so a local index is already loaded.
+        self.store.query(self.get_embedding(queries[0]), top_k)
+        for _ in range(repeats):
+            for query_text in queries:
+                began = time.perf_counter()
+                query_embedding = self.get_embedding(query_text)
+                embedded = time.perf_counter()
+                self.store.query(query_embedding, top_k)
+                embed_times.append(embedded - began)
+                store_times.append(time.perf_counter() - embedded)
+
+        print(f"\nQuery latency over {len(store_times)} queries ({self.store.name} store, {self.embedder.model} embeddings):")
+        for label, times in (("Embedding", embed_times), ("Store", store_times)):
+            times.sort()
+            p50 = times[len(times) // 2] * 1000
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))] * 1000
+            print(f"  {label:<10} p50 {p50:8.2f} ms   p95 {p95:8.2f} ms")
+        return embed_times, store_times
 
     def delete_index(self):
-        if not self.pc:
-            self.initialize_pinecone()
-
-        print(f"Deleting index '{INDEX_NAME}'...")
-        self.pc.delete_index(INDEX_NAME)
-        print(f"Index '{INDEX_NAME}' deleted successfully!")
+        self.store.delete()
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Vector Database CLI with Pinecone and OpenAI"
     )
+    parser.add_argument(
+        "--backend", choices=sorted(BACKENDS), default="pinecone",
+        help="Vector store: Pinecone, or a local on-disk index searched in process"
+    )
+    parser.add_argument(
+        "--store-path", default=LOCAL_STORE_PATH, help="Directory holding local indexes"
+    )
+    parser.add_argument(
+        "--embedder", choices=sorted(EMBEDDERS), default="openai",
+        help="Embedding backend: OpenAI, or local hashing/fake embeddings that need no network access"
+    )
+    parser.add_argument(
+        "--dimension", type=int, default=EMBEDDING_DIMENSION,
+        help="Vector dimension for the hashing and fake embedders"
+    )
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    subparsers.add_parser("init", help="Initialize Pinecone index")
+    subparsers.add_parser("init", help="Initialize the index")
 
     subparsers.add_parser("insert", help="Insert sample articles")
 
+    import_parser = subparsers.add_parser("import", help="Bulk import articles from JSONL or CSV files")
+    import_parser.add_argument("files", nargs="+", help="JSONL or CSV files with title and content fields")
+    import_parser.add_argument(
+        "--workers", type=int, default=IMPORT_WORKERS, help="Concurrent embedding and upsert workers"
+    )
+    import_parser.add_argument(
+        "--progress-file", default=PROGRESS_FILE, help="Where import progress is saved for resuming"
+    )
+    import_parser.add_argument(
+        "--restart", action="store_true", help="Ignore saved progress and import every record again"
+    )
+
     query_parser = subparsers.add_parser("query", help="Query the vector database")
     query_parser.add_argument("text", help="Query text")
     query_parser.add_argument(
@@ -181,6 +511,15 @@ def main():
 
     subparsers.add_parser("stats", help="Show index statistics")
 
+    bench_parser = subparsers.add_parser("bench", help="Measure query latency against the index")
+    bench_parser.add_argument("queries", nargs="*", help="Query texts (defaults to the demo queries)")
+    bench_parser.add_argument(
+        "-k", "--top-k", type=int, default=3, help="Number of results to return"
+    )
+    bench_parser.add_argument(
+        "--repeats", type=int, default=5, help="How many times each query is run"
+    )
+
     subparsers.add_parser("demo", help="Run a demo with fun queries")
 
     subparsers.add_parser("delete", help="Delete the index")
@@ -191,38 +530,35 @@ def main():
         parser.print_help()
         return
 
-    db = VectorDB()
+    db = VectorDB(
+        make_embedder(args.embedder, args.dimension),
+        make_store(args.backend, INDEX_NAME, args.store_path),
+    )
 
     try:
         if args.command == "init":
-            db.initialize_pinecone()
             db.create_index()
 
         elif args.command == "insert":
-            db.initialize_pinecone()
             db.insert_articles()
 
+        elif args.command == "import":
+            db.import_articles(args.files, args.workers, args.progress_file, resume=not args.restart)
+
         elif args.command == "query":
-            db.initialize_pinecone()
             db.query(args.text, args.top_k)
 
         elif args.command == "stats":
-            db.initialize_pinecone()
             db.get_stats()
 
+        elif args.command == "bench":
+            db.benchmark_queries(args.queries or DEMO_QUERIES, args.top_k, args.repeats)
+
         elif args.command == "demo":
-            db.initialize_pinecone()
             db.create_index()
             db.insert_articles()
 
-            demo_queries = [
-                "How is AI being used in medicine?",
-                "What are the latest developments in clean energy?",
-                "Tell me about working from home",
-                "What's happening with electric cars?",
-            ]
-
-            for query_text in demo_queries:
+            for query_text in DEMO_QUERIES:
                 print("\n" + "=" * 80)
                 db.query(query_text, top_k=2)
                 input("\nPress Enter to continue to next query...")
@@ -0,0 +1,287 @@
+import os
+import json
+import shutil
+import threading
+from collections import namedtuple
+
+Match = namedtuple("Match", ["id", "score", "metadata"])
+
+
+class VectorStore:
+    """Where VectorDB keeps its vectors: create, upsert, query, stats and delete.
+
+    Vectors are dicts with `id`, `values` and `metadata`, as accepted by Pinecone's upsert.
+    """
+
+    name = ""
+
+    def create(self, dimension):
+        raise NotImplementedError
+
+    def upsert(self, vectors):
+        raise NotImplementedError
+
+    def query(self, vector, top_k):
+        """Return up to `top_k` Matches, most similar (cosine) first."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return a dict with `total_vector_count` and `dimension`."""
+        raise NotImplementedError
+
+    def delete(self):
+        raise NotImplementedError
+
+
+class PineconeStore(VectorStore):
+    name = "pinecone"
+
+    def __init__(self, index_name, cloud="aws", region="us-east-1"):
+        self.index_name = index_name
+        self.cloud = cloud
+        self.region = region
+        self._client = None
+        self._index = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from pinecone import Pinecone
+
+            api_key = os.getenv("PINECONE_API_KEY")
+            if not api_key:
+                raise ValueError("PINECONE_API_KEY not found in .env file")
+            self._client = Pinecone(api_key=api_key)
+        return self._client
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self.client.Index(self.index_name)
+        return self._index
+
+    def create(self, dimension):
+        from pinecone import ServerlessSpec
+
+        existing_indexes = [index.name for index in self.client.list_indexes()]
+        if self.index_name not in existing_indexes:
+            print(f"Creating new index '{self.index_name}'...")
+            self.client.create_index(
+                name=self.index_name,
+                dimension=dimension,
+                metric="cosine",
+                spec=ServerlessSpec(cloud=self.cloud, region=self.region),
+            )
+            print(f"Index '{self.index_name}' created successfully!")
+        else:
+            print(f"Index '{self.index_name}' already exists.")
+
+    def upsert(self, vectors):
+        self.index.upsert(vectors=vectors)
+
+    def query(self, vector, top_k):
+        results = self.index.query(vector=vector, top_k=top_k, include_metadata=True)
+        return [Match(match.id, match.score, match.metadata) for match in results.matches]
+
+    def stats(self):
+        stats = self.index.describe_index_stats()
+        return {"total_vector_count": stats.total_vector_count, "dimension": stats.dimension}
+
+    def delete(self):
+        print(f"Deleting index '{self.index_name}'...")
+        self.client.delete_index(self.index_name)
+        self._index = None
+        print(f"Index '{self.index_name}' deleted successfully!")
+
+
+class LocalStore(VectorStore):
+    """In-process exact cosine search over vectors persisted in a directory.
+
+    Upserts only append, so each costs time proportional to its own size. The files are:
+    - `vectors.f32`: unit-normalized float32 rows
+    - `metadata.jsonl`: metadata as JSON lines, located through `metadata.offsets`
+    - `ids.txt`: ids, written last, so it defines how many rows are complete
+
+    An interrupted upsert can leave rows beyond ids.txt in the other files; they are
+    truncated before the next upsert appends, so rows stay aligned with the ids. A
+    re-upserted id appends a new row that replaces the old one. Vectors are loaded on
+    the first query; only the metadata of returned matches is read from disk.
+    """
+
+    name = "local"
+
+    def __init__(self, index_name, root=".vector-store"):
+        self.path = os.path.join(root, index_name)
+        self.index_name = index_name
+        self.dimension = None
+        self._loaded = False
+        self._truncated = False
+        self._lock = threading.Lock()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _require(self):
+        if not os.path.exists(self._file("store.json")):
+            raise ValueError(f"Local index '{self.index_name}' not found in {self.path}; run init first")
+        if self.dimension is None:
+            with open(self._file("store.json"), "r", encoding="utf-8") as f:
+                self.dimension = json.load(f)["dimension"]
+
+    def _truncate_to_ids(self):
+        """Drop what an interrupted upsert wrote beyond the last complete id."""
+        import numpy as np
+
+        with open(self._file("ids.txt"), "rb+") as f:
+            data = f.read()
+            # A torn last id line has no newline yet.
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        rows = data[:end].count(b"\n")
+
+        metadata_end = 0
+        if rows:
+            offset = int(np.fromfile(self._file("metadata.offsets"), dtype=np.int64, count=rows)[rows - 1])
+            with open(self._file("metadata.jsonl"), "rb") as f:
+                f.seek(offset)
+                metadata_end = offset + len(f.readline())
+
+        for name, size in (
+            ("vectors.f32", rows * self.dimension * 4),
+            ("metadata.offsets", rows * 8),
+            ("metadata.jsonl", metadata_end),
+        ):
+            if os.path.getsize(self._file(name)) > size:
+                os.truncate(self._file(name), size)
+
+    def _load(self):
+        import numpy as np
+
+        self._require()
+
+        with open(self._file("ids.txt"), "r", encoding="utf-8") as f:
+            ids = f.read().split("\n")[:-1]
+        rows = len(ids)
+
+        # Rows beyond the last complete id belong to an interrupted upsert and are ignored
+        # until the next upsert truncates them.
+        self._vectors = np.fromfile(self._file("vectors.f32"), dtype=np.float32, count=rows * self.dimension)
+        self._vectors = self._vectors.reshape(rows, self.dimension)
+        self._offsets = np.fromfile(self._file("metadata.offsets"), dtype=np.int64, count=rows)
+        self._ids = ids
+
+        # The newest row of each id is the live one.
+        self._rows = {}
+        for row, vector_id in enumerate(ids):
+            self._rows[vector_id] = row
+        self._live = np.zeros(rows, dtype=bool)
+        self._live[list(self._rows.values())] = True
+        self._loaded = True
+
+    def create(self, dimension):
+        if os.path.exists(self._file("store.json")):
+            print(f"Local index '{self.index_name}' already exists in {self.path}.")
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        for name in ("vectors.f32", "metadata.jsonl", "metadata.offsets", "ids.txt"):
+            open(self._file(name), "wb").close()
+        with open(self._file("store.json"), "w", encoding="utf-8") as f:
+            json.dump({"dimension": dimension, "metric": "cosine"}, f)
+        print(f"Local index '{self.index_name}' created in {self.path}")
+
+    def upsert(self, vectors):
+        import numpy as np
+
+        if not vectors:
+            return
+        with self._lock:
+            self._require()
+            values = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+            if values.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Vectors have {values.shape[1]} dimensions but the index holds {self.dimension}"
+                )
+            values /= np.maximum(np.linalg.norm(values, axis=1, keepdims=True), 1e-12)
+
+            ids = [str(vector["id"]) for vector in vectors]
+            if any("\n" in vector_id for vector_id in ids):
+                raise ValueError("Vector ids must not contain newlines")
+
+            if not self._truncated:
+                self._truncate_to_ids()
+                self._truncated = True
+
+            try:
+                lines = [
+                    json.dumps(vector.get("metadata") or {}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    for vector in vectors
+                ]
+                with open(self._file("metadata.jsonl"), "ab") as f:
+                    start = f.tell()
+                    f.write(b"".join(lines))
+                offsets = start + np.cumsum([0] + [len(line) for line in lines[:-1]], dtype=np.int64)
+
+                with open(self._file("vectors.f32"), "ab") as f:
+                    f.write(values.tobytes())
+                with open(self._file("metadata.offsets"), "ab") as f:
+                    f.write(offsets.tobytes())
+                with open(self._file("ids.txt"), "a", encoding="utf-8") as f:
+                    f.write("".join(vector_id + "\n" for vector_id in ids))
+            except BaseException:
+                # Whatever was written is truncated again before the next upsert.
+                self._truncated = False
+                raise
+
+            # Reloaded on the next query, so a bulk import never holds the vectors in memory.
+            self._loaded = False
+
+    def _metadata(self, row):
+        with open(self._file("metadata.jsonl"), "rb") as f:
+            f.seek(int(self._offsets[row]))
+            return json.loads(f.readline())
+
+    def query(self, vector, top_k):
+        import numpy as np
+
+        if not self._loaded:
+            self._load()
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+
+        scores = self._vectors @ query
+        scores[~self._live] = -np.inf
+        top_k = min(top_k, int(self._live.sum()))
+        if top_k <= 0:
+            return []
+        rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [Match(self._ids[row], float(scores[row]), self._metadata(row)) for row in rows]
+
+    def stats(self):
+        if not self._loaded:
+            self._load()
+        return {"total_vector_count": int(self._live.sum()), "dimension": self.dimension}
+
+    def delete(self):
+        print(f"Deleting local index '{self.index_name}'...")
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.dimension = None
+        self._loaded = False
+        self._truncated = False
+        print(f"Local index '{self.index_name}' deleted successfully!")
+
+
+BACKENDS = {
+    "pinecone": PineconeStore,
+    "local": LocalStore,
+}
+
+
+def make_store(backend, index_name, local_path=".vector-store"):
+    if backend == "local":
+        return LocalStore(index_name, local_path)
+    if backend == "pinecone":
+        return PineconeStore(index_name)
+    raise ValueError(f"Unknown vector store backend '{backend}', expected one of {sorted(BACKENDS)}")